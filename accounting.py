@@ -0,0 +1,102 @@
+"""Traffic accounting from the final counters of the removed flows.
+
+The controllers install their flows with OFPFF_SEND_FLOW_REM, so that a
+switch sends the byte and packet counts of every flow that times out or is
+deleted, without any polling. A flow crossing the fabric is installed in
+several switches, so its counts are only taken at one of them: the edge
+where the controller learned its source host, or its destination host for
+the flows that only match their destination. They are added up per pair of
+addresses and per tenant, the vlan of the source host for the Vlans
+controller.
+"""
+
+MAX_FLOWS = 100000  # Pairs of addresses accounted separately
+DEFAULT_TENANT = 'default'  # The tenant of the controllers without tenants
+
+
+def _str(mac):
+    return None if mac is None else str(mac)
+
+
+class Usage(object):
+    """Counts of the removed flows of a pair of hosts or of a tenant."""
+
+    __slots__ = ('packets', 'bytes', 'seconds', 'flows')
+
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+        self.seconds = 0.0  # Lifetime of the flows, up to their removal
+        self.flows = 0
+
+    def add(self, msg):
+        self.packets += msg.packet_count
+        self.bytes += msg.byte_count
+        self.seconds += msg.duration_sec + msg.duration_nsec / 1e9
+        self.flows += 1
+
+    def status(self):
+        return {'packets': self.packets, 'bytes': self.bytes,
+                'seconds': self.seconds, 'flows': self.flows}
+
+
+class FlowAccounting(object):
+    """Usage of the fabric per pair of addresses and per tenant.
+
+    Args:
+        edge_of: Function returning the DPID of the edge where a host
+                 address was learned, or None if unknown
+        tenant_of: Function returning the tenant of a source address, or
+                   None for DEFAULT_TENANT
+        max_flows: The maximum number of pairs accounted separately, the
+                   pairs beyond are only accounted in their tenant
+    """
+
+    def __init__(self, edge_of, tenant_of=None, max_flows=MAX_FLOWS):
+        self.edge_of = edge_of
+        self.tenant_of = tenant_of or (lambda mac: None)
+        self.max_flows = max_flows
+        self.flows = {}  # (dl_src, dl_dst) -> Usage
+        self.tenants = {}  # tenant -> Usage
+        self.overflow = 0  # Removed flows of the pairs beyond max_flows
+
+    def flow_removed(self, dpid, msg):
+        """Accounts a removed flow, if it was removed from its accounting edge.
+
+        Args:
+            dpid: The DPID of the switch
+            msg: The ofp_flow_removed
+        returns:
+            Whether the flow was accounted
+        """
+        (src, dst) = (msg.match.dl_src, msg.match.dl_dst)
+        host = src if src is not None else dst
+        if host is None or host.is_multicast or self.edge_of(host) != dpid:
+            return False
+        tenant = self.tenant_of(src) if src is not None else self.tenant_of(dst)
+        if tenant is None:
+            tenant = DEFAULT_TENANT
+        usage = self.tenants.get(tenant)
+        if usage is None:
+            usage = self.tenants[tenant] = Usage()
+        usage.add(msg)
+        key = (src, dst)
+        usage = self.flows.get(key)
+        if usage is None:
+            if len(self.flows) >= self.max_flows:
+                self.overflow += 1
+                return True
+            usage = self.flows[key] = Usage()
+        usage.add(msg)
+        return True
+
+    def status(self):
+        """Returns the usage per tenant and per pair, largest first."""
+        flows = sorted(self.flows.items(), key=lambda item: -item[1].bytes)
+        return {
+            'tenants': dict((str(tenant), usage.status())
+                            for (tenant, usage) in self.tenants.items()),
+            'flows': [dict(usage.status(), src=_str(src), dst=_str(dst))
+                      for ((src, dst), usage) in flows],
+            'overflow': self.overflow,
+        }
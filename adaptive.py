@@ -1,25 +1,48 @@
+import time
+
 from pox.core import core
-from pox.lib.util import dpid_to_str
+from pox.lib.addresses import EthAddr
+from pox.lib.util import dpid_to_str, str_to_bool
 from pox.openflow.discovery import Discovery
 import pox.openflow.libopenflow_01 as of
 from pox.lib.revent import *
-from clostopo import ClosTopo
+import buffers
+import templates
+from broadcast import BroadcastTrees
+from closdesc import ClosDescription
+from convergence import Convergence
+from linkstate import LinkState, path_table
+from metrics import Metrics
+from offload import Offload
+from fastparse import PacketHeaders
+from accounting import FlowAccounting
+from profiling import profile_handlers
+from snapshot import decode_dpids, decode_macs, encode_macs, snapshot_controller
+from status import serve_status
+from timeouts import TimeoutController
 from pox.lib.recoco import Timer
 
 log = core.getLogger()
 
+# Initial (idle, hard) timeouts of the flows of each class, 0 for none
+TIMEOUTS = {'edge': (3, 10), 'core': (0, 0)}
+
 class Switch(EventMixin):
 
-    def __init__(self):
+    def __init__(self, metrics, linkstate, hosts, timeouts):
         self.connection = None
         self.dpid = None
         self._listener = None
         self.isCore = None
         self.mac_to_port = {}
+        self.all_metrics = metrics
+        self.metrics = None
         self.edgeToCore = {}
+        self.flows = {}  # (src, dst) -> output port of the installed edge flows
+        self.linkstate = linkstate
+        self.hosts = hosts
+        self.timeouts = timeouts
         Timer(3, self._timer_func, recurring=True)
-        self.current_bw = {}
-        self.total_bw = {}
 
     def connect(self, connection, topo):
         """Connect the switch with the controller.
@@ -32,9 +55,11 @@ class Switch(EventMixin):
             self.dpid = connection.dpid
         assert self.dpid == connection.dpid
         self.isCore = topo.isCoreSwitch('s' + str(self.dpid))
+        self.metrics = self.all_metrics.switch(self.dpid)
         self.disconnect()
         self.connection = connection
         self._listeners = self.listenTo(connection)
+        buffers.configure(connection)
 
     def disconnect(self):
         """Disconnect the switch with the controller.
@@ -46,28 +71,29 @@ class Switch(EventMixin):
             self.connection.removeListeners(self._listeners)
             self.connection = None
             self._listeners = None
-            self.total_bw = {}
-            self.current_bw = {}
+            self.timeouts.forget_switch(self.dpid)
+            if not self.isCore:
+                self.linkstate.reset_edge(self.dpid)
 
-    def resend_packet(self, packet_in, out_port):
+    def resend_packet(self, packet_in, *out_ports):
         """
         Instructs the switch to resend a packet that it had sent to us.
         "packet_in" is the ofp_packet_in object the switch had sent to the
-        controller due to a table-miss.
+        controller due to a table-miss. A packet buffered by the switch can
+        only be resent once, so all its ports are given at once.
 
         Args:
             packet_in: the ofp_packet_in object the switch had sent
-            out_port: The port in which the packet will be sent
+            out_ports: The ports in which the packet will be sent
         """
-        msg = of.ofp_packet_out()
-        msg.data = packet_in
-
-        # Add an action to send to the specified port
-        action = of.ofp_action_output(port = out_port)
-        msg.actions.append(action)
+        msg = buffers.packet_out(packet_in, out_ports)
+        if msg is None:
+            log.debug("Cannot resend the truncated packet from port %s", packet_in.in_port)
+            return
 
         # Send message to switch
         self.connection.send(msg)
+        self.metrics.packet_out_to(*out_ports)
 
 
     def act_like_switch(self, packet, packet_in):
@@ -95,14 +121,12 @@ class Switch(EventMixin):
                 #log.debug("Destination MAC: " + str(packet.dst))
                 #log.debug("Out port: " + str(self.mac_to_port[packet.dst]) + "\n")
 
-                """install a permanent flow matching the destination of the packet with the good port"""
-                msg = of.ofp_flow_mod()
-                msg.match = of.ofp_match(dl_dst = packet.dst)
-                msg.idle_timeout = of.OFP_FLOW_PERMANENT
-                msg.hard_timeout = of.OFP_FLOW_PERMANENT
-                action = of.ofp_action_output(port=self.mac_to_port[packet.dst])
-                msg.actions.append(action)
-                self.connection.send(msg)
+                """install a flow matching the destination of the packet with the good port"""
+                (idle, hard, flags) = self.timeouts.install('core', (self.dpid, None, packet.dst))
+                self.connection.send(templates.DST_FLOW.pack(
+                    dl_dst=packet.dst, port=self.mac_to_port[packet.dst],
+                    idle_timeout=idle, hard_timeout=hard, flags=flags))
+                self.metrics.flow_mod += 1
             else:
                 """if the destination is unknow, flood"""
                 self.resend_packet(packet_in, of.OFPP_FLOOD)
@@ -110,6 +134,8 @@ class Switch(EventMixin):
             """if the switch is edge,
             keep the port corresponding to the source MAC address"""
             self.mac_to_port[packet.src] = packet_in.in_port
+            if packet_in.in_port not in self.edgeToCore.values():
+                self.hosts[packet.src] = self.dpid
 
             """if the destination is known"""
             if packet.dst in self.mac_to_port:
@@ -122,27 +148,28 @@ class Switch(EventMixin):
 
                 """install a flow with perfect match that lasts few seconds"""
                 msg = of.ofp_flow_mod() #Push rule in table
-                msg.match = of.ofp_match.from_packet(packet)
-                msg.idle_timeout = 3
-                msg.hard_timeout = 10
+                msg.match = of.ofp_match.from_packet(packet.decode())
+                self.timeouts.apply(msg, 'edge', (self.dpid, packet.src, packet.dst))
                 action = of.ofp_action_output(port=self.mac_to_port[packet.dst])
                 msg.actions.append(action)
                 self.connection.send(msg)
+                self.metrics.flow_mod += 1
+                self.flows[(packet.src, packet.dst)] = self.mac_to_port[packet.dst]
                 """remove the mac_to_port entry used to install the flow"""
                 del self.mac_to_port[packet.dst]
             else:
                 """if the destination is unknown"""
                 """flood"""
-                self.resend_packet(packet_in, of.OFPP_FLOOD)
+                ports = [of.OFPP_FLOOD]
 
                 """if the packet comes from a host"""
                 if packet_in.in_port not in self.edgeToCore.values():
-                    """send the packet to the less loaded core"""
-                    port = min(self.current_bw, key=self.current_bw.get)
-                    self.resend_packet(packet_in, port)
-
-                    #log.debug("PORT MATCH LOL: " + str(port))
-                    #log.debug(self.current_bw)
+                    """send the packet to the core of the less loaded path,
+                    down to the edge of the destination if it is known"""
+                    coreDpid = self.linkstate.best_core(self.dpid, self.hosts.get(packet.dst))
+                    if coreDpid is not None:
+                        ports.append(self.edgeToCore[coreDpid])
+                self.resend_packet(packet_in, *ports)
 
 
     def push_flow(self, packet, packet_in, port, idle_timeout=of.OFP_FLOW_PERMANENT, hard_timeout=of.OFP_FLOW_PERMANENT):
@@ -155,20 +182,22 @@ class Switch(EventMixin):
             idle_timeout: /
             hard_timeout: /
         """
-        self.resend_packet(packet_in, port)
+        if not buffers.is_buffered(packet_in):
+            self.resend_packet(packet_in, port)
         #log.debug("Installing flow...")
         #log.debug("Source MAC: " + str(packet.src))
         #log.debug("Destination MAC: " + str(packet.dst))
         #log.debug("Out port: " + str(port) + "\n")
 
         msg = of.ofp_flow_mod() #Push rule in table
-        msg.match = of.ofp_match.from_packet(packet)
+        msg.match = of.ofp_match.from_packet(packet.decode())
         msg.idle_timeout = idle_timeout
         msg.hard_timeout = hard_timeout
-        msg.buffer_id = packet_in.buffer_id
+        msg.buffer_id = packet_in.buffer_id  # The flow releases the buffered packet
         action = of.ofp_action_output(port=port)
         msg.actions.append(action)
         self.connection.send(msg)
+        self.metrics.flow_mod += 1
 
     def _handle_PacketIn(self, event):
         """
@@ -177,13 +206,28 @@ class Switch(EventMixin):
         Args:
             event: The event
         """
-        packet = event.parsed  # This is the parsed packet data.
-        if not packet.parsed:
+        self.metrics.packet_in += 1
+        packet = PacketHeaders.from_event(event)  # Headers read on access from the packet data.
+        if not packet.valid:
             log.warning("Ignoring incomplete packet")
             return
 
         packet_in = event.ofp  # The actual ofp_packet_in message.
+        start = time.time()
+        self.timeouts.packet_in(self.dpid, packet.src, packet.dst)
         self.act_like_switch(packet, packet_in)
+        self.metrics.observe_packet_in(time.time() - start)
+
+    def _handle_FlowRemoved(self, event):
+        """
+        Handles the removal of a flow installed with OFPFF_SEND_FLOW_REM.
+
+        Args:
+            event: The event
+        """
+        msg = event.ofp
+        self.timeouts.flow_removed(self.dpid, msg)
+        self.flows.pop((msg.match.dl_src, msg.match.dl_dst), None)
 
     def add_edge_to_core(self, port, coreDpid):
         """
@@ -195,6 +239,35 @@ class Switch(EventMixin):
         """
         #log.debug("Edge Switch " + str(self.dpid) + " Learns Vlan translation with core Switch " + str(coreDpid))
         self.edgeToCore[coreDpid] = port
+        self.linkstate.set_available(self.dpid, coreDpid)
+
+    def snapshot_state(self):
+        """
+        Returns the learned state of the switch, for warm restarts.
+        """
+        return {'mac_to_port': encode_macs(self.mac_to_port),
+                'edgeToCore': self.edgeToCore,
+                'flows': [[str(src), str(dst), port]
+                          for ((src, dst), port) in self.flows.items()]}
+
+    def restore_state(self, state):
+        """
+        Restores the state returned by snapshot_state, on ports that still exist.
+
+        Args:
+            state: The state of the switch
+        """
+        ports = self.connection.ports
+        for (mac, port) in decode_macs(state['mac_to_port']).items():
+            if port in ports:
+                self.mac_to_port[mac] = port
+        for (coreDpid, port) in decode_dpids(state['edgeToCore']).items():
+            if port in ports:
+                self.disable_flooding(port)
+                self.add_edge_to_core(port, coreDpid)
+        for (src, dst, port) in state.get('flows', []):
+            if port in ports:
+                self.flows[(EthAddr(src), EthAddr(dst))] = port
 
     def disable_flooding(self, port):
         """
@@ -233,24 +306,37 @@ class Switch(EventMixin):
         """
         handles PortStatus
         """
+        self.metrics.stats_reply += 1
         if not self.isCore:
-            stats = event.stats
-            for portStat in stats:
-                if portStat.port_no in self.edgeToCore.values():
-                    try:
-                        old_bw = self.total_bw[portStat.port_no]
-                    except:
-                        old_bw = 0
-                    self.total_bw[portStat.port_no] = portStat.rx_bytes + portStat.tx_bytes
-                    self.current_bw[portStat.port_no] = (self.total_bw[portStat.port_no] - old_bw)/3
+            """update the load of the uplinks in the global link state"""
+            portToCore = dict((port, dpid) for (dpid, port) in self.edgeToCore.items())
+            stats = [portStat for portStat in event.stats if portStat.port_no in portToCore]
+            if stats:
+                self.linkstate.update_edge(self.dpid,
+                                           [portToCore[portStat.port_no] for portStat in stats],
+                                           [portStat.tx_bytes for portStat in stats],
+                                           [portStat.rx_bytes for portStat in stats],
+                                           time.time())
 
 class Adaptive(object):
-    def __init__(self, nCore=2, nEdge=3, nHosts=3, bw=10):
-        self.topo = ClosTopo(nCore, nEdge, nHosts, bw)
+    def __init__(self, nCore=2, nEdge=3, nHosts=3, bw=10, tune_timeouts=True,
+                 accounting=True):
+        self.topo = ClosDescription(nCore, nEdge, nHosts, bw)
         self.nCore = nCore
         self.nEdge = nEdge
         self.nHost = nEdge * nHosts
         self.switches = {}
+        self.convergence = Convergence(self.topo, self.switches)
+        self.metrics = Metrics()
+        self.timeouts = TimeoutController(TIMEOUTS, adapt=tune_timeouts,
+                                          send_flow_rem=accounting)
+        self.linkstate = LinkState(nCore, nEdge)
+        self.hosts = {}  # MAC address -> DPID of the edge of the host
+        self.accounting = FlowAccounting(
+            lambda mac: self.hosts.get(mac)) if accounting else None
+        self.offload = Offload(workers=1)
+        self.broadcast = BroadcastTrees(self)  # One tree, rooted at the lowest core
+        Timer(3, self._recompute_paths, recurring=True)
         def startup():
             """Start events"""
             core.openflow.addListeners(self)
@@ -264,19 +350,54 @@ class Adaptive(object):
         Args:
             event: The event
         """
+        self.convergence.link_event(event)
+        self.broadcast.link_event(event)
         link = event.link
         switch_1 = self.switches.get(link.dpid1)
         switch_2 = self.switches.get(link.dpid2)
         port_1 = link.port1
         port_2 = link.port2
 
-        """ disable flooding between Edge and Core Switches"""
         if switch_1.isCore and not switch_2.isCore:
-            switch_2.disable_flooding(port_2)
-            switch_2.add_edge_to_core(port_2, switch_1.dpid)
+            (edge, edge_port, core_switch) = (switch_2, port_2, switch_1)
         elif switch_2.isCore and not switch_1.isCore:
-            switch_1.disable_flooding(port_1)
-            switch_1.add_edge_to_core(port_1, switch_2.dpid)
+            (edge, edge_port, core_switch) = (switch_1, port_1, switch_2)
+        else:
+            return
+
+        if event.removed:
+            """stop choosing a core through a link that went down"""
+            self.linkstate.set_available(edge.dpid, core_switch.dpid, False)
+            self._recompute_paths()
+        else:
+            """ disable flooding between Edge and Core Switches"""
+            edge.disable_flooding(edge_port)
+            edge.add_edge_to_core(edge_port, core_switch.dpid)
+
+    def snapshot_state(self):
+        """
+        Returns the host locations and link loads, for warm restarts.
+        """
+        return {'hosts': encode_macs(self.hosts),
+                'load': self.linkstate.load.tolist()}
+
+    def restore_state(self, state):
+        """
+        Restores the state returned by snapshot_state.
+
+        Args:
+            state: The state of the controller
+        """
+        self.hosts.update(decode_macs(state['hosts']))
+        self.linkstate.restore_load(state['load'])
+
+    def _recompute_paths(self):
+        """
+        Recomputes the best core of every pair of edges in the offload pool,
+        from a snapshot of the link state.
+        """
+        self.offload.submit(path_table, self.linkstate.snapshot(),
+                            self.linkstate.set_paths, key='paths')
 
     def _handle_ConnectionUp(self, event):
         """
@@ -290,7 +411,7 @@ class Adaptive(object):
         switch = self.switches.get(event.dpid)
         if switch is None:
             # New switch
-            switch = Switch()
+            switch = Switch(self.metrics, self.linkstate, self.hosts, self.timeouts)
             self.switches[event.dpid] = switch
             switch.connect(event.connection, self.topo)
         else:
@@ -311,6 +432,7 @@ class Adaptive(object):
             return
         else:
             switch.disconnect()
+            self.broadcast.forget_switch(event.dpid)
         #log.debug("switch " + dpid_to_str(event.dpid) + " down")
         # Bonus here
 
@@ -322,16 +444,50 @@ class Adaptive(object):
         Args:
             event: The event
         """
+        switch = self.switches.get(event.dpid)
+        if switch is not None and switch.metrics is not None:
+            switch.metrics.port_status += 1
         if event.added:
             action = "added"
         elif event.deleted:
             action = "removed"
         else:
             action = "modified"
+        log.debug("Port %s on Switch %s has been %s.", event.port, event.dpid, action)
+
+        if switch is not None and switch.isCore is False:
+            """stop choosing a core through an uplink that is down, before
+            discovery times the link out"""
+            cores = [c for (c, port) in switch.edgeToCore.items() if port == event.port]
+            up = not event.deleted and not event.ofp.desc.state & of.OFPPS_LINK_DOWN
+            for coreDpid in cores:
+                self.linkstate.set_available(switch.dpid, coreDpid, up)
+            if cores:
+                self._recompute_paths()
+
+    def _handle_PortStatsReceived(self, event):
+        """
+        Recomputes the paths table once the switch has updated the load from
+        the stats, the previous table is used until then.
 
-        #print "Port %s on Switch %s has been %s." % (event.port, event.dpid, action)
+        Args:
+            event: The event
+        """
+        core.callLater(self._recompute_paths)
+
+    def _handle_FlowRemoved(self, event):
+        """
+        Accounts the final counters of a removed flow.
+
+        Args:
+            event: The event
+        """
+        if self.accounting is not None:
+            self.accounting.flow_removed(event.dpid, event.ofp)
 
-def launch(nCore=2, nEdge=3, nHosts=3, bw=10):
+def launch(nCore=2, nEdge=3, nHosts=3, bw=10, status_port=8080,
+           profile=False, profile_sample=1, snapshot=None, snapshot_interval=10, topo=None,
+           tune_timeouts=True, accounting=True):
     """
     Launch the POX Controller.
 
@@ -340,5 +496,30 @@ def launch(nCore=2, nEdge=3, nHosts=3, bw=10):
         nEdge: The number of edge switch
         nHosts: The number of hosts per edge
         bw: The bandwidth of each link
+        status_port: The port serving the convergence state, 0 to disable
+        profile: Profile the packet-in and stats handlers, writing the
+                 reports to this directory (the current one if no value
+                 or True is given, False or 0 disable it) when
+                 /profile/dump is requested
+        profile_sample: Profile one handler call out of profile_sample
+        snapshot: The file in which the learned state is saved, and from
+                  which it is restored at start
+        snapshot_interval: The time between two snapshots in seconds
+        topo: A topology description written by closdesc.py, which then
+              overrides nCore, nEdge, nHosts and bw
+        tune_timeouts: Tune the timeouts of the edge flows to the packet-in
+                       rate and table occupancy, instead of using 3/10s
+        accounting: Ask for the removal of every flow, and account its final
+                    counters per pair of hosts and per tenant on /accounting
+    returns:
+        The controller, for the shard workers
     """
-    core.registerNew(Adaptive, nCore=int(nCore), nEdge=int(nEdge), nHosts=int(nHosts), bw=int(bw))
+    if topo:
+        (nCore, nEdge, nHosts, bw) = ClosDescription.load(topo).params()
+    adaptive = core.registerNew(Adaptive, nCore=int(nCore), nEdge=int(nEdge), nHosts=int(nHosts), bw=int(bw),
+                                tune_timeouts=str_to_bool(tune_timeouts),
+                                accounting=str_to_bool(accounting))
+    profiler = profile_handlers(Switch, profile, profile_sample)
+    adaptive.status_server = serve_status(adaptive, int(status_port), profiler)
+    snapshot_controller(adaptive, snapshot, snapshot_interval)
+    return adaptive
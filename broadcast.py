@@ -0,0 +1,191 @@
+"""Broadcast distribution trees computed by the controller and installed in
+the switches, so that broadcast frames are replicated by the switches
+instead of being flooded by the controller.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+BROADCAST = EthAddr('ff:ff:ff:ff:ff:ff')
+PRIORITY = of.OFP_DEFAULT_PRIORITY + 10  # Above the learned flows
+
+
+def _dpid(name):
+    return int(name[1:])
+
+
+def tree_rules(uplinks, core_links, host_ports, roots, groups=None):
+    """Returns the broadcast rules of the trees of some sources.
+
+    A broadcast from a host goes to the other hosts of its edge and up to
+    the root core of its source, which sends it down to every other edge,
+    which sends it to its hosts. An edge never sends a broadcast from a
+    core back up, so the trees are loop-free even with one root per source.
+
+    With groups, a broadcast only reaches the hosts of the group of its
+    source: the edges match the broadcasts coming down from a core on
+    their source address, and the ports whose group is unknown get none.
+
+    Args:
+        uplinks: edge dpid -> {core dpid: port of the edge}, for the live links
+        core_links: core dpid -> {port of the core: edge dpid}, for the live links
+        host_ports: edge dpid -> ports of the hosts of the edge
+        roots: (edge dpid, host port) -> root core dpid, for the sources
+               that have one
+        groups: (edge dpid, host port) -> (group, MAC address) of the known
+                hosts, or None if every host receives every broadcast
+    returns:
+        dpid -> {(in_port, dl_src or None): sorted output ports}
+    """
+    def hosts(edge, group, port=None):
+        return [p for p in host_ports.get(edge, ())
+                if p != port and (groups is None or
+                                  groups.get((edge, p), (None,))[0] == group)]
+
+    rules = {}
+    used = {}  # root core dpid -> the sources of its tree
+    for ((edge, port), root) in roots.items():
+        if groups is None:
+            (group, src) = (None, None)
+        elif (edge, port) in groups:
+            (group, src) = groups[(edge, port)]
+        else:
+            continue
+        outs = hosts(edge, group, port)
+        uplink = uplinks.get(edge, {}).get(root)
+        if uplink is not None:
+            outs.append(uplink)
+            used.setdefault(root, []).append((group, src))
+        rules.setdefault(edge, {})[(port, None)] = sorted(outs)
+    for (root, sources) in used.items():
+        down = core_links.get(root, {})
+        for (port, edge) in down.items():
+            rules.setdefault(root, {})[(port, None)] = sorted(p for p in down if p != port)
+            uplink = uplinks.get(edge, {}).get(root)
+            if uplink is not None:
+                for (group, src) in sources:
+                    rules.setdefault(edge, {})[(uplink, src)] = sorted(hosts(edge, group))
+    return rules
+
+
+class BroadcastTrees(object):
+    """Keeps the broadcast trees of a controller installed in its switches.
+
+    The ports are classified from the wiring of the topology description,
+    and the edge-core links are only used once discovered. Nothing is
+    installed before the discovery has converged, so that broadcasts still
+    reach the controller while the fabric is incomplete. The rules are then
+    updated when links change, when the controller calls refresh(), and
+    every interval, e.g. for the roots that depend on learned hosts. Only
+    the rules that changed are sent.
+
+    Args:
+        controller: The Tree, Vlans or Adaptive controller, with topo,
+                    switches and convergence attributes
+        root_of: Function of (edge dpid, host port) returning the DPID of the
+                 root core of the broadcasts from that port, or None to leave
+                 them to the controller. By default, common_root()
+        group_of: Function of (edge dpid, host port) returning the (group,
+                  MAC address) of the host of that port, or None if unknown,
+                  to only broadcast within groups (e.g. vlans). By default,
+                  the broadcasts reach every host
+        interval: The time between two periodic refreshes in seconds
+    """
+
+    def __init__(self, controller, root_of=None, group_of=None, interval=5):
+        self.controller = controller
+        self.root_of = root_of or self.common_root
+        self.group_of = group_of
+        topo = controller.topo
+        self.host_ports = {}  # edge dpid -> ports of its hosts
+        for (n1, port1, n2, port2) in topo.portLinks():
+            if not topo.isSwitch(n1):
+                self.host_ports.setdefault(_dpid(n2), []).append(port2)
+        self.uplinks = {}  # edge dpid -> {core dpid: port}
+        self.core_links = {}  # core dpid -> {port: edge dpid}
+        self.installed = {}  # dpid -> {(in_port, dl_src): output ports}
+        self._scheduled = False
+        Timer(interval, self.refresh, recurring=True)
+
+    def link_event(self, event):
+        """Updates the live links from a discovery LinkEvent."""
+        topo = self.controller.topo
+        link = event.link
+        if topo.isCoreSwitch('s%d' % link.dpid1):
+            (coreDpid, corePort, edgeDpid, edgePort) = (link.dpid1, link.port1, link.dpid2, link.port2)
+        else:
+            (coreDpid, corePort, edgeDpid, edgePort) = (link.dpid2, link.port2, link.dpid1, link.port1)
+        if event.added:
+            self.uplinks.setdefault(edgeDpid, {})[coreDpid] = edgePort
+            self.core_links.setdefault(coreDpid, {})[corePort] = edgeDpid
+        else:
+            self.uplinks.get(edgeDpid, {}).pop(coreDpid, None)
+            self.core_links.get(coreDpid, {}).pop(corePort, None)
+        self.schedule()
+
+    def common_root(self, edge=None, port=None):
+        """Returns the lowest core linked to every edge, or None, for a
+        single tree shared by all the hosts."""
+        edges = set(self.host_ports)
+        for coreDpid in sorted(self.core_links):
+            if set(self.core_links[coreDpid].values()) >= edges:
+                return coreDpid
+        return None
+
+    def schedule(self):
+        """Refreshes the rules once the current events are handled."""
+        if not self._scheduled:
+            self._scheduled = True
+            core.callLater(self.refresh)
+
+    def refresh(self):
+        """Computes the trees and updates the rules that changed."""
+        self._scheduled = False
+        if not self.installed and not self.controller.convergence.is_converged():
+            return
+        roots = {}
+        groups = None if self.group_of is None else {}
+        for (edge, ports) in self.host_ports.items():
+            for port in ports:
+                root = self.root_of(edge, port)
+                if root is not None:
+                    roots[(edge, port)] = root
+                if groups is not None:
+                    group = self.group_of(edge, port)
+                    if group is not None:
+                        groups[(edge, port)] = group
+        rules = tree_rules(self.uplinks, self.core_links, self.host_ports, roots, groups)
+        for dpid in set(rules) | set(self.installed):
+            switch = self.controller.switches.get(dpid)
+            if switch is None or switch.connection is None:
+                continue
+            old = self.installed.get(dpid, {})
+            new = rules.get(dpid, {})
+            for (key, outs) in new.items():
+                if old.get(key) != outs:
+                    self._send(switch, of.OFPFC_ADD, key, outs)
+            for key in old:
+                if key not in new:
+                    self._send(switch, of.OFPFC_DELETE_STRICT, key, ())
+            self.installed[dpid] = new
+
+    def forget_switch(self, dpid):
+        """Forgets the rules of a switch that disconnected, to reinstall them."""
+        self.installed.pop(dpid, None)
+        self.schedule()
+
+    def _send(self, switch, command, key, outs):
+        (in_port, src) = key
+        msg = of.ofp_flow_mod(command=command)
+        msg.match = of.ofp_match(in_port=in_port, dl_dst=BROADCAST)
+        if src is not None:
+            msg.match.dl_src = src
+        msg.priority = PRIORITY
+        for port in outs:
+            msg.actions.append(of.ofp_action_output(port=port))
+        switch.connection.send(msg)
+        switch.metrics.flow_mod += 1
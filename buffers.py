@@ -0,0 +1,47 @@
+"""Packet-ins carrying only the headers of the packets buffered by the switches.
+
+When a switch connects, it is asked to send only the first MISS_SEND_LEN
+bytes of the packets it buffers, which is enough for the controllers to
+read the headers. Such a packet is then released from the switch buffer,
+either by a packet_out or by the flow_mod installing its flow, but only
+once: every output port of the packet must be given in the same message.
+A packet the switch could not buffer is sent whole by the switch and sent
+back whole by the controller.
+"""
+
+import pox.openflow.libopenflow_01 as of
+import templates
+
+MISS_SEND_LEN = 128  # Ethernet, IP and TCP headers, with some options
+
+
+def configure(connection, miss_send_len=MISS_SEND_LEN):
+    """Asks a switch to send only the headers of the packets it buffers.
+
+    Args:
+        connection: The connection of the switch
+        miss_send_len: The number of bytes of the packets sent to the controller
+    """
+    connection.send(of.ofp_set_config(miss_send_len=miss_send_len))
+
+
+def is_buffered(packet_in):
+    """Returns whether the packet of a packet-in is buffered by the switch."""
+    return packet_in.buffer_id is not None
+
+
+def packet_out(packet_in, ports):
+    """Returns the packet_out sending the packet of a packet-in to ports.
+
+    Args:
+        packet_in: the ofp_packet_in object the switch had sent
+        ports: The ports in which the packet will be sent
+    returns:
+        The packed packet_out, or None if the packet is neither buffered
+        nor whole in the packet-in and cannot be sent
+    """
+    if is_buffered(packet_in):
+        return templates.packet_out(packet_in.in_port, ports, packet_in.buffer_id)
+    elif packet_in.is_complete:
+        return templates.packet_out(packet_in.in_port, ports, data=packet_in.data)
+    return None
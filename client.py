@@ -1,17 +1,30 @@
 #!/usr/bin/env python
-"""Script to generate iperf streams up to a given bandwidth."""
+"""Script to generate iperf streams up to a given bandwidth, or short
+request/response flows to measure their completion time."""
 
 from __future__ import print_function
 
+import bisect
+import random
 import socket
+import struct
 import subprocess
 import sys
 import threading
 import time
 
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+
+RPC_PORT = 5002
 
 usage = """
 Usage: {0} DST_IP BANDWIDTH DURATION N_FLOWS DELAY
+       {0} rpc DST_IP DURATION CONCURRENCY SIZES
+       {0} serve [PORT]
 
 Args:
     DST_IP: IP address of destination server (e.g. 10.0.0.5)
@@ -25,7 +38,21 @@ Example:
     - a 60s 2-Mbps flow after 0s;
     - a 55s 2-Mbps flow after 5s;
     - a 50s 2-Mbps flow after 10s.
-""".format(sys.argv[0])
+
+RPC mode:
+    Each of the CONCURRENCY workers opens a new TCP connection to DST_IP
+    for every request, asks for a response whose size is drawn from SIZES,
+    and closes it, until DURATION seconds have elapsed. Every request is
+    thus a new flow for the controller. The flow completion time (from
+    connect to last byte) and first-packet latency (TCP handshake) are
+    reported as histograms.
+
+    SIZES: comma-separated SIZE:WEIGHT pairs of response sizes in bytes
+           (e.g. 1000:0.7,10000:0.2,100000:0.1)
+
+    The server side is started on the destination with {0} serve, which
+    listens on port {1} by default.
+""".format(sys.argv[0], RPC_PORT)
 
 
 def wrong_arg(msg):
@@ -79,30 +106,222 @@ def measure(dst, bw, duration, n_flows, delay):
     return sum
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 6:
-        wrong_arg("Wrong number of arguments!")
-    _, dst, bw, duration, n_flows, delay = sys.argv
+class Histogram(object):
+    """Histogram of durations with logarithmic buckets.
+
+    Bucket i counts the durations in [2^(i-1), 2^i[ microseconds. The
+    exact values are also kept to compute percentiles.
+    """
+
+    def __init__(self):
+        self.buckets = []
+        self.values = []
+
+    def add(self, seconds):
+        us = int(seconds * 1e6)
+        index = us.bit_length()
+        if index >= len(self.buckets):
+            self.buckets.extend([0] * (index + 1 - len(self.buckets)))
+        self.buckets[index] += 1
+        self.values.append(seconds)
+
+    def percentile(self, p):
+        values = sorted(self.values)
+        return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+    def report(self, name):
+        """Return the summary and the non-empty buckets as text."""
+        if not self.values:
+            return "{}: no sample".format(name)
+        lines = ["{}: n={} mean={:.3f}ms p50={:.3f}ms p90={:.3f}ms "
+                 "p99={:.3f}ms max={:.3f}ms".format(
+                     name, len(self.values),
+                     1e3 * sum(self.values) / len(self.values),
+                     1e3 * self.percentile(50), 1e3 * self.percentile(90),
+                     1e3 * self.percentile(99), 1e3 * max(self.values))]
+        for (i, count) in enumerate(self.buckets):
+            if count:
+                high = 2 ** i
+                lines.append("  <{:>10}us {:>7} {}".format(
+                    high, count, "#" * max(1, 60 * count // len(self.values))))
+        return "\n".join(lines)
+
+
+class SizeDistribution(object):
+    """Discrete distribution of response sizes.
+
+    Args:
+        spec: comma-separated SIZE:WEIGHT pairs (a SIZE alone has weight 1)
+    """
 
+    def __init__(self, spec):
+        self.sizes = []
+        self.cumulative = []
+        total = 0.0
+        for item in spec.split(","):
+            size, _, weight = item.partition(":")
+            total += float(weight) if weight else 1.0
+            self.sizes.append(int(size))
+            self.cumulative.append(total)
+        if total <= 0:
+            raise ValueError("weights must sum to a positive value")
+
+    def draw(self):
+        x = random.random() * self.cumulative[-1]
+        return self.sizes[bisect.bisect_right(self.cumulative, x)]
+
+
+def _recv_exactly(sock, n):
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(min(n, 65536))
+        if not chunk:
+            raise socket.error("connection closed")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+
+class RpcHandler(socketserver.BaseRequestHandler):
+    """Answers a request with the number of bytes it asks for."""
+
+    def handle(self):
+        (size,) = struct.unpack("!I", _recv_exactly(self.request, 4))
+        block = b"x" * min(size, 65536)
+        while size > 0:
+            self.request.sendall(block[:size])
+            size -= len(block)
+
+
+class RpcServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class RpcThread(threading.Thread):
+    """Thread that sends requests one after the other until the deadline.
+
+    Args:
+        dst: destination IP
+        sizes: SizeDistribution of the responses
+        deadline: time after which no request is started
+
+    After thread execution, the measured durations are in fct and latency,
+    and the number of failed requests in errors.
+    """
+
+    def __init__(self, dst, sizes, deadline):
+        super(RpcThread, self).__init__()
+        self._dst = dst
+        self._sizes = sizes
+        self._deadline = deadline
+        self.fct = Histogram()
+        self.latency = Histogram()
+        self.errors = 0
+
+    def run(self):
+        while time.time() < self._deadline:
+            size = self._sizes.draw()
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(10)
+            try:
+                start = time.time()
+                sock.connect((self._dst, RPC_PORT))
+                connected = time.time()
+                sock.sendall(struct.pack("!I", size))
+                _recv_exactly(sock, size)
+                done = time.time()
+            except socket.error:
+                self.errors += 1
+                continue
+            finally:
+                sock.close()
+            self.latency.add(connected - start)
+            self.fct.add(done - start)
+
+
+def measure_rpc(dst, duration, concurrency, sizes):
+    """Do the request/response measures and return the merged histograms."""
+    deadline = time.time() + duration
+    threads = [RpcThread(dst, sizes, deadline) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+
+    fct, latency, errors = Histogram(), Histogram(), 0
+    for t in threads:
+        t.join()
+        for value in t.fct.values:
+            fct.add(value)
+        for value in t.latency.values:
+            latency.add(value)
+        errors += t.errors
+    return fct, latency, errors
+
+
+def _parse_int(s, what):
+    try:
+        return int(s)
+    except ValueError:
+        wrong_arg("{} is not a valid {}!".format(s, what))
+
+
+def _check_ip(dst):
     try:
         socket.inet_aton(dst)
     except socket.error:
         wrong_arg("{} is not a valid IP address!".format(dst))
 
+
+def main_iperf(args):
+    if len(args) != 5:
+        wrong_arg("Wrong number of arguments!")
+    dst, bw, duration, n_flows, delay = args
+
+    _check_ip(dst)
+
     try:
         bw = float(bw)
     except ValueError:
         wrong_arg("{} is not a valid bandwidth in Mbps!".format(bw))
 
-    def _parse_int(s, what):
-        try:
-            return int(s)
-        except ValueError:
-            wrong_arg("{} is not a valid {}!".format(s, what))
-
     duration = _parse_int(duration, "duration in seconds")
     n_flows = _parse_int(n_flows, "number of flows")
     delay = _parse_int(delay, "delay in seconds")
 
     result = measure(dst, bw, duration, n_flows, delay)
     print(result, "Mbps")
+
+
+def main_rpc(args):
+    if len(args) != 4:
+        wrong_arg("Wrong number of arguments!")
+    dst, duration, concurrency, sizes = args
+
+    _check_ip(dst)
+    duration = _parse_int(duration, "duration in seconds")
+    concurrency = _parse_int(concurrency, "number of workers")
+    try:
+        sizes = SizeDistribution(sizes)
+    except ValueError:
+        wrong_arg("{} is not a valid size distribution!".format(sizes))
+
+    fct, latency, errors = measure_rpc(dst, duration, concurrency, sizes)
+    print(fct.report("Flow completion time"))
+    print(latency.report("First-packet latency"))
+    print(errors, "failed requests")
+
+
+def main_serve(args):
+    if len(args) > 1:
+        wrong_arg("Wrong number of arguments!")
+    port = _parse_int(args[0], "port") if args else RPC_PORT
+    RpcServer(("", port), RpcHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "rpc":
+        main_rpc(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "serve":
+        main_serve(sys.argv[2:])
+    else:
+        main_iperf(sys.argv[1:])
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Description of a simplified Clos-like network, without Mininet.
+
+The description is shared by the Mininet side (ClosTopo, test.py) and the
+POX controllers, which only need to know the role of each switch and the
+expected links. It is serialised as a small JSON document holding the
+parameters of the topology, which can be written with:
+
+    ./closdesc.py NCORE NEDGE NHOSTS BW > clos.json
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+
+
+class ClosDescription(object):
+    """Description of a simplified Clos-like network.
+
+    The topology has one layer of core switches s1..sNCORE, fully connected
+    to one layer of edge switches, each of which has nHosts hosts. Nodes and
+    ports are named and numbered as Mininet does for ClosTopo: on an edge,
+    port c leads to core c and ports nCore + 1.. to its hosts; on a core,
+    port k leads to the k-th edge; host hN has the MAC address N.
+
+    Args:
+        nCore: number of core switches
+        nEdge: number of edge switches
+        nHosts: number of hosts per edge switch
+        bw: bandwidth in Mbps
+    """
+
+    def __init__(self, nCore=2, nEdge=3, nHosts=3, bw=10):
+        self.nCore = int(nCore)
+        self.nEdge = int(nEdge)
+        self.nHosts = int(nHosts)
+        self.bw = bw
+
+    def params(self):
+        """Returns (nCore, nEdge, nHosts, bw)."""
+        return (self.nCore, self.nEdge, self.nHosts, self.bw)
+
+    def coreSwitches(self):
+        """Return the list of core switches names."""
+        return ["s%d" % i for i in range(1, self.nCore + 1)]
+
+    def edgeSwitches(self):
+        """Return the list of edge switches names."""
+        return ["s%d" % i for i in range(self.nCore + 1, self.nCore + self.nEdge + 1)]
+
+    def switches(self):
+        """Return the list of switches names."""
+        return self.coreSwitches() + self.edgeSwitches()
+
+    def hosts(self):
+        """Return the list of hosts names."""
+        return ["h%d" % i for i in range(1, self.nEdge * self.nHosts + 1)]
+
+    def nodes(self):
+        """Return the list of switches and hosts names."""
+        return self.switches() + self.hosts()
+
+    def _number(self, node):
+        return int(node[1:])
+
+    def isSwitch(self, node):
+        """Returns true if node is a switch."""
+        return node[0] == 's' and 1 <= self._number(node) <= self.nCore + self.nEdge
+
+    def isCoreSwitch(self, node):
+        """Returns true if node is a core switch."""
+        return node[0] == 's' and 1 <= self._number(node) <= self.nCore
+
+    def isEdgeSwitch(self, node):
+        """Returns true if node is an edge switch."""
+        return self.isSwitch(node) and not self.isCoreSwitch(node)
+
+    def edgeOf(self, host):
+        """Returns the name of the edge switch of a host."""
+        return "s%d" % (self.nCore + 1 + (self._number(host) - 1) // self.nHosts)
+
+    def hostMac(self, host):
+        """Returns the MAC address Mininet gives to a host with autoSetMacs."""
+        n = self._number(host)
+        return ":".join("%02x" % ((n >> shift) & 0xff) for shift in range(40, -1, -8))
+
+    def portLinks(self):
+        """Returns the links as (node1, port1, node2, port2) tuples."""
+        links = []
+        for (k, edge) in enumerate(self.edgeSwitches(), 1):
+            for (c, core) in enumerate(self.coreSwitches(), 1):
+                links.append((edge, c, core, k))
+            for j in range(1, self.nHosts + 1):
+                host = "h%d" % ((k - 1) * self.nHosts + j)
+                links.append((host, 0, edge, self.nCore + j))
+        return links
+
+    def links(self):
+        """Returns the links as (node1, node2) tuples."""
+        return [(n1, n2) for (n1, _, n2, _) in self.portLinks()]
+
+    def to_dict(self):
+        return {'type': 'clos', 'nCore': self.nCore, 'nEdge': self.nEdge,
+                'nHosts': self.nHosts, 'bw': self.bw}
+
+    @classmethod
+    def from_dict(cls, d):
+        if d.get('type') != 'clos':
+            raise ValueError("not a Clos topology description: %r" % (d,))
+        return cls(d['nCore'], d['nEdge'], d['nHosts'], d['bw'])
+
+    def save(self, path):
+        """Writes the description to a JSON file."""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a description written by save()."""
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5:
+        print("Usage: {} NCORE NEDGE NHOSTS BW".format(sys.argv[0]), file=sys.stderr)
+        exit(1)
+    print(json.dumps(ClosDescription(*[int(a) for a in sys.argv[1:]]).to_dict()))
@@ -2,6 +2,8 @@
 
 from mininet.topo import Topo
 
+from closdesc import ClosDescription
+
 
 class ClosTopo(Topo):
     """Topology for a simplified Clos-like network.
@@ -17,23 +19,27 @@ class ClosTopo(Topo):
     """
 
     def build(self, nCore=2, nEdge=3, nHosts=3, bw=10):
+        self.description = ClosDescription(nCore, nEdge, nHosts, bw)
         # Add core switches
-        coreSwitches = ["s%d" % i for i in range(1, nCore + 1)]
-        for core in coreSwitches:
+        for core in self.description.coreSwitches():
             self.addSwitch(core, isCoreSwitch=True)
 
-        # Add edge switches
-        hostNo = 1
-        for i in range(nCore + 1, nCore + 1 + nEdge):
-            edge = self.addSwitch("s%d" % i)
-            # Link edge switch to all core switches
-            for core in coreSwitches:
-                self.addLink(edge, core, bw=bw)
-            # Add a pod of hosts to edge switch
-            for j in range(hostNo, hostNo + nHosts):
-                host = self.addHost("h%d" % j)
-                self.addLink(host, edge, bw=bw)
-            hostNo += nHosts
+        # Add edge switches and their pods of hosts
+        for edge in self.description.edgeSwitches():
+            self.addSwitch(edge)
+        for host in self.description.hosts():
+            self.addHost(host)
+
+        # Link every edge switch to all core switches and to its hosts, with
+        # the port numbers the controllers expect
+        for (n1, port1, n2, port2) in self.description.portLinks():
+            self.addLink(n1, n2, port1=port1, port2=port2, bw=bw)
+
+    @classmethod
+    def fromDescription(cls, description):
+        """Builds the topology of a ClosDescription."""
+        (nCore, nEdge, nHosts, bw) = description.params()
+        return cls(nCore=nCore, nEdge=nEdge, nHosts=nHosts, bw=bw)
 
 
     def coreSwitches(self, sort=True):
@@ -0,0 +1,455 @@
+"""Runs several controller instances as an active-active cluster.
+
+Every member of the cluster is a POX process running the same controller
+(Tree, Vlans or Adaptive), and every switch connects to all the members.
+Each switch is mastered by one of the live members connected to it, chosen
+by rendezvous hashing of its DPID: the switches of a failed member are
+spread over the others, and the other switches keep their master. Every
+member raises the connection, link and port-status events of all the
+switches in its controller, so that it knows the whole fabric, but halts
+the packet-ins, flow removals and stats replies of the switches it does not
+master, and drops the flow_mods, packet_outs, port_mods and stats requests
+its controller sends them. When it starts mastering a switch, it makes its
+controller forget the flows and broadcast rules it believes installed in
+that switch, since they were dropped.
+
+Once per sync interval, a member sends the other members one JSON line over
+TCP with the changes of its shared state since the previous line:
+
+    {"member": 0, "dpids": [...], "ports": {"<dpid>": [{mac: port}, [mac]]},
+     "hosts": {mac: dpid}, "vlans": [{mac: vlan}, [mac]], "cores": {"<vlan>": dpid},
+     "load": {"<dpid>": rows}}
+
+that is the ports learned by the switches it masters, the host locations of
+Adaptive, the vlans of the hosts and the cores of the moved vlans of Vlans
+and, for Adaptive, the load of the uplinks of the edges it masters. The
+line is sent even without changes, as a heartbeat listing the switches the
+member is connected to. A member not heard from for timeout seconds is
+considered failed, and its switches are mastered by the others from the
+next sync. A member that (re)connects to another one first sends it its
+full state.
+
+Example, two members on one machine, with the switches connecting to both
+OpenFlow ports (e.g. ./test.py --controllers=6633,6634):
+    ./pox.py openflow.of_01 --port=6633 openflow.discovery cluster
+        --controller=adaptive --members=127.0.0.1:7700,127.0.0.1:7701 --index=0
+    ./pox.py openflow.of_01 --port=6634 openflow.discovery cluster
+        --controller=adaptive --members=127.0.0.1:7700,127.0.0.1:7701 --index=1
+        --status_port=8081
+"""
+
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+from pox.lib.recoco import Timer
+from pox.lib.revent import EventHalt
+
+log = core.getLogger()
+
+# Before the Recorder of trace, so that it records what the controller gets
+PRIORITY = 2000
+
+# The messages only the master of a switch sends it
+GUARDED = frozenset([of.OFPT_FLOW_MOD, of.OFPT_PACKET_OUT, of.OFPT_PORT_MOD,
+                     of.OFPT_STATS_REQUEST])
+
+_type = struct.Struct('!B')
+_weight = struct.Struct('!Q')
+
+
+def weight(dpid, member):
+    """Returns the rendezvous weight of a member for a switch."""
+    digest = hashlib.md5(('%d:%d' % (dpid, member)).encode('ascii')).digest()
+    return _weight.unpack_from(digest)[0]
+
+
+def message_type(data):
+    """Returns the OpenFlow type of a message, packed or not."""
+    if isinstance(data, (bytes, bytearray)):
+        return _type.unpack_from(data, 1)[0]
+    return data.header_type
+
+
+def diff(old, new):
+    """Returns the entries of new that changed since old, and the keys gone."""
+    changed = dict((key, value) for (key, value) in new.items()
+                   if old.get(key) != value)
+    gone = [key for key in old if key not in new]
+    return (changed, gone)
+
+
+def parse_address(address):
+    """Returns the (host, port) of a 'host:port' string."""
+    (host, port) = address.rsplit(':', 1)
+    return (host, int(port))
+
+
+class Peer(object):
+    """Another member of the cluster, and the channel sending it our lines.
+
+    The channel is a TCP connection kept open by its own thread. The lines
+    sent while it is down are lost, the peer gets the full state once the
+    connection is back.
+
+    Args:
+        index: The index of the member
+        address: The (host, port) the member listens on
+        timeout: The time after which a connection or a send fails, in seconds
+        retry: The time between two connection attempts, in seconds
+    """
+
+    def __init__(self, index, address, timeout=3, retry=1):
+        self.index = index
+        self.address = address
+        self.timeout = timeout
+        self.retry = retry
+        self.heard = None  # Time of the last line received from the peer
+        self.dpids = None  # Switches the peer is connected to, None until heard
+        self.connected = False
+        self.fresh = False  # Connected since the last line, needs the full state
+        self.queue = Queue()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def send(self, line):
+        if self.connected:
+            self.queue.put(line)
+
+    def _run(self):
+        while True:
+            try:
+                sock = socket.create_connection(self.address, self.timeout)
+            except socket.error:
+                time.sleep(self.retry)
+                continue
+            log.info("Connected to member %d at %s:%d", self.index, *self.address)
+            self.connected = True
+            self.fresh = True
+            try:
+                while True:
+                    sock.sendall(self.queue.get())
+            except socket.error as e:
+                log.warning("Lost the connection to member %d: %s", self.index, e)
+            finally:
+                self.connected = False
+                sock.close()
+                while True:
+                    try:
+                        self.queue.get_nowait()
+                    except Empty:
+                        break
+
+    def status(self, now, live):
+        return {'live': live, 'connected': self.connected,
+                'heard': None if self.heard is None else now - self.heard,
+                'switches': None if self.dpids is None else len(self.dpids)}
+
+
+class Cluster(object):
+    """Member of a cluster of controllers, mastering a part of the switches.
+
+    Args:
+        controller: The Tree, Vlans or Adaptive controller of the member
+        index: The index of the member in members
+        members: The (host, port) every member listens on for the others
+        interval: The time between two syncs, and heartbeats, in seconds
+        timeout: The time after which a silent member is considered failed
+    """
+
+    def __init__(self, controller, index, members, interval=1, timeout=3):
+        self.controller = controller
+        self.index = index
+        self.interval = interval
+        self.timeout = timeout
+        self.peers = dict((i, Peer(i, address, timeout, interval))
+                          for (i, address) in enumerate(members) if i != index)
+        self.connected = set()  # Switches connected to this member
+        self.mastered = set()  # Switches mastered by this member
+        self.sent = {'ports': {}, 'hosts': {}, 'vlans': {}, 'cores': {}, 'load': {}}
+        self.started = time.time()  # The peers are live until timeout after it
+        self.gained = 0  # Switches taken over from other members
+        self.dropped = 0  # Messages to switches mastered by other members
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(members[index])
+        self.server.listen(len(members))
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+        Timer(interval, self._sync, recurring=True)
+
+        def startup():
+            # Before the controller, which must not see the halted events
+            core.openflow.addListeners(self, priority=PRIORITY)
+        core.call_when_ready(startup, ('openflow',))
+
+    def live(self):
+        """Returns the indexes of the live members."""
+        now = time.time()
+        return [self.index] + [
+            peer.index for peer in self.peers.values()
+            if now - (self.started if peer.heard is None else peer.heard) <= self.timeout]
+
+    def master(self, dpid, live):
+        """Returns the index of the member mastering a switch, or None.
+
+        Args:
+            dpid: The DPID of the switch
+            live: The indexes of the live members
+        """
+        candidates = [i for i in live if (dpid in self.connected if i == self.index
+                                          else self.peers[i].dpids is None or
+                                          dpid in self.peers[i].dpids)]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda i: weight(dpid, i))
+
+    def _update(self):
+        """Recomputes the switches mastered by this member."""
+        live = self.live()
+        mastered = set(dpid for dpid in self.connected
+                       if self.master(dpid, live) == self.index)
+        gained = mastered - self.mastered
+        lost = self.mastered - mastered
+        if gained:
+            log.info("Mastering switches %s", sorted(gained))
+            if time.time() - self.started > self.timeout:
+                self.gained += len(gained)
+            for dpid in gained:
+                self._resync(dpid)
+        if lost:
+            log.info("Leaving switches %s to the other members", sorted(lost))
+        self.mastered = mastered
+
+    def _resync(self, dpid):
+        """Forgets what the controller believes it installed in a switch.
+
+        The messages to the switch were dropped while another member
+        mastered it, so the flows the controller indexed and the broadcast
+        rules it sent were never installed. They are forgotten, so that the
+        flows are installed again on their next packet-in and the broadcast
+        rules at the next refresh.
+        """
+        controller = self.controller
+        controller.timeouts.forget_switch(dpid)
+        controller.broadcast.forget_switch(dpid)
+        switch = controller.switches.get(dpid)
+        if switch is None:
+            return
+        for name in ('flows', 'flows_of', 'rejected'):
+            table = getattr(switch, name, None)
+            if table is not None:
+                table.clear()
+
+    def _guard(self, connection):
+        """Drops the messages to a switch while another member masters it."""
+        send = connection.send
+        dpid = connection.dpid
+
+        def guarded(data):
+            if dpid in self.mastered or message_type(data) not in GUARDED:
+                send(data)
+            else:
+                self.dropped += 1
+        connection.send = guarded
+
+    def _handle_ConnectionUp(self, event):
+        self.connected.add(event.dpid)
+        self._guard(event.connection)
+        self._update()
+
+    def _handle_ConnectionDown(self, event):
+        self.connected.discard(event.dpid)
+        self._update()
+
+    def _halt_unmastered(self, event):
+        """Only the master of a switch handles its packets and replies."""
+        if event.dpid not in self.mastered:
+            return EventHalt
+
+    _handle_PacketIn = _halt_unmastered
+    _handle_FlowRemoved = _halt_unmastered
+    _handle_FlowStatsReceived = _halt_unmastered
+    _handle_PortStatsReceived = _halt_unmastered
+
+    def _collect(self):
+        """Returns the shared state this member is the source of, encoded."""
+        controller = self.controller
+        state = {'ports': {}, 'hosts': {}, 'vlans': {}, 'cores': {}, 'load': {}}
+        for dpid in self.mastered:
+            switch = controller.switches.get(dpid)
+            if switch is not None:
+                state['ports'][str(dpid)] = dict(
+                    (str(mac), port) for (mac, port) in switch.mac_to_port.items())
+        hosts = getattr(controller, 'hosts', None)
+        if hosts:
+            state['hosts'] = dict((str(mac), dpid) for (mac, dpid) in hosts.items()
+                                  if dpid in self.mastered)
+        tenant = getattr(controller, 'tenant', None)
+        if tenant is not None:
+            state['vlans'] = dict((str(mac), vlan) for (mac, vlan) in tenant.vlans.items())
+            state['cores'] = dict((str(vlan), dpid) for (vlan, dpid) in tenant.vlan_core.items())
+        linkstate = getattr(controller, 'linkstate', None)
+        if linkstate is not None:
+            for dpid in self.mastered:
+                e = linkstate.edge_index(dpid)
+                if 0 <= e < linkstate.nEdge:
+                    state['load'][str(dpid)] = linkstate.load[:, e].tolist()
+        return state
+
+    def _delta(self, state):
+        """Returns the changes of the shared state since the previous sync."""
+        ports = {}
+        for (dpid, table) in state['ports'].items():
+            (changed, gone) = diff(self.sent['ports'].get(dpid, {}), table)
+            if changed or gone:
+                ports[dpid] = [changed, gone]
+        (vlans, vlans_gone) = diff(self.sent['vlans'], state['vlans'])
+        delta = {'ports': ports,
+                 'hosts': diff(self.sent['hosts'], state['hosts'])[0],
+                 'vlans': [vlans, vlans_gone],
+                 'cores': diff(self.sent['cores'], state['cores'])[0],
+                 'load': diff(self.sent['load'], state['load'])[0]}
+        if not vlans and not vlans_gone:
+            del delta['vlans']
+        return dict((name, part) for (name, part) in delta.items() if part)
+
+    def _line(self, parts):
+        msg = dict(parts, member=self.index, dpids=sorted(self.connected))
+        return (json.dumps(msg, separators=(',', ':')) + '\n').encode('utf-8')
+
+    def _sync(self):
+        """Sends the changes of the shared state, and takes over the failed members."""
+        self._update()
+        state = self._collect()
+        delta = self._line(self._delta(state))
+        full = None
+        for peer in self.peers.values():
+            if peer.fresh:
+                peer.fresh = False
+                if full is None:
+                    parts = {'ports': dict((dpid, [table, []])
+                                           for (dpid, table) in state['ports'].items()),
+                             'hosts': state['hosts'],
+                             'cores': state['cores'],
+                             'load': state['load']}
+                    if state['vlans']:
+                        parts['vlans'] = [state['vlans'], []]
+                    full = self._line(parts)
+                peer.send(full)
+            else:
+                peer.send(delta)
+        self.sent = state
+
+    def _accept(self):
+        while True:
+            (sock, _) = self.server.accept()
+            thread = threading.Thread(target=self._read, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _read(self, sock):
+        """Hands the lines of another member to the event loop."""
+        f = sock.makefile('rb')
+        try:
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+                core.callLater(self._receive, json.loads(line.decode('utf-8')))
+        except (socket.error, ValueError) as e:
+            log.warning("Dropping a connection from a member: %s", e)
+        finally:
+            f.close()
+            sock.close()
+
+    def _receive(self, msg):
+        """Applies the shared state sent by another member."""
+        peer = self.peers.get(msg['member'])
+        if peer is None:
+            log.warning("Ignoring a line from unknown member %s", msg['member'])
+            return
+        if peer.heard is None or time.time() - peer.heard > self.timeout:
+            log.info("Member %d is live", peer.index)
+        peer.heard = time.time()
+        peer.dpids = set(msg['dpids'])
+        controller = self.controller
+        for (dpid, (changed, gone)) in msg.get('ports', {}).items():
+            switch = controller.switches.get(int(dpid))
+            if switch is None or int(dpid) in self.mastered:
+                continue
+            for (mac, port) in changed.items():
+                switch.mac_to_port[EthAddr(str(mac))] = port
+            for mac in gone:
+                switch.mac_to_port.pop(EthAddr(str(mac)), None)
+        for (mac, dpid) in msg.get('hosts', {}).items():
+            if dpid not in self.mastered:
+                controller.hosts[EthAddr(str(mac))] = dpid
+        if 'vlans' in msg:
+            (changed, gone) = msg['vlans']
+            vlans = controller.tenant.vlans
+            for (mac, vlan) in changed.items():
+                if vlans.get(EthAddr(str(mac))) != vlan:
+                    controller.move_host(str(mac), vlan)
+                self.sent['vlans'][mac] = vlan  # Not sent back
+            for mac in gone:
+                if EthAddr(str(mac)) in vlans:
+                    controller.remove_host(str(mac))
+                self.sent['vlans'].pop(mac, None)
+        for (vlan, dpid) in msg.get('cores', {}).items():
+            if controller.tenant.getCore(int(vlan)) == dpid or \
+                    controller.move_vlan(int(vlan), dpid):
+                self.sent['cores'][vlan] = dpid  # Not sent back
+        for (dpid, load) in msg.get('load', {}).items():
+            if int(dpid) not in self.mastered:
+                controller.linkstate.set_edge_load(int(dpid), load)
+
+    def status(self):
+        now = time.time()
+        live = self.live()
+        return {
+            'index': self.index,
+            'mastered': sorted(self.mastered),
+            'connected': len(self.connected),
+            'gained': self.gained,
+            'dropped': self.dropped,
+            'members': dict((str(peer.index), peer.status(now, peer.index in live))
+                            for peer in self.peers.values()),
+        }
+
+
+def launch(controller='adaptive', members='127.0.0.1:7700', index=0, interval=1,
+           timeout=3, **kw):
+    """
+    Launch the controller as a member of a cluster.
+
+    Args:
+        controller: The module of the controller (tree, vlans or adaptive)
+        members: The comma-separated host:port every member listens on for
+                 the others, the same list on every member
+        index: The index of this member in members
+        interval: The time between two syncs of the shared state in seconds
+        timeout: The time after which a silent member is considered failed,
+                 and its switches taken over, in seconds
+        kw: The launch arguments of the controller (nCore, nEdge, ...)
+    """
+    instance = __import__(controller).launch(**kw)
+    cluster = core.registerNew(Cluster, instance, int(index),
+                               [parse_address(m) for m in members.split(',')],
+                               float(interval), float(timeout))
+    server = getattr(instance, 'status_server', None)
+    if server is not None:
+        server.add_json_route('/cluster', cluster.status)
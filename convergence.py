@@ -0,0 +1,80 @@
+"""Discovery and readiness state of the fabric as seen by a controller."""
+
+
+def link_key(link):
+    """Returns a key identifying a discovered link in both directions.
+
+    Args:
+        link: The link of a LinkEvent
+    """
+    return tuple(sorted([(link.dpid1, link.port1), (link.dpid2, link.port2)]))
+
+
+def direction_key(link):
+    """Returns a key identifying one direction of a discovered link.
+
+    Args:
+        link: The link of a LinkEvent
+    """
+    return (link.dpid1, link.port1, link.dpid2, link.port2)
+
+
+class Convergence(object):
+    """Compares what the controller discovered with what the topology expects.
+
+    The fabric has converged once every switch of the topology is connected
+    and every link between switches has been discovered.
+
+    Args:
+        topo: The topology of the network
+        switches: The dict dpid -> Switch of the controller
+    """
+
+    def __init__(self, topo, switches):
+        self.switches = switches
+        self.expected_switches = len(topo.switches())
+        self.expected_links = len([(n1, n2) for (n1, n2) in topo.links()
+                                   if topo.isSwitch(n1) and topo.isSwitch(n2)])
+        self.links = {}  # link_key -> set of its discovered directions
+
+    def link_event(self, event):
+        """Updates the discovered links. Discovery raises one event per
+        direction, and a link counts as long as one of them is up.
+
+        Args:
+            event: The LinkEvent
+        """
+        key = link_key(event.link)
+        direction = direction_key(event.link)
+        if event.added:
+            self.links.setdefault(key, set()).add(direction)
+        elif event.removed:
+            directions = self.links.get(key)
+            if directions is not None:
+                directions.discard(direction)
+                if not directions:
+                    # Only gone once neither direction is discovered
+                    del self.links[key]
+
+    def connected(self):
+        """Returns the number of switches connected to the controller."""
+        return len([s for s in list(self.switches.values())
+                    if s.connection is not None])
+
+    def is_converged(self):
+        """Returns true if all switches are connected and all links discovered."""
+        return (self.connected() >= self.expected_switches and
+                len(self.links) >= self.expected_links)
+
+    def status(self):
+        """Returns the discovery and readiness state as a dict."""
+        connected = self.connected()
+        discovered = len(self.links)
+        return {
+            'switches': {'expected': self.expected_switches,
+                         'connected': connected},
+            'links': {'expected': self.expected_links,
+                      'discovered': discovered},
+            'converged': (connected >= self.expected_switches and
+                          discovered >= self.expected_links),
+        }
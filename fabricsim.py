@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""Flow-level simulator of the Clos fabric, to compare the core selection
+policies of the controllers on fabrics too large for Mininet.
+
+Flows arrive between hosts as Poisson processes whose rates follow a
+traffic matrix, with exponentially distributed sizes. At every time step,
+each new flow is given a core by the policy, the rates of all the flows
+are computed as the max-min fair allocation of the link capacities, and
+the flows that completed leave. All the links have the bandwidth of the
+topology, in Mbps.
+
+Policies:
+    adaptive: the least loaded core between the two edges, as Adaptive
+              chooses it with LinkState, from loads measured every poll
+    vlans: the core of the vlan of the source, as assigned by Tenant,
+           flows between vlans being rejected
+    tree: the core of the spanning tree root, as Tree forwards
+    hash: a core chosen by a hash of the hosts, as ECMP would
+
+Example:
+    ./fabricsim.py --nCore 8 --nEdge 64 --nHosts 32 --load 0.6 --duration 30
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from closdesc import ClosDescription
+from linkstate import DOWN, UP, LinkState
+
+
+def max_min_rates(links, capacity):
+    """Returns the max-min fair rates of flows sharing links.
+
+    At each round, every link whose fair share is the lowest among the
+    links of its flows is a bottleneck: its flows get that share, which is
+    taken from the capacity of their other links. The rounds go on until
+    every flow has a rate, usually after a few rounds, as all the
+    bottlenecks of a round are settled at once.
+
+    Args:
+        links: An integer array of shape (nFlows, k) of the links of each
+               flow, padded with -1
+        capacity: The capacity of each link
+    returns:
+        The rate of each flow
+    """
+    nLinks = len(capacity)
+    k = links.shape[1]
+    # A last link of infinite capacity stands for the padding
+    links = np.where(links >= 0, links, nLinks)
+    residual = np.append(np.asarray(capacity, dtype=float), np.inf)
+    rates = np.zeros(len(links))
+    pending = np.arange(len(links))
+    while len(pending):
+        flows = links[pending]
+        counts = np.bincount(flows.ravel(), minlength=nLinks + 1)
+        counts[nLinks] = 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.where(counts > 0, residual / counts, np.inf)
+        flow_share = share[flows].min(axis=1)
+        neighbours = np.full(nLinks + 1, np.inf)
+        np.minimum.at(neighbours, flows.ravel(), np.repeat(flow_share, k))
+        bottleneck = share <= neighbours * (1 + 1e-12)
+        settled = bottleneck[flows].any(axis=1)
+        rates[pending[settled]] = flow_share[settled]
+        residual -= np.bincount(flows[settled].ravel(),
+                                weights=np.repeat(flow_share[settled], k),
+                                minlength=nLinks + 1)
+        residual = np.maximum(residual, 0.0)
+        residual[nLinks] = np.inf
+        pending = pending[~settled]
+    return rates
+
+
+def clos_traffic(topo, kind='uniform', load=0.5, fanout=8, seed=0):
+    """Returns a synthetic traffic matrix of a topology.
+
+    Args:
+        topo: The ClosDescription of the fabric
+        kind: 'uniform', every host sending to fanout random hosts, or
+              'permutation', every host sending to a single host
+        load: The rate sent by each host, as a fraction of the bandwidth
+        fanout: The number of destinations of each host for 'uniform'
+        seed: The seed of the destinations
+    returns:
+        (src, dst, rate) arrays of host indexes and rates in Mbps
+    """
+    nHosts = topo.nEdge * topo.nHosts
+    rng = np.random.RandomState(seed)
+    if kind == 'permutation':
+        src = np.arange(nHosts)
+        dst = rng.permutation(nHosts)
+        # No host sends to itself
+        dst = np.where(dst == src, (dst + 1) % nHosts, dst)
+    elif kind == 'uniform':
+        fanout = min(fanout, nHosts - 1)
+        src = np.repeat(np.arange(nHosts), fanout)
+        dst = (src + 1 + rng.randint(0, nHosts - 1, len(src))) % nHosts
+    else:
+        raise ValueError("Unknown traffic matrix %r" % (kind,))
+    rate = np.full(len(src), load * topo.bw * nHosts / len(src))
+    return (src, dst, rate)
+
+
+def load_traffic(path):
+    """Reads a traffic matrix from a JSON list of [src host, dst host, Mbps],
+    the hosts being named as in the topology (h1, h2, ...)."""
+    with open(path) as f:
+        entries = json.load(f)
+    src = np.array([int(s[1:]) - 1 for (s, _, _) in entries], dtype=int)
+    dst = np.array([int(d[1:]) - 1 for (_, d, _) in entries], dtype=int)
+    rate = np.array([r for (_, _, r) in entries], dtype=float)
+    return (src, dst, rate)
+
+
+class FabricSim(object):
+    """Flow-level simulation of a Clos fabric under a core selection policy.
+
+    Links are indexed as host i -> edge: i, edge -> host i: nHost + i,
+    edge e -> core c: 2 * nHost + e * nCore + c, and core c -> edge e:
+    2 * nHost + (nEdge + e) * nCore + c.
+
+    Args:
+        topo: The ClosDescription of the fabric
+        traffic: The (src, dst, rate) traffic matrix
+        policy: The name of the core selection policy
+        mean_size: The mean size of the flows in Mbit
+        step: The time step in seconds
+        poll: The interval of the load measures of 'adaptive' in seconds
+        n_vlans: The number of vlans of 'vlans'
+        seed: The seed of the arrivals and sizes, the same for every policy
+    """
+
+    def __init__(self, topo, traffic, policy='adaptive', mean_size=10.0,
+                 step=0.1, poll=3.0, n_vlans=4, seed=0):
+        self.topo = topo
+        (self.nCore, self.nEdge, nHosts, bw) = topo.params()
+        self.nHost = self.nEdge * nHosts
+        self.host_edge = np.arange(self.nHost) // nHosts
+        self.nLinks = 2 * self.nHost + 2 * self.nEdge * self.nCore
+        self.capacity = np.full(self.nLinks, float(bw))
+        (self.pair_src, self.pair_dst, pair_rate) = traffic
+        self.arrival_rate = np.asarray(pair_rate, dtype=float) / mean_size
+        self.mean_size = mean_size
+        self.step = step
+        self.poll = poll
+        self.n_vlans = n_vlans
+        self.rng = np.random.RandomState(seed)
+        self.choose = getattr(self, '_policy_' + policy)
+        self.linkstate = LinkState(self.nCore, self.nEdge)
+        self.linkstate.available[:] = True
+
+        self.now = 0.0
+        self.src = np.zeros(0, dtype=int)
+        self.dst = np.zeros(0, dtype=int)
+        self.links = np.zeros((0, 4), dtype=int)
+        self.remaining = np.zeros(0)
+        self.start = np.zeros(0)
+        self.link_load = np.zeros(self.nLinks)  # rates of the last step
+        self._measured = np.zeros(self.nLinks)  # Mbit carried since the last poll
+        self._last_poll = 0.0
+
+        self.arrived = 0
+        self.rejected = 0
+        self.completion_times = []
+        self.delivered = 0.0  # Mbit
+        self.link_sum = np.zeros(self.nLinks)  # Mbit carried by each link
+        self.steps = 0
+
+    def _uplink(self, edge, core):
+        return 2 * self.nHost + edge * self.nCore + core
+
+    def _downlink(self, core, edge):
+        return 2 * self.nHost + (self.nEdge + edge) * self.nCore + core
+
+    def _policy_adaptive(self, src, dst):
+        return self.linkstate.best_cores(self.host_edge[src], self.host_edge[dst])
+
+    def _policy_vlans(self, src, dst):
+        # Host hN is in vlan (N - 1) % n_vlans and vlan v on core v % nCore,
+        # as initialised by Tenant
+        vlan = src % self.n_vlans
+        nCore = min(self.nCore, self.n_vlans)
+        return np.where(vlan == dst % self.n_vlans, vlan % nCore, -1)
+
+    def _policy_tree(self, src, dst):
+        return np.zeros(len(src), dtype=int)
+
+    def _policy_hash(self, src, dst):
+        return (src * 2654435761 + dst) % self.nCore
+
+    def _route(self, src, dst, cores):
+        """Returns the links of flows, the fabric links being -1 for the
+        flows that stay in their edge."""
+        (e1, e2) = (self.host_edge[src], self.host_edge[dst])
+        local = e1 == e2
+        links = np.empty((len(src), 4), dtype=int)
+        links[:, 0] = src
+        links[:, 1] = self.nHost + dst
+        links[:, 2] = np.where(local, -1, self._uplink(e1, cores))
+        links[:, 3] = np.where(local, -1, self._downlink(cores, e2))
+        return links
+
+    def _poll(self):
+        """Gives the mean rates since the last poll to the LinkState."""
+        elapsed = self.now - self._last_poll
+        if elapsed < self.poll:
+            return
+        rates = self._measured / elapsed
+        base = 2 * self.nHost
+        fabric = self.nEdge * self.nCore
+        self.linkstate.load[UP] = rates[base:base + fabric].reshape(self.nEdge, self.nCore)
+        self.linkstate.load[DOWN] = rates[base + fabric:].reshape(self.nEdge, self.nCore)
+        self._measured[:] = 0
+        self._last_poll = self.now
+
+    def _arrivals(self):
+        counts = self.rng.poisson(self.arrival_rate * self.step)
+        pairs = np.repeat(np.arange(len(counts)), counts)
+        sizes = self.rng.exponential(self.mean_size, len(pairs))
+        if not len(pairs):
+            return
+        (src, dst) = (self.pair_src[pairs], self.pair_dst[pairs])
+        cores = np.asarray(self.choose(src, dst))
+        admitted = cores >= 0
+        self.arrived += len(pairs)
+        self.rejected += int((~admitted).sum())
+        (src, dst, cores) = (src[admitted], dst[admitted], cores[admitted])
+        self.src = np.concatenate((self.src, src))
+        self.dst = np.concatenate((self.dst, dst))
+        self.links = np.concatenate((self.links, self._route(src, dst, cores)))
+        self.remaining = np.concatenate((self.remaining, sizes[admitted]))
+        self.start = np.concatenate((self.start, np.full(len(src), self.now)))
+
+    def run_step(self):
+        """Simulates one time step."""
+        self._poll()
+        self._arrivals()
+        rates = max_min_rates(self.links, self.capacity)
+        sent = np.minimum(rates * self.step, self.remaining)
+        self.remaining -= sent
+        self.delivered += sent.sum()
+        valid = self.links >= 0
+        carried = np.bincount(self.links[valid],
+                              weights=np.broadcast_to(sent[:, None], self.links.shape)[valid],
+                              minlength=self.nLinks)
+        self.link_sum += carried
+        self._measured += carried
+        self.link_load = carried / self.step
+        self.now += self.step
+        self.steps += 1
+
+        done = self.remaining <= 1e-12
+        if done.any():
+            self.completion_times.extend(self.now - self.start[done])
+            keep = ~done
+            self.src = self.src[keep]
+            self.dst = self.dst[keep]
+            self.links = self.links[keep]
+            self.remaining = self.remaining[keep]
+            self.start = self.start[keep]
+
+    def run(self, duration):
+        """Simulates a duration in seconds and returns the report."""
+        for _ in range(int(round(duration / self.step))):
+            self.run_step()
+        return self.report()
+
+    def report(self):
+        """Returns the throughput, utilisation and imbalance of the fabric."""
+        elapsed = max(self.now, self.step)
+        base = 2 * self.nHost
+        utilisation = self.link_sum[base:] / (elapsed * self.capacity[base:])
+        per_core = (utilisation[:self.nEdge * self.nCore].reshape(self.nEdge, self.nCore).sum(axis=0) +
+                    utilisation[self.nEdge * self.nCore:].reshape(self.nEdge, self.nCore).sum(axis=0))
+        fct = np.asarray(self.completion_times)
+        mean_core = per_core.mean()
+        return {
+            'throughput': self.delivered / elapsed,
+            'flows': {'arrived': self.arrived, 'rejected': self.rejected,
+                      'completed': len(fct), 'active': len(self.remaining)},
+            'fct_mean': float(fct.mean()) if len(fct) else None,
+            'fct_p99': float(np.percentile(fct, 99)) if len(fct) else None,
+            'fabric_utilisation': {'mean': float(utilisation.mean()),
+                                   'max': float(utilisation.max())},
+            'core_imbalance': float(per_core.max() / mean_core) if mean_core > 0 else 1.0,
+            'link_cv': float(utilisation.std() / utilisation.mean()) if utilisation.mean() > 0 else 0.0,
+        }
+
+
+def compare(topo, traffic, policies, duration=30, **kw):
+    """Simulates the same arrivals under several policies.
+
+    Args:
+        topo: The ClosDescription of the fabric
+        traffic: The (src, dst, rate) traffic matrix
+        policies: The names of the policies
+        duration: The simulated time in seconds
+        kw: The other arguments of FabricSim
+    returns:
+        policy name -> report, with the wall-clock time of the simulation
+    """
+    reports = {}
+    for policy in policies:
+        start = time.time()
+        reports[policy] = FabricSim(topo, traffic, policy, **kw).run(duration)
+        reports[policy]['seconds'] = time.time() - start
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the core selection policies on a simulated fabric")
+    parser.add_argument("--topo", help="topology description written by closdesc.py")
+    parser.add_argument("--nCore", type=int, default=2)
+    parser.add_argument("--nEdge", type=int, default=3)
+    parser.add_argument("--nHosts", type=int, default=3)
+    parser.add_argument("--bw", type=float, default=10, help="bandwidth of the links in Mbps")
+    parser.add_argument("--matrix", default="uniform",
+                        help="'uniform', 'permutation' or a JSON file of [src, dst, Mbps]")
+    parser.add_argument("--load", type=float, default=0.5,
+                        help="rate sent by each host as a fraction of the bandwidth")
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--policies", default="adaptive,vlans,tree,hash")
+    parser.add_argument("--duration", type=float, default=30, help="simulated seconds")
+    parser.add_argument("--step", type=float, default=0.1, help="time step in seconds")
+    parser.add_argument("--mean-size", type=float, default=10.0, help="mean flow size in Mbit")
+    parser.add_argument("--poll", type=float, default=3.0, help="load polling interval of adaptive")
+    parser.add_argument("--n-vlans", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.topo:
+        topo = ClosDescription.load(args.topo)
+    else:
+        topo = ClosDescription(args.nCore, args.nEdge, args.nHosts, args.bw)
+    if args.matrix in ('uniform', 'permutation'):
+        traffic = clos_traffic(topo, args.matrix, args.load, args.fanout, args.seed)
+    else:
+        traffic = load_traffic(args.matrix)
+    reports = compare(topo, traffic, args.policies.split(','), args.duration,
+                      mean_size=args.mean_size, step=args.step, poll=args.poll,
+                      n_vlans=args.n_vlans, seed=args.seed)
+    print(json.dumps(reports, indent=2, sort_keys=True))
@@ -0,0 +1,122 @@
+"""Lazy parsing of the headers of the packets sent to the controller.
+
+The packet-in handlers mostly need the Ethernet addresses of a packet.
+PacketHeaders reads them, and the IP and transport header fields when
+asked, straight from the ofp_packet_in data, and only decodes the whole
+pox.lib.packet object tree when decode() is called, e.g. to build an
+exact match with ofp_match.from_packet.
+"""
+
+import struct
+
+from pox.lib.addresses import EthAddr, IPAddr
+from pox.lib.packet.ethernet import ethernet
+
+ETH_HEADER_LEN = 14
+VLAN_TYPE = 0x8100
+IP_TYPE = 0x0800
+TCP_PROTOCOL = 6
+UDP_PROTOCOL = 17
+
+_type = struct.Struct('!H')
+_ip = struct.Struct('!BBHHHBBH4s4s')  # IPv4 header without options
+_ports = struct.Struct('!HH')
+
+
+class PacketHeaders(object):
+    """Header fields of a packet, read on access from its raw data.
+
+    Args:
+        data: The raw packet, as sent in the ofp_packet_in
+        packet: The decoded packet, if it is already known
+    """
+
+    __slots__ = ('data', '_view', '_src', '_dst', '_l3', '_ip', '_packet')
+
+    def __init__(self, data, packet=None):
+        self.data = data
+        self._view = memoryview(data)
+        self._src = None
+        self._dst = None
+        self._l3 = None  # (ethertype, offset of the network header)
+        self._ip = None  # Unpacked IPv4 header
+        self._packet = packet
+
+    @classmethod
+    def from_event(cls, event):
+        """Returns the headers of the packet of a PacketIn event, reusing
+        the packet decoded by a previous listener if there is one."""
+        return cls(event.ofp.data, getattr(event, '_parsed', None))
+
+    @property
+    def valid(self):
+        """Whether the packet has a whole Ethernet header."""
+        return len(self.data) >= ETH_HEADER_LEN
+
+    @property
+    def dst(self):
+        if self._dst is None:
+            self._dst = EthAddr(self._view[0:6].tobytes())
+        return self._dst
+
+    @property
+    def src(self):
+        if self._src is None:
+            self._src = EthAddr(self._view[6:12].tobytes())
+        return self._src
+
+    def _network(self):
+        if self._l3 is None:
+            (ethertype,) = _type.unpack_from(self._view, 12)
+            offset = ETH_HEADER_LEN
+            if ethertype == VLAN_TYPE and len(self.data) >= offset + 4:
+                (ethertype,) = _type.unpack_from(self._view, offset + 2)
+                offset += 4
+            self._l3 = (ethertype, offset)
+        return self._l3
+
+    @property
+    def ethertype(self):
+        """The ethertype of the packet, after an 802.1Q tag if any."""
+        return self._network()[0]
+
+    def _ipv4(self):
+        if self._ip is None:
+            (ethertype, offset) = self._network()
+            if ethertype != IP_TYPE or len(self.data) < offset + _ip.size:
+                self._ip = ()
+            else:
+                self._ip = _ip.unpack_from(self._view, offset)
+        return self._ip
+
+    @property
+    def nw_proto(self):
+        """The IP protocol, or None if the packet is not IPv4."""
+        ip = self._ipv4()
+        return ip[6] if ip else None
+
+    @property
+    def nw_src(self):
+        ip = self._ipv4()
+        return IPAddr(ip[8]) if ip else None
+
+    @property
+    def nw_dst(self):
+        ip = self._ipv4()
+        return IPAddr(ip[9]) if ip else None
+
+    def ports(self):
+        """Returns the (source, destination) TCP or UDP ports, or None."""
+        ip = self._ipv4()
+        if not ip or ip[6] not in (TCP_PROTOCOL, UDP_PROTOCOL) or ip[4] & 0x1fff:
+            return None  # Not TCP nor UDP, or not the first fragment
+        offset = self._network()[1] + (ip[0] & 0x0f) * 4
+        if len(self.data) < offset + _ports.size:
+            return None
+        return _ports.unpack_from(self._view, offset)
+
+    def decode(self):
+        """Returns the fully decoded packet, decoded on the first call."""
+        if self._packet is None:
+            self._packet = ethernet(self.data)
+        return self._packet
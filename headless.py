@@ -0,0 +1,134 @@
+"""Drives a controller from raw OpenFlow messages, without switch sockets.
+
+The Harness feeds the controller with the same events POX would raise for
+a switch connection, built from packed OpenFlow messages, and hands the
+messages the controller sends to a sink function instead of a socket.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.revent import *
+from pox.openflow import (ConnectionUp, ConnectionDown, PacketIn, PortStatus,
+                          FlowRemoved, FlowStatsReceived, PortStatsReceived)
+from pox.openflow.discovery import Link, LinkEvent
+from pox.openflow.of_01 import Connection
+
+log = core.getLogger()
+
+STATS_EVENTS = {
+    of.OFPST_FLOW: FlowStatsReceived,
+    of.OFPST_PORT: PortStatsReceived,
+}
+
+
+class ProxyConnection(EventMixin):
+    """Stands for the connection of a switch in the controller.
+
+    Args:
+        dpid: The DPID of the switch
+        features: The ofp_features_reply of the switch
+        sink: Function called with the DPID and the packed message for
+              every message sent to the switch
+    """
+    _eventMixin_events = Connection._eventMixin_events
+
+    def __init__(self, dpid, features, sink):
+        self.dpid = dpid
+        self.features = features
+        self.ports = dict((port.port_no, port) for port in features.ports)
+        self.sink = sink
+
+    def send(self, data):
+        """Packs a message and hands it to the sink."""
+        if not isinstance(data, bytes):
+            data = data.pack()
+        self.sink(self.dpid, data)
+
+    def __str__(self):
+        return "[proxy %s]" % (self.dpid,)
+
+
+class Harness(object):
+    """Raises the events of raw OpenFlow messages in a controller.
+
+    Args:
+        controller: The Tree, Vlans or Adaptive controller
+        sink: Function called with the DPID and the packed message for
+              every message sent by the controller
+    """
+
+    def __init__(self, controller, sink):
+        self.controller = controller
+        self.sink = sink
+        self.connections = {}
+
+    def connection_up(self, dpid, features):
+        """A switch connected, with its packed ofp_features_reply."""
+        reply = of.ofp_features_reply()
+        reply.unpack(features)
+        connection = ProxyConnection(dpid, reply, self.sink)
+        self.connections[dpid] = connection
+        self.controller._handle_ConnectionUp(ConnectionUp(connection, reply))
+
+    def connection_down(self, dpid):
+        """A switch disconnected."""
+        connection = self.connections.pop(dpid, None)
+        if connection is not None:
+            self.controller._handle_ConnectionDown(ConnectionDown(connection))
+
+    def link(self, added, dpid1, port1, dpid2, port2):
+        """Discovery found or lost a link."""
+        self.controller._handle_LinkEvent(
+            LinkEvent(added, Link(dpid1, port1, dpid2, port2)))
+
+    def packet_in(self, dpid, data):
+        """A switch sent a packed ofp_packet_in."""
+        connection = self.connections.get(dpid)
+        if connection is not None:
+            msg = of.ofp_packet_in()
+            msg.unpack(data)
+            connection.raiseEventNoErrors(PacketIn, connection, msg)
+
+    def port_status(self, dpid, data):
+        """A switch sent a packed ofp_port_status."""
+        connection = self.connections.get(dpid)
+        if connection is None:
+            return
+        msg = of.ofp_port_status()
+        msg.unpack(data)
+        if msg.reason == of.OFPPR_DELETE:
+            connection.ports.pop(msg.desc.port_no, None)
+        else:
+            connection.ports[msg.desc.port_no] = msg.desc
+        event = PortStatus(connection, msg)
+        connection.raiseEventNoErrors(event)
+        self.controller._handle_PortStatus(event)
+
+    def flow_removed(self, dpid, data):
+        """A switch sent a packed ofp_flow_removed."""
+        connection = self.connections.get(dpid)
+        if connection is not None:
+            msg = of.ofp_flow_removed()
+            msg.unpack(data)
+            event = FlowRemoved(connection, msg)
+            connection.raiseEventNoErrors(event)
+            handler = getattr(self.controller, '_handle_FlowRemoved', None)
+            if handler is not None:
+                handler(event)
+
+    def stats(self, dpid, parts):
+        """A switch sent the packed ofp_stats_reply parts of a reply."""
+        connection = self.connections.get(dpid)
+        if connection is None or not parts:
+            return
+        replies = []
+        for data in parts:
+            msg = of.ofp_stats_reply()
+            msg.unpack(data)
+            replies.append(msg)
+        event = STATS_EVENTS.get(replies[0].type)
+        if event is not None:
+            stats = []
+            for reply in replies:
+                stats.extend(reply.body)
+            connection.raiseEventNoErrors(event, connection, replies, stats)
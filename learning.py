@@ -0,0 +1,203 @@
+"""Bounded MAC learning tables with aging.
+
+A MacTable maps the MAC addresses learned on a switch to their ports, like
+the mac_to_port dicts of the controllers, with a bounded memory: the
+addresses are interned as integers, the ports, learning times and the
+order of the entries are kept in arrays of slots, and the table holds at
+most capacity entries. Learning an address when the table is full evicts
+the least recently learned one, and an entry expires max_age seconds after
+its address was last learned, so that the port of a host that left is not
+used forever.
+"""
+
+import struct
+import time
+from array import array
+
+from pox.lib.addresses import EthAddr
+
+MAC_CAPACITY = 100000  # Entries per switch
+MAC_AGE = 300  # Seconds, as the default aging time of Ethernet bridges
+
+_mac = struct.Struct('!Q')
+_NONE = -1
+
+
+def mac_key(mac):
+    """Returns the integer key of an EthAddr."""
+    return _mac.unpack(b'\x00\x00' + mac.toRaw())[0]
+
+
+def key_mac(key):
+    """Returns the EthAddr of an integer key."""
+    return EthAddr(_mac.pack(key)[2:])
+
+
+class MacTable(object):
+    """MAC address -> port table of a switch, with LRU eviction and aging.
+
+    The slots are chained from the most to the least recently learned
+    entry, so that the learning times decrease along the chain and the
+    expired entries are found from its end.
+
+    Args:
+        capacity: The maximum number of entries, 0 for no limit
+        max_age: The time after which an entry that was not learned again
+                 expires, in seconds, 0 for never
+        clock: The function giving the current time
+    """
+
+    __slots__ = ('capacity', 'max_age', 'clock', '_slots', '_keys', '_ports',
+                 '_stamps', '_prev', '_next', '_head', '_tail', '_free',
+                 'evictions', 'expirations')
+
+    def __init__(self, capacity=MAC_CAPACITY, max_age=MAC_AGE, clock=time.time):
+        if capacity < 0:
+            raise ValueError("MacTable capacity must not be negative, not %r" % (capacity,))
+        self.capacity = capacity
+        self.max_age = max_age
+        self.clock = clock
+        self._slots = {}  # integer MAC -> slot
+        self._keys = []  # slot -> integer MAC
+        self._ports = array('H')  # slot -> port
+        self._stamps = array('d')  # slot -> time of learning
+        self._prev = array('i')  # slot -> more recently learned slot
+        self._next = array('i')  # slot -> less recently learned slot
+        self._head = _NONE
+        self._tail = _NONE
+        self._free = []  # Slots of the removed entries
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _unlink(self, slot):
+        (before, after) = (self._prev[slot], self._next[slot])
+        if before == _NONE:
+            self._head = after
+        else:
+            self._next[before] = after
+        if after == _NONE:
+            self._tail = before
+        else:
+            self._prev[after] = before
+
+    def _push(self, slot):
+        self._prev[slot] = _NONE
+        self._next[slot] = self._head
+        if self._head == _NONE:
+            self._tail = slot
+        else:
+            self._prev[self._head] = slot
+        self._head = slot
+
+    def _remove(self, slot):
+        self._unlink(slot)
+        del self._slots[self._keys[slot]]
+        self._keys[slot] = None
+        self._free.append(slot)
+
+    def _slot(self, mac):
+        """Returns the slot of an address, or None if absent or expired."""
+        slot = self._slots.get(mac_key(mac))
+        if slot is not None and self.max_age and \
+                self.clock() - self._stamps[slot] > self.max_age:
+            self.expire()
+            return None
+        return slot
+
+    def __setitem__(self, mac, port):
+        """Learns the port of an address."""
+        key = mac_key(mac)
+        now = self.clock()
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._unlink(slot)
+        elif self._free:
+            slot = self._free.pop()
+        elif not self.capacity or len(self._keys) < self.capacity:
+            slot = len(self._keys)
+            self._keys.append(None)
+            self._ports.append(0)
+            self._stamps.append(0.0)
+            self._prev.append(_NONE)
+            self._next.append(_NONE)
+        else:
+            slot = self._tail
+            self._unlink(slot)
+            del self._slots[self._keys[slot]]
+            self.evictions += 1
+        self._slots[key] = slot
+        self._keys[slot] = key
+        self._ports[slot] = port
+        self._stamps[slot] = now
+        self._push(slot)
+
+    def __getitem__(self, mac):
+        slot = self._slot(mac)
+        if slot is None:
+            raise KeyError(mac)
+        return self._ports[slot]
+
+    def __contains__(self, mac):
+        return self._slot(mac) is not None
+
+    def __delitem__(self, mac):
+        slot = self._slots.get(mac_key(mac))
+        if slot is None:
+            raise KeyError(mac)
+        self._remove(slot)
+
+    def get(self, mac, default=None):
+        slot = self._slot(mac)
+        return default if slot is None else self._ports[slot]
+
+    def pop(self, mac, default=None):
+        slot = self._slot(mac)
+        if slot is None:
+            return default
+        port = self._ports[slot]
+        self._remove(slot)
+        return port
+
+    def items(self):
+        """Returns the (EthAddr, port) entries, most recently learned first."""
+        self.expire()
+        entries = []
+        slot = self._head
+        while slot != _NONE:
+            entries.append((key_mac(self._keys[slot]), self._ports[slot]))
+            slot = self._next[slot]
+        return entries
+
+    def keys(self):
+        return [mac for (mac, _) in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def expire(self):
+        """Removes the expired entries.
+
+        returns:
+            The number of removed entries
+        """
+        if not self.max_age:
+            return 0
+        oldest = self.clock() - self.max_age
+        removed = 0
+        while self._tail != _NONE and self._stamps[self._tail] < oldest:
+            self._remove(self._tail)
+            removed += 1
+        self.expirations += removed
+        return removed
+
+    def clear(self):
+        self.__init__(self.capacity, self.max_age, self.clock)
+
+    def status(self):
+        """Returns the occupancy of the table and its eviction and
+        expiration counts."""
+        return {'entries': len(self), 'capacity': self.capacity,
+                'evictions': self.evictions, 'expirations': self.expirations}
@@ -0,0 +1,223 @@
+"""Global load of the links between edge and core switches."""
+
+import numpy as np
+
+UP = 0  # From the edge to the core
+DOWN = 1  # From the core to the edge
+
+
+def path_table(snapshot, block=1 << 20):
+    """Returns the best core of every pair of edges.
+
+    Args:
+        snapshot: The (load, available, version) snapshot of a LinkState
+        block: The maximum number of costs computed at once
+    returns:
+        The snapshot version and an array of shape (nEdge, nEdge + 1) of
+        core indexes, -1 where no core is reachable. The last column is for
+        unknown destinations, where only the uplinks count.
+    """
+    (load, available, version) = snapshot
+    nEdge = load.shape[1]
+    nCore = load.shape[2]
+    up = np.where(available, load[UP], np.inf)
+    down = np.where(available, load[DOWN], np.inf)
+    table = np.empty((nEdge, nEdge + 1), dtype=int)
+    step = max(1, block // max(1, nEdge * nCore))
+    for start in range(0, nEdge, step):
+        cost = np.maximum(up[start:start + step, None, :], down[None, :, :])
+        best = np.argmin(cost, axis=2)
+        table[start:start + step, :nEdge] = np.where(
+            np.isfinite(cost.min(axis=2)), best, -1)
+    table[:, nEdge] = np.where(np.isfinite(up.min(axis=1)),
+                               np.argmin(up, axis=1), -1)
+    return (version, table)
+
+
+class LinkState(object):
+    """Load of every edge-core link of the fabric, kept in NumPy arrays.
+
+    load[UP, e, c] is the rate from edge e to core c and load[DOWN, e, c]
+    the rate from core c to edge e, in bytes per second. Edges and cores
+    are indexed from the DPIDs given by ClosDescription: cores are s1..snCore and
+    edges the following switches.
+
+    A path between two edges goes up to a core then down to the other
+    edge, its cost is the load of its most loaded link. Links that are not
+    discovered yet have an infinite cost.
+
+    The best cores of all pairs of edges can be precomputed in a table by
+    path_table(), off the event loop, from a snapshot. The last table is
+    used until the next one, even if the load changed since its snapshot,
+    but not once the discovered links changed: the best cores are then
+    computed per query until a table of the new links is set.
+
+    Args:
+        nCore: The number of core switch
+        nEdge: The number of edge switch
+        alpha: The weight of the last measure in the moving average
+    """
+
+    def __init__(self, nCore=2, nEdge=3, alpha=1.0):
+        self.nCore = nCore
+        self.nEdge = nEdge
+        self.alpha = alpha
+        self.load = np.zeros((2, nEdge, nCore))
+        self.available = np.zeros((nEdge, nCore), dtype=bool)
+        self._bytes = np.zeros((2, nEdge, nCore))  # last byte counters
+        self._measured = np.zeros((2, nEdge, nCore), dtype=bool)
+        self._stamp = np.zeros(nEdge)  # time of the last update of an edge
+        self.version = 0  # incremented when the discovered links change
+        self.paths = None
+
+    def edge_index(self, dpid):
+        """Returns the index of an edge switch from its DPID."""
+        return dpid - self.nCore - 1
+
+    def edge_dpid(self, index):
+        """Returns the DPID of an edge switch from its index."""
+        return int(index) + self.nCore + 1
+
+    def core_index(self, dpid):
+        """Returns the index of a core switch from its DPID."""
+        return dpid - 1
+
+    def core_dpid(self, index):
+        """Returns the DPID of a core switch from its index."""
+        return int(index) + 1
+
+    def set_available(self, edge_dpid, core_dpid, available=True):
+        """Marks the link between an edge and a core as usable or not.
+
+        Args:
+            edge_dpid: The DPID of the edge switch
+            core_dpid: The DPID of the core switch
+            available: Whether the link can be used
+        """
+        e = self.edge_index(edge_dpid)
+        c = self.core_index(core_dpid)
+        if self.available[e, c] != available:
+            self.available[e, c] = available
+            self.version += 1
+            self.paths = None
+
+    def reset_edge(self, edge_dpid):
+        """Forgets the counters and links of an edge, e.g. when it disconnects."""
+        e = self.edge_index(edge_dpid)
+        self.load[:, e] = 0
+        if self.available[e].any():
+            self.available[e] = False
+            self.version += 1
+            self.paths = None
+        self._measured[:, e] = False
+        self._stamp[e] = 0
+
+    def restore_load(self, load):
+        """Restores the rates of a previous load array, if the fabric is the same.
+
+        Args:
+            load: The load array, possibly as nested lists
+        """
+        load = np.asarray(load, dtype=float)
+        if load.shape == self.load.shape:
+            self.load[:] = load
+
+    def set_edge_load(self, edge_dpid, load):
+        """Sets the load of the uplinks of an edge measured elsewhere.
+
+        Args:
+            edge_dpid: The DPID of the edge switch
+            load: The (UP, DOWN) rows of the edge, possibly as nested lists
+        """
+        self.load[:, self.edge_index(edge_dpid)] = load
+
+    def update_edge(self, edge_dpid, core_dpids, tx_bytes, rx_bytes, now):
+        """Updates the load of the uplinks of an edge from its port counters.
+
+        Args:
+            edge_dpid: The DPID of the edge switch
+            core_dpids: The DPIDs of the cores the ports are linked to
+            tx_bytes: The bytes sent by the edge on each port
+            rx_bytes: The bytes received by the edge on each port
+            now: The time of the measure in seconds
+        """
+        e = self.edge_index(edge_dpid)
+        cores = np.asarray(core_dpids, dtype=int) - 1
+        counters = np.array([tx_bytes, rx_bytes], dtype=float)
+        elapsed = now - self._stamp[e]
+        self._stamp[e] = now
+
+        delta = counters - self._bytes[:, e, cores]
+        # Counters that went backwards were reset by the switch
+        delta = np.where(delta < 0, counters, delta)
+        measured = self._measured[:, e, cores]
+        self._bytes[:, e, cores] = counters
+        self._measured[:, e, cores] = True
+        if elapsed <= 0:
+            return
+        rate = np.where(measured, delta / elapsed, 0.0)
+        old = self.load[:, e, cores]
+        self.load[:, e, cores] = old + self.alpha * (rate - old)
+
+    def snapshot(self):
+        """Returns a copy of the state for path_table()."""
+        return (self.load.copy(), self.available.copy(), self.version)
+
+    def set_paths(self, result):
+        """Uses the table returned by path_table(), unless links changed since.
+
+        Args:
+            result: The (stamp, table) returned by path_table()
+        """
+        (version, table) = result
+        if version == self.version:
+            self.paths = table
+
+    def path_costs(self, src_edges, dst_edges):
+        """Returns the cost of going through each core, for pairs of edges.
+
+        Args:
+            src_edges: The indexes of the source edges
+            dst_edges: The indexes of the destination edges, or None if the
+                       destinations are unknown and only the uplinks count
+        returns:
+            An array of shape (len(src_edges), nCore)
+        """
+        cost = self.load[UP][src_edges]
+        available = self.available[src_edges]
+        if dst_edges is not None:
+            cost = np.maximum(cost, self.load[DOWN][dst_edges])
+            available = available & self.available[dst_edges]
+        return np.where(available, cost, np.inf)
+
+    def best_cores(self, src_edges, dst_edges=None):
+        """Returns the index of the least loaded core for pairs of edges.
+
+        Args:
+            src_edges: The indexes of the source edges
+            dst_edges: The indexes of the destination edges, or None
+        returns:
+            An array of core indexes, -1 where no core is reachable
+        """
+        costs = self.path_costs(src_edges, dst_edges)
+        best = np.argmin(costs, axis=1)
+        reachable = np.isfinite(costs[np.arange(len(best)), best])
+        return np.where(reachable, best, -1)
+
+    def best_core(self, src_dpid, dst_dpid=None):
+        """Returns the DPID of the least loaded core between two edges.
+
+        Args:
+            src_dpid: The DPID of the source edge
+            dst_dpid: The DPID of the destination edge, or None if unknown
+        returns:
+            The DPID of the core, or None if no core is reachable
+        """
+        if self.paths is not None:
+            dst = self.nEdge if dst_dpid is None else self.edge_index(dst_dpid)
+            best = self.paths[self.edge_index(src_dpid), dst]
+        else:
+            src = [self.edge_index(src_dpid)]
+            dst = None if dst_dpid is None else [self.edge_index(dst_dpid)]
+            best = self.best_cores(src, dst)[0]
+        return None if best < 0 else self.core_dpid(best)
@@ -0,0 +1,107 @@
+"""Per-switch counters and packet-in handling time of the controllers.
+
+The counters are plain integer attributes incremented by the Switch
+objects, so that keeping them up to date costs an attribute increment.
+They are only formatted, in the Prometheus text format, when the /metrics
+route of the status server is scraped.
+"""
+
+import bisect
+
+import pox.openflow.libopenflow_01 as of
+
+# Upper bounds in seconds of the packet-in handling time buckets
+BUCKETS = (25e-6, 50e-6, 100e-6, 250e-6, 500e-6,
+           1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3, 100e-3)
+
+FLOOD_PORTS = (of.OFPP_FLOOD, of.OFPP_ALL)
+
+COUNTERS = (
+    ('packet_in', 'Packet-in messages received'),
+    ('flood', 'Packet-out messages flooding the packet'),
+    ('packet_out', 'Packet-out messages sent'),
+    ('flow_mod', 'Flow-mod messages sent'),
+    ('stats_reply', 'Statistics replies received'),
+    ('port_status', 'Port-status messages received'),
+    ('rejected', 'Packet-in messages of flows rejected by the tenant policy'),
+)
+
+
+class SwitchMetrics(object):
+    """Counters and packet-in handling time histogram of a switch."""
+
+    __slots__ = tuple(name for (name, _) in COUNTERS) + (
+        'packet_in_buckets', 'packet_in_seconds')
+
+    def __init__(self):
+        for (name, _) in COUNTERS:
+            setattr(self, name, 0)
+        self.packet_in_buckets = [0] * (len(BUCKETS) + 1)
+        self.packet_in_seconds = 0.0
+
+    def observe_packet_in(self, seconds):
+        """Records the handling time of a packet-in.
+
+        Args:
+            seconds: The time spent in the handler
+        """
+        self.packet_in_buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.packet_in_seconds += seconds
+
+    def packet_out_to(self, *ports):
+        """Counts a packet-out sent to some ports.
+
+        Args:
+            ports: The output ports of the packet-out
+        """
+        self.packet_out += 1
+        for port in ports:
+            if port in FLOOD_PORTS:
+                self.flood += 1
+                break
+
+
+class Metrics(object):
+    """The metrics of all the switches of a controller.
+
+    Args:
+        prefix: The prefix of the metric names
+    """
+
+    def __init__(self, prefix='controller'):
+        self.prefix = prefix
+        self.switches = {}
+
+    def switch(self, dpid):
+        """Returns the metrics of a switch, created on first use.
+
+        Args:
+            dpid: The DPID of the switch
+        """
+        metrics = self.switches.get(dpid)
+        if metrics is None:
+            metrics = self.switches[dpid] = SwitchMetrics()
+        return metrics
+
+    def render(self):
+        """Returns all the metrics in the Prometheus text format."""
+        switches = sorted(self.switches.items())
+        lines = []
+        for (name, help) in COUNTERS:
+            metric = '%s_%s_total' % (self.prefix, name)
+            lines.append('# HELP %s %s.' % (metric, help))
+            lines.append('# TYPE %s counter' % metric)
+            for (dpid, metrics) in switches:
+                lines.append('%s{dpid="%s"} %d' % (metric, dpid, getattr(metrics, name)))
+
+        metric = '%s_packet_in_seconds' % self.prefix
+        lines.append('# HELP %s Packet-in handling time.' % metric)
+        lines.append('# TYPE %s histogram' % metric)
+        for (dpid, metrics) in switches:
+            count = 0
+            for (bound, n) in zip(BUCKETS + ('+Inf',), metrics.packet_in_buckets):
+                count += n
+                lines.append('%s_bucket{dpid="%s",le="%s"} %d' % (metric, dpid, bound, count))
+            lines.append('%s_sum{dpid="%s"} %r' % (metric, dpid, metrics.packet_in_seconds))
+            lines.append('%s_count{dpid="%s"} %d' % (metric, dpid, count))
+        return '\n'.join(lines) + '\n'
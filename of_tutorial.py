@@ -23,9 +23,17 @@ It's roughly similar to the one Brandon Heller did for NOX.
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+from pox.lib.util import str_to_bool
+import buffers
+from fastparse import PacketHeaders
+from learning import MAC_AGE, MAC_CAPACITY, MacTable
+from timeouts import TimeoutController
 
 log = core.getLogger()
 
+# Initial (idle, hard) timeouts of the learned flows
+TIMEOUTS = {'learned': (30, 60)}
+
 
 
 class Tutorial (object):
@@ -33,17 +41,24 @@ class Tutorial (object):
   A Tutorial object is created for each switch that connects.
   A Connection object for that switch is passed to the __init__ function.
   """
-  def __init__ (self, connection):
+  def __init__ (self, connection, timeouts, mac_to_port):
     # Keep track of the connection to the switch so that we can
     # send it messages!
     self.connection = connection
 
+    # Gives the timeouts of the flows and learns from their removal
+    self.timeouts = timeouts
+
     # This binds our PacketIn event listener
     connection.addListeners(self)
 
+    # Only the headers of the packets buffered by the switch are sent to us
+    buffers.configure(connection)
+
     # Use this table to keep track of which ethernet address is on
-    # which switch port (keys are MACs, values are ports).
-    self.mac_to_port = {}
+    # which switch port (keys are MACs, values are ports). It is bounded
+    # and forgets the addresses not seen for a while.
+    self.mac_to_port = mac_to_port
 
 
   def resend_packet (self, packet_in, out_port):
@@ -52,12 +67,12 @@ class Tutorial (object):
     "packet_in" is the ofp_packet_in object the switch had sent to the
     controller due to a table-miss.
     """
-    msg = of.ofp_packet_out()
-    msg.data = packet_in
-
-    # Add an action to send to the specified port
-    action = of.ofp_action_output(port = out_port)
-    msg.actions.append(action)
+    # Reuse the switch buffer, or the data if the packet is not buffered
+    msg = buffers.packet_out(packet_in, [out_port])
+    if msg is None:
+      log.debug("Cannot resend the truncated packet from port %s"
+                % (packet_in.in_port,))
+      return
 
     # Send message to switch
     self.connection.send(msg)
@@ -91,8 +106,10 @@ class Tutorial (object):
     self.mac_to_port[packet.src] = packet_in.in_port
 
     if packet.dst in self.mac_to_port:
-      # Send packet out the associated port
-      self.resend_packet(packet_in, self.mac_to_port[packet.dst])
+      # Send packet out the associated port, unless the flow_mod below
+      # releases it from the switch buffer (a buffer can only be used once)
+      if not buffers.is_buffered(packet_in):
+        self.resend_packet(packet_in, self.mac_to_port[packet.dst])
       # Once you have the above working, try pushing a flow entry
       # instead of resending the packet (comment out the above and
       # uncomment and complete the below.)
@@ -106,11 +123,11 @@ class Tutorial (object):
       msg = of.ofp_flow_mod()
       #
       ## Set fields to match received packet
-      msg.match = of.ofp_match.from_packet(packet)
+      msg.match = of.ofp_match.from_packet(packet.decode())
       #
       #< Set other fields of flow_mod (timeouts? buffer_id?) >
-      msg.idle_timeout = 30
-      msg.hard_timeout = 60
+      self.timeouts.apply(msg, 'learned',
+                          (self.connection.dpid, packet.src, packet.dst))
       msg.buffer_id = packet_in.buffer_id
       action = of.ofp_action_output(port=self.mac_to_port[packet.dst])
       msg.actions.append(action)
@@ -129,12 +146,15 @@ class Tutorial (object):
     Handles packet in messages from the switch.
     """
 
-    packet = event.parsed # This is the parsed packet data.
-    if not packet.parsed:
+    # The headers are read on access from the packet data, the whole packet
+    # is only decoded by packet.decode()
+    packet = PacketHeaders.from_event(event)
+    if not packet.valid:
       log.warning("Ignoring incomplete packet")
       return
 
     packet_in = event.ofp # The actual ofp_packet_in message.
+    self.timeouts.packet_in(self.connection.dpid, packet.src, packet.dst)
 
     # Comment out the following line and uncomment the one after
     # when starting the exercise.
@@ -142,12 +162,28 @@ class Tutorial (object):
     self.act_like_switch(packet, packet_in)
 
 
+  def _handle_FlowRemoved (self, event):
+    """
+    Handles the removal of a flow installed with OFPFF_SEND_FLOW_REM.
+    """
+    self.timeouts.flow_removed(self.connection.dpid, event.ofp)
+
+
 
-def launch ():
+def launch (tune_timeouts=True, mac_capacity=MAC_CAPACITY, mac_age=MAC_AGE):
   """
   Starts the component
+
+  tune_timeouts: tune the timeouts of the flows to the packet-in rate and
+  table occupancy, instead of using 30/60s
+  mac_capacity: the maximum number of addresses learned per switch, 0 for
+  no limit
+  mac_age: the seconds after which an address not seen again is forgotten
   """
+  timeouts = TimeoutController(TIMEOUTS, adapt=str_to_bool(tune_timeouts))
+
   def start_switch (event):
     log.debug("Controlling %s" % (event.connection,))
-    Tutorial(event.connection)
+    Tutorial(event.connection, timeouts,
+             MacTable(int(mac_capacity), float(mac_age)))
   core.openflow.addListenerByName("ConnectionUp", start_switch)
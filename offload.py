@@ -0,0 +1,98 @@
+"""Runs heavy control computations outside of the recoco event loop."""
+
+import sys
+import threading
+import traceback
+from multiprocessing.pool import Pool, ThreadPool
+
+from pox.core import core
+
+log = core.getLogger()
+
+
+def _call(compute, snapshot):
+    """Runs a computation in the pool, returning its result or its error."""
+    try:
+        return (True, compute(snapshot))
+    except Exception:
+        return (False, "".join(traceback.format_exception(*sys.exc_info())))
+
+
+class Offload(object):
+    """Pool running computations on snapshots of the controller state.
+
+    A computation only gets the snapshot it is submitted with, which must
+    not be modified afterwards, and never touches the controller. Its
+    result is applied back on the event loop, and all the results ready at
+    that time are applied in the same call, so the handlers never see a
+    partially applied batch.
+
+    Submissions with the same key are coalesced: while a computation of a
+    key runs, only the last snapshot submitted for that key is kept, and
+    computed when the running one is done.
+
+    Args:
+        workers: The number of workers of the pool, 0 to compute in the
+                 caller, e.g. for a deterministic replay
+        processes: Use processes instead of threads, for computations that
+                   hold the GIL (compute and snapshot must be picklable)
+    """
+
+    def __init__(self, workers=2, processes=False):
+        self.pool = (Pool if processes else ThreadPool)(workers) if workers else None
+        self._lock = threading.Lock()
+        self._running = set()
+        self._pending = {}  # key -> next task of the key
+        self._results = []  # (apply, result) to apply on the event loop
+
+    def submit(self, compute, snapshot, apply, key=None):
+        """Computes compute(snapshot) in the pool then apply(result) on the loop.
+
+        Args:
+            compute: The function doing the computation
+            snapshot: The immutable input of the computation
+            apply: The function applying the result to the controller
+            key: The key of coalesced submissions, None to never coalesce
+        """
+        task = (key, compute, snapshot, apply)
+        with self._lock:
+            if key is not None:
+                if key in self._running:
+                    self._pending[key] = task
+                    return
+                self._running.add(key)
+        self._start(task)
+
+    def _start(self, task):
+        (key, compute, snapshot, apply) = task
+        if self.pool is None:
+            self._done(task, _call(compute, snapshot))
+            return
+        self.pool.apply_async(_call, (compute, snapshot),
+                              callback=lambda outcome: self._done(task, outcome))
+
+    def _done(self, task, outcome):
+        """Called in the pool result thread when a computation is done, or
+        in the caller without pool."""
+        (key, compute, snapshot, apply) = task
+        with self._lock:
+            schedule = not self._results
+            self._results.append((apply, outcome))
+            following = self._pending.pop(key, None)
+            if following is None:
+                self._running.discard(key)
+        if following is not None:
+            self._start(following)
+        if schedule:
+            core.callLater(self._apply)
+
+    def _apply(self):
+        """Applies the batch of ready results on the event loop."""
+        with self._lock:
+            results = self._results
+            self._results = []
+        for (apply, (ok, result)) in results:
+            if ok:
+                apply(result)
+            else:
+                log.error("Offloaded computation failed:\n%s", result)
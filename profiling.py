@@ -0,0 +1,174 @@
+"""Opt-in profiling of the controller handlers.
+
+The handlers are only wrapped when profiling is asked at launch, so that a
+controller started without it runs the plain methods.
+"""
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+from collections import deque
+
+from pox.core import core
+from pox.lib.util import str_to_bool
+
+log = core.getLogger()
+
+DUMP_TIMEOUT = 10  # Seconds the status server waits for a dump
+# The values of --profile that switch it on or off, any other is a directory
+_SWITCHES = ('true', 'false', 't', 'f', 'yes', 'no', 'on', 'off', '1', '0')
+
+
+class Profiler(object):
+    """Deterministic profiler of some handlers over a rolling window.
+
+    The calls are profiled in windows of a fixed duration, and only the
+    last windows are kept, so that a report covers the recent behaviour of
+    the controller. Profiling one call out of sample reduces the overhead
+    under heavy load.
+
+    Args:
+        directory: The directory in which the reports are written
+        window: The duration of a window in seconds
+        windows: The number of windows kept
+        sample: Profile one call out of sample
+    """
+
+    def __init__(self, directory='.', window=60, windows=5, sample=1):
+        self.directory = directory
+        self.window = window
+        self.sample = sample
+        self.profiles = deque(maxlen=windows)  # (start time, Profile)
+        self.enabled = True
+        self.calls = 0
+
+    def wrap(self, cls, names):
+        """Profiles the given methods of a class.
+
+        Args:
+            cls: The class, whose instances must not be listening yet
+            names: The names of the methods, missing ones are ignored
+        """
+        for name in names:
+            method = getattr(cls, name, None)
+            if method is not None:
+                setattr(cls, name, self._wrapper(method))
+
+    def _wrapper(self, method):
+        profiler = self
+
+        @functools.wraps(method)
+        def wrapper(*args, **kw):
+            profiler.calls += 1
+            if not profiler.enabled or profiler.calls % profiler.sample:
+                return method(*args, **kw)
+            return profiler._current().runcall(method, *args, **kw)
+        return wrapper
+
+    def _current(self):
+        """Returns the profile of the current window."""
+        now = time.time()
+        if not self.profiles or now - self.profiles[-1][0] >= self.window:
+            self.profiles.append((now, cProfile.Profile()))
+        return self.profiles[-1][1]
+
+    def start(self):
+        """Resumes profiling."""
+        self.enabled = True
+        return "profiling enabled\n"
+
+    def stop(self):
+        """Suspends profiling, the kept windows can still be dumped."""
+        self.enabled = False
+        return "profiling disabled\n"
+
+    def dump(self, limit=50):
+        """Writes the report of the kept windows to the directory.
+
+        Two files are written: a .prof file that pstats or snakeviz can
+        load, and a .txt file ranking the functions by cumulative and by
+        internal time. The report is built on the event loop, between two
+        handlers, so that none of the profiles is running meanwhile.
+
+        Args:
+            limit: The number of functions in each ranking of the .txt file
+        returns:
+            The path of the .txt report
+        """
+        done = threading.Event()
+        result = []
+
+        def run():
+            try:
+                result.append(self._dump(limit))
+            except Exception:
+                log.exception("Profile dump failed")
+            finally:
+                done.set()
+        core.callLater(run)
+        if not done.wait(DUMP_TIMEOUT):
+            return "event loop busy, no dump written\n"
+        return result[0] if result else "dump failed\n"
+
+    def _dump(self, limit):
+        profiles = [profile for (_, profile) in self.profiles]
+        if not profiles:
+            return "nothing profiled yet\n"
+        base = os.path.join(self.directory,
+                            time.strftime('profile-%Y%m%d-%H%M%S'))
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(base + '.prof')
+
+        out = io.BytesIO() if str is bytes else io.StringIO()
+        stats.stream = out
+        stats.sort_stats('cumulative').print_stats(limit)
+        stats.sort_stats('tottime').print_stats(limit)
+        with open(base + '.txt', 'w') as f:
+            f.write(out.getvalue())
+        log.info("Profile of %d calls written to %s.txt", self.calls, base)
+        return base + '.txt\n'
+
+    def add_routes(self, server):
+        """Controls the profiler from the status server.
+
+        Args:
+            server: The StatusServer
+        """
+        server.add_route('/profile/start', self.start)
+        server.add_route('/profile/stop', self.stop)
+        server.add_route('/profile/dump', self.dump)
+
+
+def profile_handlers(cls, profile, sample=1, window=60):
+    """Profiles the packet-in and stats handlers of a Switch class.
+
+    Args:
+        cls: The Switch class of the controller
+        profile: False to disable profiling, True or the directory of the
+                 reports to enable it, as a bool or a command-line string
+                 ("True" and "False", "1" and "0", ...)
+        sample: Profile one call out of sample
+        window: The duration of a window in seconds
+    returns:
+        The Profiler, or None if disabled
+    """
+    if not profile:
+        return None
+    if isinstance(profile, bool) or str(profile).lower() in _SWITCHES:
+        if not str_to_bool(profile):
+            return None
+        directory = '.'
+    else:
+        directory = profile
+    if int(sample) < 1:
+        raise ValueError("profile_sample must be at least 1, not %r" % (sample,))
+    profiler = Profiler(directory, window=int(window), sample=int(sample))
+    profiler.wrap(cls, ('_handle_PacketIn', '_handle_PortStatsReceived',
+                        '_handle_FlowStatsReceived'))
+    return profiler
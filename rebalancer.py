@@ -0,0 +1,198 @@
+"""Moves the vlans of the vlans controller between cores to even out their load.
+
+Example:
+    ./pox.py openflow.discovery vlans rebalancer --interval=10
+"""
+
+import time
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+from traffic_matrix import ByteDeltas, ema, smooth
+
+log = core.getLogger()
+
+
+class VlanRebalancer(object):
+    """Reassigns the vlans of a Vlans controller to its cores by load.
+
+    The edges are polled for their flow and port statistics. The bytes of
+    the flows leaving an edge by an uplink are attributed to the vlan of
+    their source host, which gives the rate of every vlan. The bytes sent on
+    an uplink that no flow explains (e.g. floods) are a base load of its
+    core, which cannot be moved.
+
+    Before each poll, the vlan whose move from the most loaded to the least
+    loaded core lowers the peak load the most is moved, if it lowers it by
+    more than the threshold. At most max_moves vlans are moved per interval,
+    and a moved vlan stays on its new core for hold intervals, so that the
+    assignment does not oscillate. Rates are in bytes per second, smoothed
+    with an exponential moving average.
+
+    Args:
+        vlans: The Vlans controller
+        interval: The polling interval of the edges in seconds
+        alpha: The weight of the last measure in the moving average
+        threshold: The minimum relative decrease of the peak load of a move
+        min_rate: The peak load under which the cores are not rebalanced
+        max_moves: The maximum number of vlans moved per interval
+        hold: The number of intervals a moved vlan stays on its core
+    """
+
+    def __init__(self, vlans, interval=10, alpha=0.5, threshold=0.1,
+                 min_rate=10000, max_moves=1, hold=3):
+        self.vlans = vlans
+        self.tenant = vlans.tenant
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_rate = min_rate
+        self.max_moves = max_moves
+        self.hold = hold
+        self.round = 0
+        self.held = {}  # vlan id -> round until which it stays on its core
+
+        self.edge_vlan_rates = {}  # edge dpid -> {vlan id: rate}
+        self.edge_base = {}  # edge dpid -> {core dpid: unattributed rate}
+        self.flow_bytes = ByteDeltas()  # Of the (src, dst) flows of every edge
+        self.uplink_bytes = ByteDeltas(flows=False)  # Sent on the uplinks
+        # edge dpid -> {core dpid: rate of the uplink flows}, as of the last
+        # flow stats, compared as a rate since other pollers' replies update
+        # the counters too
+        self.attributed = {}
+
+        Timer(interval, self._timer_func, recurring=True)
+        core.openflow.addListeners(self)
+
+    def _edge(self, dpid):
+        """Returns the vlans Switch of an edge, or None."""
+        switch = self.vlans.switches.get(dpid)
+        if switch is None or switch.isCore is not False:
+            return None
+        return switch
+
+    def vlan_rates(self):
+        """Returns the rate of every vlan."""
+        rates = {}
+        for edge_rates in self.edge_vlan_rates.values():
+            for (vlan, rate) in edge_rates.items():
+                rates[vlan] = rates.get(vlan, 0.0) + rate
+        return rates
+
+    def core_loads(self, rates):
+        """Returns the load of every core, from the rates of the vlans.
+
+        Args:
+            rates: The rate of every vlan
+        """
+        loads = dict((dpid, 0.0) for dpid in range(1, self.vlans.nCore + 1))
+        for base in self.edge_base.values():
+            for (dpid, rate) in base.items():
+                loads[dpid] = loads.get(dpid, 0.0) + rate
+        for (vlan, rate) in rates.items():
+            dpid = self.tenant.getCore(vlan)
+            loads[dpid] = loads.get(dpid, 0.0) + rate
+        return loads
+
+    def rebalance(self):
+        """Moves up to max_moves vlans from the most to the least loaded core."""
+        rates = self.vlan_rates()
+        for _ in range(self.max_moves):
+            loads = self.core_loads(rates)
+            hot = max(loads, key=loads.get)
+            cold = min(loads, key=loads.get)
+            if loads[hot] < self.min_rate:
+                return
+            best = None
+            for (vlan, rate) in rates.items():
+                if self.tenant.getCore(vlan) != hot or self.held.get(vlan, 0) > self.round:
+                    continue
+                peak = max(loads[hot] - rate, loads[cold] + rate)
+                if best is None or peak < best[0]:
+                    best = (peak, vlan)
+            if best is None or best[0] > loads[hot] * (1 - self.threshold):
+                return
+            (peak, vlan) = best
+            log.info("Moving vlan %s (%.0f B/s) from core %s (%.0f B/s) to core %s (%.0f B/s)",
+                     vlan, rates[vlan], hot, loads[hot], cold, loads[cold])
+            if not self.vlans.move_vlan(vlan, cold):
+                return
+            self.held[vlan] = self.round + self.hold
+
+    def _timer_func(self):
+        """Rebalances from the last measures, then polls the edges."""
+        self.round += 1
+        self.rebalance()
+        for switch in self.vlans.switches.values():
+            if switch.isCore is False and switch.connection is not None:
+                switch.connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
+                switch.connection.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+
+    def _handle_FlowStatsReceived(self, event):
+        """Attributes the bytes of the uplink flows of an edge to their vlans."""
+        switch = self._edge(event.dpid)
+        if switch is None:
+            return
+        portToCore = dict((port, dpid) for (dpid, port) in switch.edgeToCore.items())
+        counts = {}
+        placements = {}  # (src, dst) -> (vlan id, core dpid)
+        for flow in event.stats:
+            ports = [a.port for a in flow.actions if isinstance(a, of.ofp_action_output)]
+            if len(ports) != 1 or ports[0] not in portToCore:
+                continue
+            vlan = self.tenant.vlans.get(flow.match.dl_src)
+            if vlan is None:
+                continue
+            key = (flow.match.dl_src, flow.match.dl_dst)
+            counts[key] = flow.byte_count
+            placements[key] = (vlan, portToCore[ports[0]])
+        (deltas, elapsed) = self.flow_bytes.update(event.dpid, counts, time.time())
+        vlan_delta = {}
+        core_delta = {}
+        for (key, delta) in deltas.items():
+            (vlan, coreDpid) = placements[key]
+            vlan_delta[vlan] = vlan_delta.get(vlan, 0) + delta
+            core_delta[coreDpid] = core_delta.get(coreDpid, 0) + delta
+        if elapsed <= 0:
+            return
+        self.attributed[event.dpid] = dict((dpid, delta / elapsed)
+                                           for (dpid, delta) in core_delta.items())
+        smooth(self.edge_vlan_rates.setdefault(event.dpid, {}), vlan_delta, elapsed,
+               self.alpha)
+
+    def _handle_PortStatsReceived(self, event):
+        """Updates the traffic of the uplinks of an edge that no flow explains."""
+        switch = self._edge(event.dpid)
+        if switch is None:
+            return
+        portToCore = dict((port, dpid) for (dpid, port) in switch.edgeToCore.items())
+        counts = dict((portStat.port_no, portStat.tx_bytes) for portStat in event.stats
+                      if portStat.port_no in portToCore)
+        (deltas, elapsed) = self.uplink_bytes.update(event.dpid, counts, time.time())
+        if elapsed <= 0:
+            return
+        attributed = self.attributed.get(event.dpid, {})
+        base = self.edge_base.setdefault(event.dpid, {})
+        for (port, delta) in deltas.items():
+            coreDpid = portToCore[port]
+            residual = max(0, delta / elapsed - attributed.get(coreDpid, 0))
+            base[coreDpid] = ema(base.get(coreDpid, 0.0), residual, self.alpha)
+
+
+def launch(interval=10, threshold=0.1, min_rate=10000, max_moves=1, hold=3):
+    """
+    Launch the rebalancer, next to the vlans controller.
+
+    Args:
+        interval: The polling interval of the edges in seconds
+        threshold: The minimum relative decrease of the peak load of a move
+        min_rate: The peak load in bytes per second under which the cores
+                  are not rebalanced
+        max_moves: The maximum number of vlans moved per interval
+        hold: The number of intervals a moved vlan stays on its core
+    """
+    def start():
+        core.registerNew(VlanRebalancer, core.Vlans, interval=float(interval),
+                         threshold=float(threshold), min_rate=float(min_rate),
+                         max_moves=int(max_moves), hold=int(hold))
+    core.call_when_ready(start, ('openflow', 'Vlans'))
@@ -0,0 +1,197 @@
+"""Runs the controller logic in several worker processes, sharded by DPID.
+
+The front process keeps the OpenFlow connections and discovery. Every
+worker process runs its own instance of the controller (Tree, Vlans or
+Adaptive) through a Harness. Connection, link and port-status events are
+given to all workers, so that every worker knows the whole fabric, but
+packet-ins, stats replies and flow removals of a switch only go to the
+worker owning its DPID, and only the owner's messages reach the switch.
+The host locations and link loads learned by a worker are replicated to
+the others once per sync interval.
+
+Example:
+    ./pox.py openflow.discovery shard --controller=adaptive --workers=4
+"""
+
+import multiprocessing
+import threading
+
+from pox.core import core
+import pox.lib.recoco as recoco
+from pox.lib.recoco import Timer
+from headless import Harness
+
+log = core.getLogger()
+
+
+class Worker(object):
+    """Controller instance of a worker process.
+
+    Args:
+        index: The index of the worker
+        count: The number of workers
+        controller: The controller run by the worker
+        outbox: Queue of the messages to the front process
+        sync: The replication interval of the shared state in seconds
+    """
+
+    def __init__(self, index, count, controller, outbox, sync=1):
+        self.index = index
+        self.count = count
+        self.controller = controller
+        self.outbox = outbox
+        self.harness = Harness(controller, self._send)
+        self._hosts_sent = {}
+        Timer(sync, self._sync, recurring=True)
+
+    def owns(self, dpid):
+        return dpid % self.count == self.index
+
+    def _send(self, dpid, data):
+        """Only the owner of a switch talks to it."""
+        if self.owns(dpid):
+            self.outbox.put(('send', dpid, data))
+
+    def handle(self, msg):
+        """Raises the event of a message from the front process."""
+        kind = msg[0]
+        if kind == 'state':
+            if msg[1] != self.index:
+                self._merge(msg[2], msg[3])
+        else:
+            getattr(self.harness, kind)(*msg[1:])
+
+    def _sync(self):
+        """Sends the shared state learned since the previous sync."""
+        hosts = getattr(self.controller, 'hosts', None)
+        if hosts:
+            changes = dict((mac, dpid) for (mac, dpid) in hosts.items()
+                           if self.owns(dpid) and self._hosts_sent.get(mac) != dpid)
+            if changes:
+                self._hosts_sent.update(changes)
+                self.outbox.put(('state', self.index, 'hosts', changes))
+        linkstate = getattr(self.controller, 'linkstate', None)
+        if linkstate is not None:
+            rows = {}
+            for dpid in self.harness.connections:
+                e = linkstate.edge_index(dpid)
+                if self.owns(dpid) and 0 <= e < linkstate.nEdge:
+                    rows[e] = linkstate.load[:, e].tolist()
+            if rows:
+                self.outbox.put(('state', self.index, 'load', rows))
+
+    def _merge(self, name, state):
+        """Applies the shared state sent by another worker."""
+        if name == 'hosts':
+            self.controller.hosts.update(state)
+        elif name == 'load':
+            linkstate = self.controller.linkstate
+            for (e, load) in state.items():
+                linkstate.set_edge_load(linkstate.edge_dpid(e), load)
+
+
+def _worker_main(index, count, controller, kw, inbox, outbox):
+    """Entry point of a worker process, forked from the front process.
+
+    The recoco scheduler thread of the front process does not exist in the
+    fork, so a new one runs the handlers and timers of the controller.
+    """
+    recoco.defaultScheduler = None
+    core.scheduler = recoco.Scheduler(daemon=True)
+    module = __import__(controller)
+    kw = dict(kw, status_port=0)
+    worker = Worker(index, count, module.launch(**kw), outbox)
+    while True:
+        msg = inbox.get()
+        if msg is None:
+            break
+        core.callLater(worker.handle, msg)
+
+
+class Shard(object):
+    """Front process dispatching the switch events to the workers.
+
+    Args:
+        controller: The module of the controller (tree, vlans or adaptive)
+        workers: The number of worker processes
+        kw: The launch arguments of the controller
+    """
+
+    def __init__(self, controller, workers, kw):
+        self.inboxes = [multiprocessing.Queue() for _ in range(workers)]
+        self.outbox = multiprocessing.Queue()
+        self.processes = []
+        for (index, inbox) in enumerate(self.inboxes):
+            process = multiprocessing.Process(
+                target=_worker_main,
+                args=(index, workers, controller, kw, inbox, self.outbox))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+        reader = threading.Thread(target=self._read_outbox)
+        reader.daemon = True
+        reader.start()
+
+        def startup():
+            """Start events"""
+            core.openflow.addListeners(self)
+            core.openflow_discovery.addListeners(self)
+        core.call_when_ready(startup, ('openflow', 'openflow_discovery'))
+
+    def owner(self, dpid):
+        return self.inboxes[dpid % len(self.inboxes)]
+
+    def broadcast(self, msg):
+        for inbox in self.inboxes:
+            inbox.put(msg)
+
+    def _read_outbox(self):
+        while True:
+            msg = self.outbox.get()
+            if msg[0] == 'send':
+                core.callLater(self._send, msg[1], msg[2])
+            else:
+                # Shared state goes to every worker, the sender ignores it
+                self.broadcast(msg)
+
+    def _send(self, dpid, data):
+        connection = core.openflow.getConnection(dpid)
+        if connection is not None:
+            connection.send(data)
+
+    def _handle_ConnectionUp(self, event):
+        self.broadcast(('connection_up', event.dpid, event.connection.features.pack()))
+
+    def _handle_ConnectionDown(self, event):
+        self.broadcast(('connection_down', event.dpid))
+
+    def _handle_LinkEvent(self, event):
+        link = event.link
+        self.broadcast(('link', event.added, link.dpid1, link.port1, link.dpid2, link.port2))
+
+    def _handle_PortStatus(self, event):
+        self.broadcast(('port_status', event.dpid, event.ofp.pack()))
+
+    def _handle_PacketIn(self, event):
+        self.owner(event.dpid).put(('packet_in', event.dpid, event.ofp.pack()))
+
+    def _handle_FlowRemoved(self, event):
+        self.owner(event.dpid).put(('flow_removed', event.dpid, event.ofp.pack()))
+
+    def _handle_FlowStatsReceived(self, event):
+        self.owner(event.dpid).put(('stats', event.dpid, [m.pack() for m in event.ofp]))
+
+    def _handle_PortStatsReceived(self, event):
+        self.owner(event.dpid).put(('stats', event.dpid, [m.pack() for m in event.ofp]))
+
+
+def launch(controller='adaptive', workers=2, **kw):
+    """
+    Launch the front process and the workers running the controller.
+
+    Args:
+        controller: The module of the controller (tree, vlans or adaptive)
+        workers: The number of worker processes
+        kw: The launch arguments of the controller (nCore, nEdge, ...)
+    """
+    core.registerNew(Shard, controller, int(workers), kw)
@@ -0,0 +1,163 @@
+"""Warm restart of the controllers from snapshots of their learned state.
+
+A snapshot is a zlib-compressed JSON document:
+
+    {"version": 1, "time": ..., "controller": {...},
+     "switches": {"<dpid>": {...}, ...}}
+
+where the controller and switch parts are whatever their snapshot_state()
+methods return. MAC addresses are stored as strings.
+"""
+
+import json
+import os
+import time
+import zlib
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+VERSION = 1
+
+
+def encode_macs(table):
+    """Returns a MAC address -> value table with string keys."""
+    return dict((str(mac), value) for (mac, value) in table.items())
+
+
+def decode_macs(table):
+    """Returns a table encoded by encode_macs with EthAddr keys."""
+    return dict((EthAddr(mac), value) for (mac, value) in table.items())
+
+
+def decode_dpids(table):
+    """Returns a DPID -> value table whose keys were turned into strings."""
+    return dict((int(dpid), value) for (dpid, value) in table.items())
+
+
+class Snapshotter(object):
+    """Saves the learned state of a controller and restores it at restart.
+
+    The snapshot file is only read when the first switch connects, and the
+    state of each switch is restored when that switch connects. A restored
+    switch is then asked for its flow table, the restored ports of the
+    hosts are corrected from the flows forwarding to them, and the restored
+    flow placements (the flows attribute of the switch, if any) that are
+    no longer in the table are forgotten.
+
+    The controller must provide snapshot_state() and restore_state(state),
+    and its Switch objects the same methods.
+
+    Args:
+        controller: The Tree, Vlans or Adaptive controller
+        path: The path of the snapshot file
+        interval: The time between two snapshots in seconds
+    """
+
+    def __init__(self, controller, path, interval=10):
+        self.controller = controller
+        self.path = path
+        self.saved = None  # The snapshot read at start, once loaded
+        self.reconciling = set()
+        self._last = None
+        Timer(interval, self.save, recurring=True)
+
+        def startup():
+            core.openflow.addListeners(self)
+        core.call_when_ready(startup, ('openflow',))
+
+    def save(self):
+        """Writes the state of the controller, if it changed."""
+        state = {
+            'controller': self.controller.snapshot_state(),
+            'switches': dict((str(dpid), switch.snapshot_state())
+                             for (dpid, switch) in self.controller.switches.items()
+                             if switch.connection is not None),
+        }
+        data = json.dumps(state, sort_keys=True)
+        if data == self._last:
+            return
+        self._last = data
+        state['version'] = VERSION
+        state['time'] = time.time()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(zlib.compress(json.dumps(state).encode('utf-8')))
+        os.rename(tmp, self.path)
+
+    def _load(self):
+        """Reads the snapshot and restores the state of the controller."""
+        self.saved = {'switches': {}}
+        try:
+            with open(self.path, 'rb') as f:
+                state = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except (IOError, OSError, ValueError, zlib.error) as e:
+            log.info("No snapshot restored from %s: %s", self.path, e)
+            return
+        if state.get('version') != VERSION:
+            log.warning("Ignoring snapshot %s of version %s", self.path, state.get('version'))
+            return
+        self.saved = state
+        self.controller.restore_state(state['controller'])
+        log.info("Restoring snapshot of %d switches taken %.1fs ago",
+                 len(state['switches']), time.time() - state['time'])
+
+    def _handle_ConnectionUp(self, event):
+        if self.saved is None:
+            self._load()
+        # After the handler of the controller, which creates the Switch
+        core.callLater(self._restore_switch, event.dpid, event.connection)
+
+    def _restore_switch(self, dpid, connection):
+        """Restores the state of a connected switch, if it was saved."""
+        switch = self.controller.switches.get(dpid)
+        if switch is None or switch.connection is not connection:
+            return
+        state = self.saved['switches'].pop(str(dpid), None)
+        if state is None:
+            return
+        switch.restore_state(state)
+        self.reconciling.add(dpid)
+        connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
+
+    def _handle_FlowStatsReceived(self, event):
+        """Corrects the restored host ports from the flows of the switch."""
+        if event.dpid not in self.reconciling:
+            return
+        self.reconciling.discard(event.dpid)
+        switch = self.controller.switches[event.dpid]
+        mac_to_port = switch.mac_to_port
+        installed = set()
+        for flow in event.stats:
+            ports = [a.port for a in flow.actions
+                     if isinstance(a, of.ofp_action_output)]
+            dst = flow.match.dl_dst
+            if len(ports) == 1 and dst in mac_to_port and ports[0] < of.OFPP_MAX:
+                mac_to_port[dst] = ports[0]
+            if len(ports) == 1:
+                installed.add((flow.match.dl_src, dst, ports[0]))
+        flows = getattr(switch, 'flows', None)
+        if flows is not None:
+            forget = getattr(switch, 'unindex_flow', flows.pop)
+            for ((src, dst), port) in list(flows.items()):
+                if (src, dst, port) not in installed:
+                    forget((src, dst))
+
+
+def snapshot_controller(controller, path, interval=10):
+    """Snapshots a controller if a path is given.
+
+    Args:
+        controller: The Tree, Vlans or Adaptive controller
+        path: The path of the snapshot file, None to disable snapshots
+        interval: The time between two snapshots in seconds
+    returns:
+        The Snapshotter, or None if disabled
+    """
+    if not path:
+        return None
+    return Snapshotter(controller, path, float(interval))
@@ -0,0 +1,126 @@
+"""Small HTTP endpoint exposing the controller state to the test scripts."""
+
+import json
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from pox.core import core
+
+log = core.getLogger()
+
+
+class StatusServer(object):
+    """HTTP server answering GET requests from a table of routes.
+
+    Each route maps a path to a function returning the body of the answer.
+    The server runs in its own daemon thread, so the functions should only
+    read the controller state.
+
+    Args:
+        port: The TCP port to listen on
+        address: The address to bind
+    """
+
+    def __init__(self, port, address='127.0.0.1'):
+        self.routes = {}
+        routes = self.routes
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                route = routes.get(path)
+                if route is None:
+                    self.send_error(404)
+                    return
+                content_type, func = route
+                try:
+                    body = func()
+                except Exception:
+                    log.exception("Status route %s failed", path)
+                    self.send_error(500)
+                    return
+                if not isinstance(body, bytes):
+                    body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer((address, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def add_route(self, path, func, content_type='text/plain'):
+        """Serve the string returned by func on path.
+
+        Args:
+            path: The path of the route (e.g. /status)
+            func: Function without argument returning the body
+            content_type: The content type of the body
+        """
+        self.routes[path] = (content_type, func)
+
+    def add_json_route(self, path, func):
+        """Serve the object returned by func on path, encoded in JSON.
+
+        Args:
+            path: The path of the route (e.g. /status)
+            func: Function without argument returning the object
+        """
+        self.add_route(path, lambda: json.dumps(func()), 'application/json')
+
+    def start(self):
+        """Start serving in the background."""
+        self.thread.start()
+        log.debug("Status served on %s:%d" % self.server.server_address)
+
+
+def mac_tables_status(switches):
+    """Returns dpid -> status of the MacTables learned by switches, for
+    those whose mac_to_port is one."""
+    tables = {}
+    for (dpid, switch) in switches.items():
+        status = getattr(getattr(switch, 'mac_to_port', None), 'status', None)
+        if status is not None:
+            tables[str(dpid)] = status()
+    return tables
+
+
+def serve_status(controller, port, profiler=None):
+    """Serve the convergence state of a controller on /status, its metrics
+    on /metrics, its flow timeouts on /timeouts, its traffic accounting
+    on /accounting and the occupancy of its MAC tables on /mac_tables.
+
+    Args:
+        controller: The controller, with convergence, metrics and switches
+                    attributes
+        port: The TCP port to listen on, 0 to disable the endpoint
+        profiler: The Profiler to control under /profile, if any
+    returns:
+        The StatusServer, or None if disabled
+    """
+    if not port:
+        return None
+    server = StatusServer(port)
+    server.add_json_route('/status', controller.convergence.status)
+    server.add_route('/metrics', controller.metrics.render,
+                     'text/plain; version=0.0.4')
+    timeouts = getattr(controller, 'timeouts', None)
+    if timeouts is not None:
+        server.add_json_route('/timeouts', timeouts.status)
+    accounting = getattr(controller, 'accounting', None)
+    if accounting is not None:
+        server.add_json_route('/accounting', accounting.status)
+    server.add_json_route('/mac_tables', lambda: mac_tables_status(controller.switches))
+    if profiler is not None:
+        profiler.add_routes(server)
+    server.start()
+    return server
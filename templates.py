@@ -0,0 +1,121 @@
+"""Pre-packed flow_mod and packet_out messages.
+
+The flow_mods the controllers send on packet-ins only differ in their
+addresses, output port, timeouts, flags and buffer_id. A FlowModTemplate
+packs a message of each shape once, with POX, then copies its bytes and
+patches these fields in place for every message, instead of building and
+packing an ofp_flow_mod, ofp_match and ofp_action_output each time. The
+packet_outs are packed the same way from a pre-packed output action.
+
+The offsets are those of OpenFlow 1.0: the xid at 4, dl_src at 14 and
+dl_dst at 20 in the match, then idle_timeout, hard_timeout, priority,
+buffer_id, out_port and flags from 58, and the output actions from 72.
+"""
+
+import struct
+
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+
+NO_BUFFER = 0xffffffff
+
+_xid = struct.Struct('!I')
+_mac = struct.Struct('!6s')
+_flow_fields = struct.Struct('!HHHIHH')  # idle, hard, priority, buffer_id, out_port, flags
+_port = struct.Struct('!H')
+_packet_out = struct.Struct('!BBHIIHH')  # header, buffer_id, in_port, actions_len
+
+XID_OFFSET = 4
+DL_SRC_OFFSET = 14
+DL_DST_OFFSET = 20
+FLOW_FIELDS_OFFSET = 58
+FLOW_ACTIONS_OFFSET = 72
+ACTION_PORT_OFFSET = 2
+
+
+class FlowModTemplate(object):
+    """A flow_mod matching on Ethernet addresses, with at most one output.
+
+    Args:
+        fields: The match fields set by pack(), among 'dl_src' and 'dl_dst'
+        command: The flow_mod command
+        priority: The priority of the flow
+        output: Whether the flow has an output action, else it drops
+    """
+
+    def __init__(self, fields, command=of.OFPFC_ADD,
+                 priority=of.OFP_DEFAULT_PRIORITY, output=True):
+        zero = EthAddr('00:00:00:00:00:00')
+        msg = of.ofp_flow_mod(command=command)
+        msg.match = of.ofp_match(**dict((field, zero) for field in fields))
+        msg.priority = priority
+        if output:
+            msg.actions.append(of.ofp_action_output(port=0))
+        self.data = msg.pack()
+        self.priority = priority
+        self.output = output
+
+    def pack(self, dl_src=None, dl_dst=None, port=None, idle_timeout=0,
+             hard_timeout=0, buffer_id=None, flags=0, priority=None):
+        """Returns the packed flow_mod of some field values.
+
+        Args:
+            dl_src: The source EthAddr, if the template matches it
+            dl_dst: The destination EthAddr, if the template matches it
+            port: The output port, if the template has an output
+            idle_timeout: The idle timeout in seconds
+            hard_timeout: The hard timeout in seconds
+            buffer_id: The buffer of the packet to apply the flow to, or None
+            flags: The flow_mod flags (e.g. OFPFF_SEND_FLOW_REM)
+            priority: The priority, if not the one of the template
+        """
+        data = bytearray(self.data)
+        _xid.pack_into(data, XID_OFFSET, of.generate_xid())
+        if dl_src is not None:
+            _mac.pack_into(data, DL_SRC_OFFSET, dl_src.toRaw())
+        if dl_dst is not None:
+            _mac.pack_into(data, DL_DST_OFFSET, dl_dst.toRaw())
+        _flow_fields.pack_into(data, FLOW_FIELDS_OFFSET, idle_timeout, hard_timeout,
+                               self.priority if priority is None else priority,
+                               NO_BUFFER if buffer_id is None else buffer_id,
+                               of.OFPP_NONE, flags)
+        if self.output:
+            _port.pack_into(data, FLOW_ACTIONS_OFFSET + ACTION_PORT_OFFSET, port)
+        return bytes(data)
+
+
+# The shapes of the flow_mods of the controllers
+DST_FLOW = FlowModTemplate(('dl_dst',))
+PAIR_FLOW = FlowModTemplate(('dl_src', 'dl_dst'))
+PAIR_MODIFY = FlowModTemplate(('dl_src', 'dl_dst'), command=of.OFPFC_MODIFY_STRICT)
+PAIR_DELETE = FlowModTemplate(('dl_src', 'dl_dst'), command=of.OFPFC_DELETE_STRICT,
+                              output=False)
+PAIR_DROP = FlowModTemplate(('dl_src', 'dl_dst'), priority=of.OFP_DEFAULT_PRIORITY + 1,
+                            output=False)
+
+_OUTPUT = of.ofp_action_output(port=0).pack()
+
+
+def packet_out(in_port, ports, buffer_id=None, data=b''):
+    """Returns a packed packet_out sending a packet to ports.
+
+    Args:
+        in_port: The port the packet came from
+        ports: The output ports
+        buffer_id: The buffer of the packet in the switch, or None
+        data: The packet, if it is not buffered
+    """
+    actions_len = len(_OUTPUT) * len(ports)
+    length = _packet_out.size + actions_len + len(data)
+    msg = bytearray(length)
+    _packet_out.pack_into(msg, 0, of.OFP_VERSION, of.OFPT_PACKET_OUT, length,
+                          of.generate_xid(),
+                          NO_BUFFER if buffer_id is None else buffer_id,
+                          in_port, actions_len)
+    offset = _packet_out.size
+    for port in ports:
+        msg[offset:offset + len(_OUTPUT)] = _OUTPUT
+        _port.pack_into(msg, offset + ACTION_PORT_OFFSET, port)
+        offset += len(_OUTPUT)
+    msg[offset:] = data
+    return bytes(msg)
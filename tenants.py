@@ -13,6 +13,7 @@ class Tenant(object):
         self.n_vlans = n_vlans
         self.vlans_id = [i for i in range(n_vlans)]
         self.vlans = {}
+        self.vlan_core = {}  # vlan id -> core DPID, for vlans moved from their default core
 
         """Initialisation with vlan here, it should match with the topology"""
         self.vlans[EthAddr('00:00:00:00:00:01')] = self.vlans_id[0]
@@ -40,4 +41,77 @@ class Tenant(object):
             (vlan id, core DPID)
         """
         ID = self.vlans[EthAddr]
-        return (self.vlans[EthAddr], (ID % self.nCore) + 1)
+        return (ID, self.getCore(ID))
+
+    def getCore(self, vlan_id):
+        """
+        returns the DPID of the core switch carrying the traffic of a vlan
+
+        Args:
+            vlan_id: The vlan ID
+        """
+        core = self.vlan_core.get(vlan_id)
+        if core is None:
+            core = (vlan_id % self.nCore) + 1
+        return core
+
+    def setCore(self, vlan_id, coreDPID):
+        """
+        Assigns a vlan to a core switch
+
+        Args:
+            vlan_id: The vlan ID
+            coreDPID: The DPID of the core switch
+        """
+        if vlan_id not in self.vlans_id:
+            raise ValueError("Unknown vlan id %r" % (vlan_id,))
+        self.vlan_core[vlan_id] = coreDPID
+
+    def hostsOf(self, vlan_id):
+        """
+        returns the Ethernet MAC addresses of the hosts of a vlan
+
+        Args:
+            vlan_id: The vlan ID
+        """
+        return [mac for (mac, ID) in self.vlans.items() if ID == vlan_id]
+
+    def isAllowed(self, src, dst):
+        """
+        returns whether a host may send a frame to a destination: both hosts
+        must be in the same vlan, and broadcast or multicast frames are only
+        allowed from known hosts
+
+        Args:
+            src: The source Ethernet MAC address
+            dst: The destination Ethernet MAC address
+        returns:
+            True if the frame is allowed
+        """
+        vlan = self.vlans.get(src)
+        if vlan is None:
+            return False
+        if dst.is_multicast:
+            return True
+        return self.vlans.get(dst) == vlan
+
+    def setVlan(self, EthAddr, vlan_id):
+        """
+        Adds a host to a vlan, or moves it from its current vlan
+
+        Args:
+            EthAddr: The Ethernet MAC address of the Host
+            vlan_id: The vlan ID
+        """
+        if vlan_id not in self.vlans_id:
+            raise ValueError("Unknown vlan id %r" % (vlan_id,))
+        self.vlans[EthAddr] = vlan_id
+
+    def removeHost(self, EthAddr):
+        """
+        Removes a host from its vlan, after which it may not send anything
+
+        Args:
+            EthAddr: The Ethernet MAC address of the Host
+        """
+        self.vlans.pop(EthAddr, None)
@@ -2,8 +2,14 @@
 """Tests the controller performance on a Clos-like topology."""
 
 import argparse
+import json
 import time
 
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
 from mininet.link import TCLink
 from mininet.log import error, info, lg
 from mininet.net import Mininet
@@ -13,27 +19,69 @@ from mininet.util import waitListening
 from clostopo import ClosTopo
 
 
-def closTest(duration, discovery_time):
+def waitConverged(status_url, timeout, interval=0.2):
+    """Wait until the controller reports a converged fabric.
+
+    Args:
+        status_url: URL of the controller status endpoint
+        timeout: maximum time to wait in seconds
+        interval: time between two polls of the endpoint in seconds
+    Returns:
+        True if the fabric converged before the timeout
+    """
+    start = time.time()
+    status = None
+    while time.time() - start < timeout:
+        try:
+            status = json.loads(urlopen(status_url, timeout=1).read())
+        except (IOError, ValueError):
+            status = None
+        if status is not None:
+            info("\rswitches {}/{}, links {}/{}".format(
+                status['switches']['connected'],
+                status['switches']['expected'],
+                status['links']['discovered'],
+                status['links']['expected']))
+            if status['converged']:
+                info(" in {:.1f}s\n".format(time.time() - start))
+                return True
+        time.sleep(interval)
+    info('\n')
+    return False
+
+
+def closTest(duration, discovery_time, status_url, describe=None,
+             controllers=None):
     """Test the controller performance on a Clos-like topology.
 
     Args:
-        discovery_time: how long to wait for controller topology discovery in
-                        seconds
+        discovery_time: maximum time to wait for controller topology discovery
+                        in seconds
+        status_url: URL of the controller status endpoint
+        describe: path where to write the topology description for the
+                  controllers (launch them with --topo=PATH), or None
+        controllers: OpenFlow ports of the local members of a controller
+                     cluster, every switch connects to all of them, or None
+                     for a single controller on the default port
     """
     # If you modify the topology on next line, you will also likely want to
     # modify the tests done below
     topo = ClosTopo(nCore=2, nEdge=3, nHosts=4, bw=10)
+    if describe:
+        topo.description.save(describe)
     net = Mininet(topo=topo, switch=OVSKernelSwitch,
-                  controller=RemoteController, autoSetMacs=True,
-                  autoStaticArp=True, waitConnected=True,
+                  controller=None if controllers else RemoteController,
+                  autoSetMacs=True, autoStaticArp=True, waitConnected=True,
                   link=TCLink)
+    for (i, port) in enumerate(controllers or []):
+        net.addController('c{}'.format(i), controller=RemoteController,
+                          ip='127.0.0.1', port=port)
     net.start()
 
     info("*** Waiting for controller topology discovery\n")
-    for i in range(discovery_time, -1, -1):
-        info("\r{:02d}".format(i))
-        time.sleep(1)
-    info('\n')
+    if not waitConverged(status_url, discovery_time):
+        error("Controller did not converge in {}s, testing anyway\n"
+              .format(discovery_time))
 
     h1, h2, h3, h4 = net.getNodeByName('h1', 'h2', 'h3', 'h4')
     clients = [h1, h2, h3, h4]
@@ -75,13 +123,7 @@ def closTest(duration, discovery_time):
     h3.sendCmd(small.format("10.0.0.7", duration))
     h4.sendCmd(small.format("10.0.0.12", duration))
 
-    info("*** Measuring\n")
-    for i in range(duration + 5, -1, -1):
-        info("\r{:03d}".format(i))
-        time.sleep(1)
-    info('\n')
-
-    info("*** Waiting for clients to finish\n")
+    info("*** Measuring for {}s\n".format(duration))
     results = {}
     for c in clients:
         results[c] = c.waitOutput()
@@ -104,8 +146,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--duration", help="test duration in seconds",
                         type=int, default=60)
-    parser.add_argument("--discovery", help="discovery time in seconds",
-                        type=int, default=3)
+    parser.add_argument("--discovery",
+                        help="maximum discovery time in seconds",
+                        type=int, default=30)
+    parser.add_argument("--status", help="controller status URL",
+                        default="http://127.0.0.1:8080/status")
+    parser.add_argument("--describe",
+                        help="write the topology description to this file")
+    parser.add_argument("--controllers",
+                        help="comma-separated OpenFlow ports of the members "
+                             "of a controller cluster")
     args = parser.parse_args()
 
     if (args.duration < 30):
@@ -113,4 +163,8 @@ if __name__ == "__main__":
         exit(1)
 
     lg.setLogLevel('info')
-    closTest(args.duration, args.discovery)
+    controllers = None
+    if args.controllers:
+        controllers = [int(port) for port in args.controllers.split(',')]
+    closTest(args.duration, args.discovery, args.status, args.describe,
+             controllers)
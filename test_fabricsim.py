@@ -0,0 +1,35 @@
+"""Tests of the max-min fair allocation of the fabric simulator."""
+
+import unittest
+
+import numpy as np
+
+from fabricsim import max_min_rates
+
+
+class MaxMinRatesTest(unittest.TestCase):
+
+    def test_single_link_is_shared_equally(self):
+        rates = max_min_rates(np.array([[0], [0], [0]]), [9.0])
+        np.testing.assert_allclose(rates, [3.0, 3.0, 3.0])
+
+    def test_two_links(self):
+        # Flow 1 crosses both links, the second link (4) is its bottleneck
+        # and it is shared with flow 2, flow 0 gets what is left of link 0
+        links = np.array([[0, -1], [0, 1], [1, -1]])
+        rates = max_min_rates(links, [10.0, 4.0])
+        np.testing.assert_allclose(rates, [8.0, 2.0, 2.0])
+
+    def test_bottlenecks_of_successive_rounds(self):
+        # Link 1 settles flows 1 and 2 first, then link 0 is shared by
+        # flows 0 and 3, which are not limited by link 2
+        links = np.array([[0, 2], [0, 1], [1, -1], [0, -1]])
+        rates = max_min_rates(links, [10.0, 2.0, 100.0])
+        np.testing.assert_allclose(rates, [4.5, 1.0, 1.0, 4.5])
+
+    def test_no_flows(self):
+        self.assertEqual(len(max_min_rates(np.zeros((0, 2), dtype=int), [1.0])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
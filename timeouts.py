@@ -0,0 +1,207 @@
+"""Idle and hard timeouts of the installed flows, tuned per flow class.
+
+The controllers give every flow they install a class (e.g. 'edge' or
+'core') and take its timeouts from a TimeoutController instead of
+hard-coding them. The controller learns from the FlowRemoved messages of
+the flows, which are installed with OFPFF_SEND_FLOW_REM, and from the
+packet-ins of flows that come back shortly after they timed out.
+"""
+
+import time
+
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+
+MAX_TIMEOUT = 0xffff  # The timeouts are 16 bits in OpenFlow 1.0
+
+
+class FlowClass(object):
+    """Timeouts and counters of a class of flows.
+
+    Args:
+        idle: The initial idle timeout in seconds, 0 for none
+        hard: The initial hard timeout in seconds, 0 for none
+    """
+
+    __slots__ = ('idle', 'ratio', 'hard', 'live', 'installs', 'returns', 'removals')
+
+    def __init__(self, idle, hard):
+        self.idle = float(idle)
+        self.hard = hard
+        # The hard timeout follows the idle one, with the initial ratio
+        self.ratio = float(hard) / idle if idle and hard else 0
+        self.live = 0  # Flows in the tables
+        self.installs = 0  # Flows installed during the interval
+        self.returns = 0  # Flows missed again soon after a timeout, during the interval
+        self.removals = 0  # Flows removed by a timeout during the interval
+
+    def timeouts(self):
+        """Returns the (idle, hard) timeouts in whole seconds."""
+        idle = int(round(self.idle))
+        hard = int(round(self.idle * self.ratio)) if self.ratio else self.hard
+        return (idle, min(MAX_TIMEOUT, max(hard, idle)) if hard else 0)
+
+    def status(self):
+        (idle, hard) = self.timeouts()
+        return {'idle_timeout': idle, 'hard_timeout': hard, 'live': self.live,
+                'installs': self.installs, 'returns': self.returns,
+                'removals': self.removals}
+
+
+class TimeoutController(object):
+    """Picks the timeouts of every flow class to meet a packet-in rate and a
+    table occupancy target.
+
+    A flow is keyed by (dpid, dl_src, dl_dst), dl_src being None for the
+    flows matching only their destination. A flow returns when a packet-in
+    of its key arrives less than recall seconds after it timed out.
+
+    Every interval, when the flows in the tables exceed the table target,
+    the idle timeouts of the classes whose flows seldom return are halved
+    (all of them if the packet-in rate is under its target). Otherwise, when
+    the packet-in rate exceeds its target, the idle timeouts of the classes
+    whose flows return are doubled. The hard timeouts keep their initial
+    ratio to the idle ones. Classes with no idle timeout are never tuned.
+
+    Args:
+        defaults: The initial (idle, hard) timeouts of each flow class
+        adapt: Tune the timeouts, otherwise only the defaults are used
+        packet_in_rate: The target of packet-ins per second, all switches
+        table_size: The target of tuned flows in the tables, all switches
+        interval: The time between two adaptations in seconds
+        recall: The time after a timeout during which a flow returns
+        min_idle: The minimum idle timeout in seconds
+        max_idle: The maximum idle timeout in seconds
+        return_target: The ratio of returning flows under which a class
+                       is shortened first
+        send_flow_rem: Ask for the removal of every flow, e.g. for its
+                       final counters, and not only of the tuned ones
+    """
+
+    def __init__(self, defaults, adapt=True, packet_in_rate=100.0, table_size=1000,
+                 interval=5, recall=30, min_idle=1, max_idle=300, return_target=0.1,
+                 send_flow_rem=False):
+        self.classes = dict((name, FlowClass(idle, hard))
+                            for (name, (idle, hard)) in defaults.items())
+        self.adapt = adapt
+        self.packet_in_rate = packet_in_rate
+        self.table_size = table_size
+        self.interval = interval
+        self.recall = recall
+        self.min_idle = min_idle
+        self.max_idle = max_idle
+        self.return_target = return_target
+        self.send_flow_rem = send_flow_rem
+        self.live = {}  # flow key -> flow class, of the flows in the tables
+        self.timed_out = {}  # flow key -> (flow class, time of the timeout)
+        self.packet_ins = 0  # During the interval
+        self.rate = 0.0  # Packet-ins per second during the last interval
+        if adapt:
+            Timer(interval, self._adapt, recurring=True)
+
+    def timeouts(self, flow_class):
+        """Returns the (idle, hard) timeouts of a flow class."""
+        return self.classes[flow_class].timeouts()
+
+    def apply(self, msg, flow_class, key):
+        """Sets the timeouts of a flow-mod adding a flow, and tracks the flow.
+
+        Args:
+            msg: The ofp_flow_mod
+            flow_class: The name of the class of the flow
+            key: The (dpid, dl_src, dl_dst) of the flow
+        """
+        (msg.idle_timeout, msg.hard_timeout, flags) = self.install(flow_class, key)
+        msg.flags |= flags
+
+    def install(self, flow_class, key):
+        """Tracks a flow being added, for the flow-mods packed without
+        ofp_flow_mod.
+
+        Args:
+            flow_class: The name of the class of the flow
+            key: The (dpid, dl_src, dl_dst) of the flow
+        returns:
+            The (idle, hard) timeouts and the flags of the flow-mod
+        """
+        cls = self.classes[flow_class]
+        (idle, hard) = cls.timeouts()
+        if not self.adapt or not cls.idle:
+            return (idle, hard, of.OFPFF_SEND_FLOW_REM if self.send_flow_rem else 0)
+        cls.installs += 1
+        # Adding a flow already in the table replaces it without any
+        # FlowRemoved, so a key is only counted once
+        if key not in self.live:
+            self.live[key] = flow_class
+            cls.live += 1
+        return (idle, hard, of.OFPFF_SEND_FLOW_REM)
+
+    def packet_in(self, dpid, src, dst):
+        """Counts a packet-in, and whether its flow returns.
+
+        Args:
+            dpid: The DPID of the switch
+            src: The source MAC address of the packet
+            dst: The destination MAC address of the packet
+        """
+        self.packet_ins += 1
+        if not self.timed_out:
+            return
+        now = time.time()
+        for key in ((dpid, src, dst), (dpid, None, dst)):
+            entry = self.timed_out.pop(key, None)
+            if entry is not None and now - entry[1] <= self.recall:
+                self.classes[entry[0]].returns += 1
+
+    def flow_removed(self, dpid, msg):
+        """Learns from the removal of a flow.
+
+        Args:
+            dpid: The DPID of the switch
+            msg: The ofp_flow_removed
+        """
+        key = (dpid, msg.match.dl_src, msg.match.dl_dst)
+        flow_class = self.live.pop(key, None)
+        if flow_class is None:
+            return
+        cls = self.classes[flow_class]
+        cls.live -= 1
+        if msg.reason != of.OFPRR_DELETE:
+            cls.removals += 1
+            self.timed_out[key] = (flow_class, time.time())
+
+    def forget_switch(self, dpid):
+        """Stops tracking the flows of a switch that disconnected.
+
+        Args:
+            dpid: The DPID of the switch
+        """
+        for key in [key for key in self.live if key[0] == dpid]:
+            self.classes[self.live.pop(key)].live -= 1
+
+    def _adapt(self):
+        """Tunes the idle timeouts from the measures of the last interval."""
+        self.rate = self.packet_ins / float(self.interval)
+        self.packet_ins = 0
+        live = sum(cls.live for cls in self.classes.values())
+        tuned = [cls for cls in self.classes.values() if cls.idle]
+        if live > self.table_size:
+            seldom = [cls for cls in tuned
+                      if cls.returns <= self.return_target * max(1, cls.installs)]
+            for cls in (seldom if self.rate > self.packet_in_rate and seldom else tuned):
+                cls.idle = max(self.min_idle, cls.idle / 2)
+        elif self.rate > self.packet_in_rate:
+            for cls in tuned:
+                if cls.returns:
+                    cls.idle = min(self.max_idle, cls.idle * 2)
+        for cls in self.classes.values():
+            cls.installs = cls.returns = cls.removals = 0
+
+        now = time.time()
+        self.timed_out = dict((key, entry) for (key, entry) in self.timed_out.items()
+                              if now - entry[1] <= self.recall)
+
+    def status(self):
+        """Returns the timeouts and counters of every flow class."""
+        return {'packet_in_rate': self.rate,
+                'classes': dict((name, cls.status()) for (name, cls) in self.classes.items())}
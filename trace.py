@@ -0,0 +1,266 @@
+"""Recording of the inputs of a controller, and deterministic offline replay.
+
+The recorder writes the switch connections, packet-ins, port-status,
+flow removals, stats replies and discovery link events, in the order the
+controller receives them, to a binary log. A record is a header
+
+    kind (B), time (d), dpid (Q), payload length (I)
+
+followed by the payload: the packed OpenFlow message(s) of the event, the
+features reply for a connection, or (added (B), port1 (H), dpid2 (Q),
+port2 (H)) for a link, dpid being dpid1.
+
+The replayer feeds a log to a controller through a Harness as fast as
+possible, with time.time() returning the recorded times. The timers of the
+controller do not fire, its deferred calls (core.callLater) are run after
+each replayed event, and its offloaded computations are run inline, so the
+replay only depends on the log. It reports the messages the controller sent, with a
+digest of their contents to compare controller versions on the same log.
+
+Examples:
+    ./pox.py openflow.discovery adaptive trace --record=adaptive.trace
+    ./pox.py trace --replay=adaptive.trace --controller=vlans --report=vlans.json
+"""
+
+import hashlib
+import json
+import struct
+import sys
+import time
+
+from pox.core import core
+import pox.lib.recoco as recoco
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+from headless import Harness
+from offload import Offload
+
+log = core.getLogger()
+
+MAGIC = b'OFTRACE1'
+CONNECTION_UP = 1
+CONNECTION_DOWN = 2
+LINK = 3
+PACKET_IN = 4
+PORT_STATUS = 5
+FLOW_REMOVED = 6
+STATS = 7
+
+_record = struct.Struct('!BdQI')
+_link = struct.Struct('!BHQH')
+_length = struct.Struct('!H')
+LLDP_TYPE = b'\x88\xcc'
+
+
+def split_messages(data):
+    """Returns the packed OpenFlow messages of a concatenation."""
+    messages = []
+    offset = 0
+    while offset < len(data):
+        (length,) = _length.unpack_from(data, offset + 2)
+        messages.append(data[offset:offset + length])
+        offset += length
+    return messages
+
+
+def read_trace(path):
+    """Yields the (kind, time, dpid, payload) records of a trace file."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a trace file" % (path,))
+        while True:
+            header = f.read(_record.size)
+            if len(header) < _record.size:
+                return
+            (kind, stamp, dpid, length) = _record.unpack(header)
+            yield (kind, stamp, dpid, f.read(length))
+
+
+class Recorder(object):
+    """Writes the inputs of the controllers to a trace file.
+
+    It listens before the controllers, so the records are in the order the
+    controllers receive the events. The LLDP packet-ins, which discovery
+    handles and stops, are not recorded.
+
+    Args:
+        path: The path of the trace file
+        flush: The time between two flushes of the file in seconds
+    """
+
+    def __init__(self, path, flush=1):
+        self.file = open(path, 'wb', 1 << 16)
+        self.file.write(MAGIC)
+        self.records = 0
+        Timer(flush, self.file.flush, recurring=True)
+        core.addListenerByName('GoingDownEvent', lambda event: self.file.close())
+
+        def startup():
+            core.openflow.addListeners(self, priority=1000)
+            core.openflow_discovery.addListeners(self, priority=1000)
+        core.call_when_ready(startup, ('openflow', 'openflow_discovery'))
+
+    def write(self, kind, dpid, payload=b''):
+        self.file.write(_record.pack(kind, time.time(), dpid, len(payload)))
+        self.file.write(payload)
+        self.records += 1
+
+    def _handle_ConnectionUp(self, event):
+        self.write(CONNECTION_UP, event.dpid, event.connection.features.pack())
+
+    def _handle_ConnectionDown(self, event):
+        self.write(CONNECTION_DOWN, event.dpid)
+
+    def _handle_LinkEvent(self, event):
+        link = event.link
+        self.write(LINK, link.dpid1,
+                   _link.pack(event.added, link.port1, link.dpid2, link.port2))
+
+    def _handle_PacketIn(self, event):
+        if event.ofp.data[12:14] != LLDP_TYPE:
+            self.write(PACKET_IN, event.dpid, event.ofp.pack())
+
+    def _handle_PortStatus(self, event):
+        self.write(PORT_STATUS, event.dpid, event.ofp.pack())
+
+    def _handle_FlowRemoved(self, event):
+        self.write(FLOW_REMOVED, event.dpid, event.ofp.pack())
+
+    def _handle_FlowStatsReceived(self, event):
+        self.write(STATS, event.dpid, b''.join(m.pack() for m in event.ofp))
+
+    def _handle_PortStatsReceived(self, event):
+        self.write(STATS, event.dpid, b''.join(m.pack() for m in event.ofp))
+
+
+class Report(object):
+    """Counts and digests the messages sent by a controller."""
+
+    def __init__(self):
+        self.types = dict((value, name) for (name, value) in of.ofp_type_rev_map.items())
+        self.messages = {}  # type name -> count
+        self.commands = {}  # flow-mod command -> count
+        self.per_switch = {}  # dpid -> count
+        self.bytes = 0
+        self.digest = hashlib.sha1()
+
+    def sink(self, dpid, data):
+        """Records a message sent to a switch."""
+        kind = self.types.get(struct.unpack_from('!B', data, 1)[0], 'unknown')
+        self.messages[kind] = self.messages.get(kind, 0) + 1
+        if kind == 'OFPT_FLOW_MOD':
+            (command,) = _length.unpack_from(data, 56)
+            self.commands[command] = self.commands.get(command, 0) + 1
+        self.per_switch[dpid] = self.per_switch.get(dpid, 0) + 1
+        self.bytes += len(data)
+        # The xids differ from a run to another, they are not digested
+        self.digest.update(struct.pack('!Q', dpid) + data[:4] + data[8:])
+
+    def result(self):
+        return {'messages': self.messages,
+                'flow_mod_commands': dict((str(c), n) for (c, n) in self.commands.items()),
+                'per_switch': dict((str(d), n) for (d, n) in self.per_switch.items()),
+                'bytes': self.bytes,
+                'digest': self.digest.hexdigest()}
+
+
+class DeferredCalls(object):
+    """Stands for core.scheduler during a replay, keeping the calls deferred
+    with core.callLater until they are run."""
+
+    def __init__(self):
+        self.calls = []
+
+    def callLater(self, func, *args, **kw):
+        self.calls.append((func, args, kw))
+
+    def run(self):
+        """Runs the deferred calls, and those they defer in turn."""
+        while self.calls:
+            (calls, self.calls) = (self.calls, [])
+            for (func, args, kw) in calls:
+                func(*args, **kw)
+
+
+def replay_trace(path, controller, kw):
+    """Replays a trace in a new instance of a controller.
+
+    Args:
+        path: The path of the trace file
+        controller: The module of the controller (tree, vlans or adaptive)
+        kw: The launch arguments of the controller
+    returns:
+        The report of the messages sent by the controller
+    """
+    module = __import__(controller)
+    report = Report()
+    clock = [0.0]
+    (real_time, scheduler, default) = (time.time, core.scheduler, recoco.defaultScheduler)
+    events = 0
+    start = real_time()
+    try:
+        # The timers of the controller go to a scheduler that never runs,
+        # its deferred calls are run after every event, and it reads the
+        # recorded time
+        recoco.defaultScheduler = None
+        recoco.Scheduler(daemon=True, startInThread=False)  # Becomes the default one
+        deferred = core.scheduler = DeferredCalls()
+        time.time = lambda: clock[0]
+        instance = module.launch(**dict(kw, status_port=0))
+        if getattr(instance, 'offload', None) is not None:
+            instance.offload.pool.terminate()
+            instance.offload = Offload(workers=0)
+        harness = Harness(instance, report.sink)
+        deferred.run()
+        for (kind, stamp, dpid, payload) in read_trace(path):
+            clock[0] = stamp
+            events += 1
+            if kind == CONNECTION_UP:
+                harness.connection_up(dpid, payload)
+            elif kind == CONNECTION_DOWN:
+                harness.connection_down(dpid)
+            elif kind == LINK:
+                (added, port1, dpid2, port2) = _link.unpack(payload)
+                harness.link(bool(added), dpid, port1, dpid2, port2)
+            elif kind == PACKET_IN:
+                harness.packet_in(dpid, payload)
+            elif kind == PORT_STATUS:
+                harness.port_status(dpid, payload)
+            elif kind == FLOW_REMOVED:
+                harness.flow_removed(dpid, payload)
+            elif kind == STATS:
+                harness.stats(dpid, split_messages(payload))
+            deferred.run()
+    finally:
+        # The rest of the process keeps the real clock and scheduler
+        time.time = real_time
+        core.scheduler = scheduler
+        recoco.defaultScheduler = default
+    result = report.result()
+    result['controller'] = controller
+    result['events'] = events
+    result['seconds'] = real_time() - start
+    return result
+
+
+def launch(record=None, replay=None, controller='adaptive', report=None, **kw):
+    """
+    Record the inputs of the controllers, or replay a trace offline.
+
+    Args:
+        record: The trace file to write
+        replay: The trace file to replay, after which POX exits
+        controller: The module of the replayed controller (tree, vlans or adaptive)
+        report: The file where to write the replay report, printed if not given
+        kw: The launch arguments of the replayed controller (nCore, nEdge, ...)
+    """
+    if record:
+        core.registerNew(Recorder, record)
+    if replay:
+        result = json.dumps(replay_trace(replay, controller, kw), indent=2, sort_keys=True)
+        if report:
+            with open(report, 'w') as f:
+                f.write(result)
+        else:
+            sys.stdout.write(result + '\n')
+        core.scheduler.callLater(core.quit)
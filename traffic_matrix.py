@@ -0,0 +1,263 @@
+"""Live estimate of the traffic exchanged between edges and between hosts."""
+
+import time
+from array import array
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+from closdesc import ClosDescription
+from fastparse import PacketHeaders
+
+log = core.getLogger()
+
+
+def ema(value, sample, alpha):
+    """Returns an exponential moving average updated with a sample."""
+    return value + alpha * (sample - value)
+
+
+def smooth(rates, deltas, elapsed, alpha, floor=1.0):
+    """Updates a sparse dict of rates from the bytes counted since the last
+    measure, forgetting the rates that fall under floor.
+
+    Args:
+        rates: The dict key -> rate in bytes per second
+        deltas: The dict key -> bytes counted over elapsed
+        elapsed: The time since the last measure in seconds
+        alpha: The weight of the last measure in the moving average
+        floor: The rate under which a key is forgotten
+    """
+    for key in set(rates) | set(deltas):
+        rate = ema(rates.get(key, 0.0), deltas.get(key, 0) / elapsed, alpha)
+        if rate < floor:
+            rates.pop(key, None)
+        else:
+            rates[key] = rate
+
+
+class ByteDeltas(object):
+    """Last byte counters of the stats replies of every switch.
+
+    Args:
+        flows: The counters are those of flows, which start from zero when
+               the flow is installed, so that all the bytes of a new or
+               reinstalled flow count. Otherwise (ports) a new counter or
+               one that went backwards counts nothing.
+    """
+
+    def __init__(self, flows=True):
+        self.flows = flows
+        self.counters = {}  # dpid -> {key: last byte count}
+        self.replies = {}  # dpid -> time of the last reply
+
+    def update(self, dpid, counts, now):
+        """Replaces the counters of a switch with those of a new reply.
+
+        Args:
+            dpid: The DPID of the switch
+            counts: The dict key -> byte count of the reply
+            now: The time of the reply in seconds
+        returns:
+            The dict key -> bytes counted since the previous reply, and the
+            time elapsed since it, 0 for the first reply
+        """
+        elapsed = now - self.replies.get(dpid, now)
+        self.replies[dpid] = now
+        old = self.counters.get(dpid, {})
+        deltas = {}
+        for (key, count) in counts.items():
+            previous = old.get(key)
+            if previous is not None and count >= previous:
+                deltas[key] = count - previous
+            else:
+                deltas[key] = count if self.flows else 0
+        self.counters[dpid] = counts
+        return (deltas, elapsed)
+
+
+class TrafficMatrix(object):
+    """Edge x edge and host x host traffic matrix of the fabric.
+
+    Edge switches are polled for their flow and port statistics. The bytes
+    of each flow are attributed at the edge of its source host only, so
+    that a flow crossing the fabric is counted once. The traffic leaving an
+    edge by its uplinks that no flow explains (e.g. rules matching only the
+    destination) is kept as unattributed traffic of that edge.
+
+    Rates are in bytes per second, smoothed with an exponential moving
+    average. The edge matrix is a flat array of nEdge * nEdge doubles and
+    the host matrix is sparse, one dict of (src, dst) host indexes per
+    source edge, so that a stats reply only updates the row of its edge.
+
+    Args:
+        nCore: The number of core switch
+        nEdge: The number of edge switch
+        nHosts: The number of hosts per edge
+        bw: The bandwidth of each link
+        interval: The polling interval of the edges in seconds
+        alpha: The weight of the last measure in the moving average
+    """
+
+    def __init__(self, nCore=2, nEdge=3, nHosts=3, bw=10, interval=3,
+                 alpha=0.5):
+        self.topo = ClosDescription(nCore, nEdge, nHosts, bw)
+        self.alpha = alpha
+        self.edges = [int(name[1:]) for name in self.topo.edgeSwitches()]
+        self.edge_index = dict((dpid, i) for (i, dpid) in enumerate(self.edges))
+        n = len(self.edges)
+        self.edge_rates = array('d', [0.0]) * (n * n)
+        self.unattributed = array('d', [0.0]) * n
+
+        self.hosts = {}  # MAC address -> host index
+        self.host_macs = []  # host index -> MAC address
+        self.host_edge = array('i')  # host index -> edge index
+        self.host_rates = [{} for _ in range(n)]  # per source edge
+
+        self.switch_ports = {}  # dpid -> ports connected to other switches
+        self.flow_bytes = ByteDeltas()  # Of the flows of every edge
+        self.uplink_bytes = ByteDeltas(flows=False)  # Sent on the uplinks
+        # Rate of the flows leaving each edge, as of its last flow stats:
+        # any poller's stats replies update the counters, so the flow and
+        # port deltas are over different intervals and only their rates
+        # can be compared
+        self.attributed = array('d', [0.0]) * n
+
+        Timer(interval, self._timer_func, recurring=True)
+
+        def startup():
+            """Start events"""
+            core.openflow.addListeners(self)
+            core.openflow_discovery.addListeners(self)
+        core.call_when_ready(startup, ('openflow', 'openflow_discovery'))
+
+    def demand(self, src_dpid, dst_dpid):
+        """Returns the rate from an edge to another.
+
+        Args:
+            src_dpid: The DPID of the source edge
+            dst_dpid: The DPID of the destination edge
+        """
+        n = len(self.edges)
+        return self.edge_rates[self.edge_index[src_dpid] * n +
+                               self.edge_index[dst_dpid]]
+
+    def edge_matrix(self):
+        """Returns the edge matrix as a list of rows, in the order of edges."""
+        n = len(self.edges)
+        return [list(self.edge_rates[i * n:(i + 1) * n]) for i in range(n)]
+
+    def host_matrix(self):
+        """Returns the host matrix as a dict (src MAC, dst MAC) -> rate."""
+        matrix = {}
+        for row in self.host_rates:
+            for ((s, d), rate) in row.items():
+                matrix[(self.host_macs[s], self.host_macs[d])] = rate
+        return matrix
+
+    def _host(self, mac, edge):
+        """Returns the index of a host, registering it on an edge if new."""
+        index = self.hosts.get(mac)
+        if index is None:
+            index = len(self.host_macs)
+            self.hosts[mac] = index
+            self.host_macs.append(mac)
+            self.host_edge.append(edge)
+        else:
+            self.host_edge[index] = edge
+        return index
+
+    def _timer_func(self):
+        """Request the flow and port statistics of every edge."""
+        for dpid in self.edges:
+            connection = core.openflow.getConnection(dpid)
+            if connection is not None:
+                connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
+                connection.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+
+    def _handle_LinkEvent(self, event):
+        """Keeps the ports connecting switches, which are not host ports."""
+        link = event.link
+        for (dpid, port) in ((link.dpid1, link.port1), (link.dpid2, link.port2)):
+            ports = self.switch_ports.setdefault(dpid, set())
+            if event.added:
+                ports.add(port)
+            elif event.removed:
+                ports.discard(port)
+
+    def _handle_PacketIn(self, event):
+        """Learns the edge of a host from the packets it sends."""
+        edge = self.edge_index.get(event.dpid)
+        if edge is None or event.port in self.switch_ports.get(event.dpid, ()):
+            return
+        packet = PacketHeaders.from_event(event)
+        if packet.valid and not packet.src.is_multicast:
+            self._host(packet.src, edge)
+
+    def _handle_FlowStatsReceived(self, event):
+        """Updates the row of the edge with the flows of its hosts."""
+        edge = self.edge_index.get(event.dpid)
+        if edge is None:
+            return
+        counts = {}
+        pairs = {}  # flow key -> (src, dst) host indexes
+        for flow in event.stats:
+            src = self.hosts.get(flow.match.dl_src)
+            dst = self.hosts.get(flow.match.dl_dst)
+            if src is None or dst is None or self.host_edge[src] != edge:
+                continue
+            key = (flow.priority, flow.match.pack())
+            counts[key] = flow.byte_count
+            pairs[key] = (src, dst)
+        (deltas, elapsed) = self.flow_bytes.update(event.dpid, counts, time.time())
+        edge_delta = {}
+        host_delta = {}
+        for (key, delta) in deltas.items():
+            if delta:
+                (src, dst) = pairs[key]
+                dst_edge = self.host_edge[dst]
+                edge_delta[dst_edge] = edge_delta.get(dst_edge, 0) + delta
+                host_delta[(src, dst)] = host_delta.get((src, dst), 0) + delta
+        if elapsed <= 0:
+            return
+
+        n = len(self.edges)
+        for j in range(n):
+            cell = edge * n + j
+            self.edge_rates[cell] = ema(self.edge_rates[cell],
+                                        edge_delta.get(j, 0) / elapsed, self.alpha)
+        self.attributed[edge] = sum(delta for (j, delta) in edge_delta.items()
+                                    if j != edge) / elapsed
+        smooth(self.host_rates[edge], host_delta, elapsed, self.alpha)
+
+    def _handle_PortStatsReceived(self, event):
+        """Updates the traffic leaving an edge that no flow explains."""
+        edge = self.edge_index.get(event.dpid)
+        if edge is None:
+            return
+        uplinks = self.switch_ports.get(event.dpid, ())
+        counts = dict((portStat.port_no, portStat.tx_bytes) for portStat in event.stats
+                      if portStat.port_no in uplinks)
+        (deltas, elapsed) = self.uplink_bytes.update(event.dpid, counts, time.time())
+        if elapsed > 0:
+            residual = max(0, sum(deltas.values()) / elapsed - self.attributed[edge])
+            self.unattributed[edge] = ema(self.unattributed[edge], residual, self.alpha)
+
+
+def launch(nCore=2, nEdge=3, nHosts=3, bw=10, interval=3, topo=None):
+    """
+    Launch the traffic matrix estimator, next to one of the controllers.
+
+    Args:
+        nCore: The number of core switch
+        nEdge: The number of edge switch
+        nHosts: The number of hosts per edge
+        bw: The bandwidth of each link
+        topo: A topology description written by closdesc.py, which then
+              overrides nCore, nEdge, nHosts and bw
+        interval: The polling interval of the edges in seconds
+    """
+    if topo:
+        (nCore, nEdge, nHosts, bw) = ClosDescription.load(topo).params()
+    core.registerNew(TrafficMatrix, nCore=int(nCore), nEdge=int(nEdge),
+                     nHosts=int(nHosts), bw=int(bw), interval=float(interval))
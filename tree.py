@@ -1,12 +1,30 @@
+import time
+
 from pox.core import core
-from pox.lib.util import dpid_to_str
+from pox.lib.util import dpid_to_str, str_to_bool
 from pox.openflow.discovery import Discovery
 import pox.openflow.libopenflow_01 as of
 from pox.lib.revent import *
-from clostopo import ClosTopo
+import buffers
+import templates
+from broadcast import BroadcastTrees
+from closdesc import ClosDescription
+from convergence import Convergence
+from metrics import Metrics
+from fastparse import PacketHeaders
+from learning import MAC_AGE, MAC_CAPACITY, MacTable
+from accounting import FlowAccounting
+from profiling import profile_handlers
+from snapshot import decode_macs, encode_macs, snapshot_controller
+from status import serve_status
+from timeouts import TimeoutController
 
 log = core.getLogger()
 
+# Initial (idle, hard) timeouts of the flows of each class, 0 for none
+TIMEOUTS = {'edge': (0, 0), 'core': (0, 0)}
+TUNED_TIMEOUTS = {'edge': (10, 60), 'core': (30, 300)}
+
 
 class Switch(EventMixin):
     """
@@ -14,12 +32,18 @@ class Switch(EventMixin):
     a boolean isCore if the switch is whether a Core or not.
     """
 
-    def __init__(self):
+    def __init__(self, metrics, timeouts, mac_to_port, hosts, host_ports):
         self.connection = None
         self.dpid = None
         self._listener = None
         self.isCore = None
-        self.mac_to_port = {}
+        self.mac_to_port = mac_to_port
+        self.hosts = hosts  # MAC address -> DPID of the edge of the host, shared
+        self.host_ports = host_ports  # Ports of the hosts of the switch
+        self.all_metrics = metrics
+        self.metrics = None
+        self.noFlood = set()  # Ports on which flooding is disabled
+        self.timeouts = timeouts
 
     def connect(self, connection, topo):
         """Connect the switch with the controller.
@@ -32,9 +56,11 @@ class Switch(EventMixin):
             self.dpid = connection.dpid
         assert self.dpid == connection.dpid
         self.isCore = topo.isCoreSwitch('s' + str(self.dpid))
+        self.metrics = self.all_metrics.switch(self.dpid)
         self.disconnect()
         self.connection = connection
         self._listeners = self.listenTo(connection)
+        buffers.configure(connection)
 
     def disconnect(self):
         """Disconnect the switch with the controller.
@@ -46,26 +72,27 @@ class Switch(EventMixin):
             self.connection.removeListeners(self._listeners)
             self.connection = None
             self._listeners = None
+            self.timeouts.forget_switch(self.dpid)
 
-    def resend_packet(self, packet_in, out_port):
+    def resend_packet(self, packet_in, *out_ports):
         """
         Instructs the switch to resend a packet that it had sent to us.
         "packet_in" is the ofp_packet_in object the switch had sent to the
-        controller due to a table-miss.
+        controller due to a table-miss. A packet buffered by the switch can
+        only be resent once, so all its ports are given at once.
 
         Args:
             packet_in: the ofp_packet_in object the switch had sent
-            out_port: The port in which the packet will be sent
+            out_ports: The ports in which the packet will be sent
         """
-        msg = of.ofp_packet_out()
-        msg.data = packet_in
-
-        # Add an action to send to the specified port
-        action = of.ofp_action_output(port=out_port)
-        msg.actions.append(action)
+        msg = buffers.packet_out(packet_in, out_ports)
+        if msg is None:
+            log.debug("Cannot resend the truncated packet from port %s", packet_in.in_port)
+            return
 
         # Send message to switch
         self.connection.send(msg)
+        self.metrics.packet_out_to(*out_ports)
 
     def act_like_switch(self, packet, packet_in):
         """
@@ -79,24 +106,26 @@ class Switch(EventMixin):
         #log.debug("Packet in Switch s" + str(self.dpid) + "\n")
         """keep the port corresponding to the source MAC address"""
         self.mac_to_port[packet.src] = packet_in.in_port
+        if packet_in.in_port in self.host_ports:
+            self.hosts[packet.src] = self.dpid
 
         """if the destination is known"""
         if packet.dst in self.mac_to_port:
-            """resend packet to the good port"""
-            self.resend_packet(packet_in, self.mac_to_port[packet.dst])
+            """resend packet to the good port, unless the new flow releases it from the switch buffer"""
+            if not buffers.is_buffered(packet_in):
+                self.resend_packet(packet_in, self.mac_to_port[packet.dst])
             #log.debug("Installing flow...")
             #log.debug("Source MAC: " + str(packet.src))
             #log.debug("Destination MAC: " + str(packet.dst))
             #log.debug("Out port: " + str(self.mac_to_port[packet.dst]) + "\n")
-            """install a permanent flow matching the destination of the packet with the good port"""
-            msg = of.ofp_flow_mod()
-            msg.match = of.ofp_match(dl_dst=packet.dst)
-            msg.idle_timeout = of.OFP_FLOW_PERMANENT
-            msg.hard_timeout = of.OFP_FLOW_PERMANENT
-            msg.buffer_id = packet_in.buffer_id
-            action = of.ofp_action_output(port=self.mac_to_port[packet.dst])
-            msg.actions.append(action)
-            self.connection.send(msg)
+            """install a flow matching the destination of the packet with the good port"""
+            (idle, hard, flags) = self.timeouts.install('core' if self.isCore else 'edge',
+                                                        (self.dpid, None, packet.dst))
+            self.connection.send(templates.DST_FLOW.pack(
+                dl_dst=packet.dst, port=self.mac_to_port[packet.dst],
+                idle_timeout=idle, hard_timeout=hard, flags=flags,
+                buffer_id=packet_in.buffer_id))  # The flow releases the buffered packet
+            self.metrics.flow_mod += 1
         else:
             """if the destination is unknow, flood"""
             self.resend_packet(packet_in, of.OFPP_FLOOD)
@@ -108,13 +137,50 @@ class Switch(EventMixin):
         Args:
             event: The event
         """
-        packet = event.parsed  # This is the parsed packet data.
-        if not packet.parsed:
+        self.metrics.packet_in += 1
+        packet = PacketHeaders.from_event(event)  # Headers read on access from the packet data.
+        if not packet.valid:
             log.warning("Ignoring incomplete packet")
             return
 
         packet_in = event.ofp  # The actual ofp_packet_in message.
+        start = time.time()
+        self.timeouts.packet_in(self.dpid, packet.src, packet.dst)
         self.act_like_switch(packet, packet_in)
+        self.metrics.observe_packet_in(time.time() - start)
+
+    def _handle_FlowRemoved(self, event):
+        """
+        Handles the removal of a flow installed with OFPFF_SEND_FLOW_REM.
+
+        Args:
+            event: The event
+        """
+        self.timeouts.flow_removed(self.dpid, event.ofp)
+
+    def snapshot_state(self):
+        """
+        Returns the learned state of the switch, for warm restarts.
+        """
+        return {'mac_to_port': encode_macs(self.mac_to_port),
+                'noFlood': sorted(self.noFlood)}
+
+    def restore_state(self, state):
+        """
+        Restores the state returned by snapshot_state, on ports that still exist.
+
+        Args:
+            state: The state of the switch
+        """
+        ports = self.connection.ports
+        for (mac, port) in decode_macs(state['mac_to_port']).items():
+            if port in ports:
+                self.mac_to_port[mac] = port
+                if port in self.host_ports:
+                    self.hosts[mac] = self.dpid
+        for port in state['noFlood']:
+            if port in ports:
+                self.disable_flooding(port)
 
     def disable_flooding(self, port):
         """
@@ -126,16 +192,32 @@ class Switch(EventMixin):
         msg = of.ofp_port_mod(
             port_no=port, hw_addr=self.connection.ports[port].hw_addr, config=of.OFPPC_NO_FLOOD, mask=of.OFPPC_NO_FLOOD)
         self.connection.send(msg)
+        self.noFlood.add(port)
 
 
 class Tree (object):
-    def __init__(self, nCore=2, nEdge=3, nHosts=3, bw=10):
-        self.topo = ClosTopo(nCore, nEdge, nHosts, bw)
+    def __init__(self, nCore=2, nEdge=3, nHosts=3, bw=10, tune_timeouts=False,
+                 mac_capacity=MAC_CAPACITY, mac_age=MAC_AGE, accounting=False):
+        self.topo = ClosDescription(nCore, nEdge, nHosts, bw)
+        self.mac_capacity = mac_capacity
+        self.mac_age = mac_age
         self.nCore = nCore
         self.nEdge = nEdge
         self.nHost = nEdge * nHosts
         self.switches = {}
+        self.convergence = Convergence(self.topo, self.switches)
+        self.metrics = Metrics()
+        # The accounted flows need timeouts to ever be removed
+        self.timeouts = TimeoutController(
+            TUNED_TIMEOUTS if tune_timeouts or accounting else TIMEOUTS,
+            adapt=tune_timeouts, send_flow_rem=accounting)
+        self.hosts = {}  # MAC address -> DPID of the edge of the host
+        self.accounting = FlowAccounting(
+            lambda mac: self.hosts.get(mac)) if accounting else None
         self.root = None  # Will be the main switch Core
+        self.restored_root = None  # DPID of the root before a restart
+        self.broadcast = BroadcastTrees(
+            self, lambda edge, port: self.root.dpid if self.root is not None else None)
 
         def startup():
             """Start events"""
@@ -143,6 +225,24 @@ class Tree (object):
             core.openflow_discovery.addListeners(self)
         core.call_when_ready(startup, ('openflow', 'openflow_discovery'))
 
+    def snapshot_state(self):
+        """
+        Returns the chosen root, for warm restarts.
+        """
+        return {'root': self.root.dpid if self.root is not None else None}
+
+    def restore_state(self, state):
+        """
+        Restores the state returned by snapshot_state.
+
+        Args:
+            state: The state of the controller
+        """
+        self.restored_root = state['root']
+        switch = self.switches.get(self.restored_root)
+        if switch is not None and switch.connection is not None:
+            self.root = switch
+
     def _handle_LinkEvent(self, event):
         """
         Handles changes or discovery between switches.
@@ -150,6 +250,8 @@ class Tree (object):
         Args:
             event: The event
         """
+        self.convergence.link_event(event)
+        self.broadcast.link_event(event)
         link = event.link
         switch_1 = self.switches.get(link.dpid1)
         switch_2 = self.switches.get(link.dpid2)
@@ -175,18 +277,24 @@ class Tree (object):
         switch = self.switches.get(event.dpid)
         if switch is None:
             # New switch
-            switch = Switch()
+            switch = Switch(self.metrics, self.timeouts,
+                            MacTable(self.mac_capacity, self.mac_age), self.hosts,
+                            self.broadcast.host_ports.get(event.dpid, ()))
             self.switches[event.dpid] = switch
             switch.connect(event.connection, self.topo)
         else:
             switch.connect(event.connection, self.topo)
 
-        """Update root if needed"""
-        if self.root is None and switch.isCore:
+        """Update root if needed, keeping the root from before a restart
+        as the flows installed in the switches go through it"""
+        if switch.isCore and switch.dpid == self.restored_root:
             self.root = switch
-        elif switch.isCore and switch.dpid < self.root.dpid:
+        elif self.root is None and switch.isCore:
+            self.root = switch
+        elif switch.isCore and switch.dpid < self.root.dpid and self.root.dpid != self.restored_root:
             self.root_dpid = switch.dpid
             self.root = switch
+        self.broadcast.schedule()
 
     def _handle_ConnectionDown(self, event):
         """
@@ -202,6 +310,7 @@ class Tree (object):
             log.debug("Should never happen please")
         else:
             switch.disconnect()
+            self.broadcast.forget_switch(event.dpid)
         log.debug("switch " + dpid_to_str(event.dpid) + " down")
         # Bonus here
 
@@ -213,15 +322,32 @@ class Tree (object):
         Args:
             event: The event
         """
+        switch = self.switches.get(event.dpid)
+        if switch is not None and switch.metrics is not None:
+            switch.metrics.port_status += 1
         if event.added:
             action = "added"
         elif event.deleted:
             action = "removed"
         else:
             action = "modified"
+        log.debug("Port %s on Switch %s has been %s.", event.port, event.dpid, action)
+
+    def _handle_FlowRemoved(self, event):
+        """
+        Accounts the final counters of a removed flow.
+
+        Args:
+            event: The event
+        """
+        if self.accounting is not None:
+            self.accounting.flow_removed(event.dpid, event.ofp)
 
 
-def launch(nCore=2, nEdge=3, nHosts=3, bw=10):
+def launch(nCore=2, nEdge=3, nHosts=3, bw=10, status_port=8080,
+           profile=False, profile_sample=1, snapshot=None, snapshot_interval=10, topo=None,
+           tune_timeouts=False, mac_capacity=MAC_CAPACITY, mac_age=MAC_AGE,
+           accounting=False):
     """
     Launch the POX Controller.
 
@@ -230,5 +356,36 @@ def launch(nCore=2, nEdge=3, nHosts=3, bw=10):
         nEdge: The number of edge switch
         nHosts: The number of hosts per edge
         bw: The bandwidth of each link
+        status_port: The port serving the convergence state, 0 to disable
+        profile: Profile the packet-in and stats handlers, writing the
+                 reports to this directory (the current one if no value
+                 or True is given, False or 0 disable it) when
+                 /profile/dump is requested
+        profile_sample: Profile one handler call out of profile_sample
+        snapshot: The file in which the learned state is saved, and from
+                  which it is restored at start
+        snapshot_interval: The time between two snapshots in seconds
+        topo: A topology description written by closdesc.py, which then
+              overrides nCore, nEdge, nHosts and bw
+        tune_timeouts: Give the flows timeouts tuned to the packet-in rate
+                       and table occupancy, instead of permanent flows
+        mac_capacity: The maximum number of addresses learned per switch,
+                      0 for no limit
+        mac_age: The time after which a learned address that was not seen
+                 again is forgotten, in seconds, 0 for never
+        accounting: Ask for the removal of every flow, and account its final
+                    counters per pair of hosts and per tenant on /accounting.
+                    Permanent flows are never removed, so the flows then get
+                    the initial tuned timeouts, even without tune_timeouts
+    returns:
+        The controller, for the shard workers
     """
-    core.registerNew(Tree, int(nCore), int(nEdge), int(nHosts), int(bw))
+    if topo:
+        (nCore, nEdge, nHosts, bw) = ClosDescription.load(topo).params()
+    tree = core.registerNew(Tree, int(nCore), int(nEdge), int(nHosts), int(bw),
+                            str_to_bool(tune_timeouts), int(mac_capacity),
+                            float(mac_age), str_to_bool(accounting))
+    profiler = profile_handlers(Switch, profile, profile_sample)
+    tree.status_server = serve_status(tree, int(status_port), profiler)
+    snapshot_controller(tree, snapshot, snapshot_interval)
+    return tree
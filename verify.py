@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+"""Static verification of the flow tables of the fabric.
+
+The Verifier collects the flow tables of all the switches with flow stats
+requests, then checks every pair of hosts at once against a model of the
+tables, instead of pinging them:
+
+    - reachability: allowed traffic reaches its destination, or at least
+      the controller, which installs its flows on demand
+    - isolation: no host receives traffic it is not allowed to, as defined
+      by the Tenant of the Vlans controller
+    - loops: no packet comes back to a port it already entered
+    - black holes: allowed traffic is never dropped nor sent to a port
+      without link
+
+The model is the Ethernet header space the controllers match on (in_port,
+dl_src, dl_dst). Addresses that no rule mentions are equivalent, so a
+packet is traced once per class of addresses. A rule matching on other
+fields only applies to part of a class, so the trace follows both that rule
+and the next ones.
+
+The tables can be saved and checked again offline:
+    ./pox.py openflow.discovery vlans verify --dump=tables.json
+    ./verify.py tables.json --topo=clos.json --n-vlans=4
+"""
+
+from __future__ import print_function
+
+import argparse
+import heapq
+import json
+import sys
+import time
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+from pox.lib.recoco import Timer
+from closdesc import ClosDescription
+
+log = core.getLogger()
+
+BROADCAST = 'ff:ff:ff:ff:ff:ff'
+EXACT_PRIORITY = 0x10000  # OpenFlow 1.0 exact matches come before any wildcard
+MAX_REPORTED = 100
+_OTHER_FIELDS = ('dl_vlan', 'dl_vlan_pcp', 'dl_type', 'nw_tos', 'nw_proto',
+                 'nw_src', 'nw_dst', 'tp_src', 'tp_dst')
+
+
+def _dpid(name):
+    return int(name[1:])
+
+
+def flow_rules(stats):
+    """Returns the rules of a flow table from its ofp_flow_stats entries.
+
+    A rule is a dict of its priority, its in_port, dl_src and dl_dst (None
+    when wildcarded), whether it matches other fields (partial), and its
+    output ports (empty to drop).
+    """
+    rules = []
+    for flow in stats:
+        match = flow.match
+        rules.append({
+            'priority': EXACT_PRIORITY if match.is_exact else flow.priority,
+            'in_port': match.in_port,
+            'dl_src': None if match.dl_src is None else str(match.dl_src),
+            'dl_dst': None if match.dl_dst is None else str(match.dl_dst),
+            'partial': any(getattr(match, f) is not None for f in _OTHER_FIELDS),
+            'outputs': [a.port for a in flow.actions
+                        if isinstance(a, of.ofp_action_output)],
+        })
+    return rules
+
+
+class Outcome(object):
+    """Where the packets of a trace went."""
+
+    __slots__ = ('delivered', 'controller', 'dropped', 'loops')
+
+    def __init__(self):
+        self.delivered = set()  # host names
+        self.controller = False
+        self.dropped = set()  # (dpid, reason)
+        self.loops = set()  # dpids where a packet came back
+
+    def merge(self, other):
+        """Adds where the packets of another trace went."""
+        self.delivered |= other.delivered
+        self.controller = self.controller or other.controller
+        self.dropped |= other.dropped
+        self.loops |= other.loops
+
+
+class TableModel(object):
+    """Forwarding model of the flow tables of a ClosDescription fabric.
+
+    Args:
+        topo: The ClosDescription of the fabric
+        tables: dpid -> rules, as returned by flow_rules()
+    """
+
+    def __init__(self, topo, tables):
+        self.topo = topo
+        self.peers = {}  # (dpid, port) -> (node, port)
+        self.ports = {}  # dpid -> ports with a link
+        self.host_port = {}  # host -> (edge dpid, port)
+        for (n1, port1, n2, port2) in topo.portLinks():
+            for (a, pa, b, pb) in ((n1, port1, n2, port2), (n2, port2, n1, port1)):
+                if topo.isSwitch(a):
+                    self.peers[(_dpid(a), pa)] = (b, pb)
+                    self.ports.setdefault(_dpid(a), []).append(pa)
+                else:
+                    self.host_port[a] = (_dpid(b), pb)
+        # Each rule is indexed by the first of dl_dst, dl_src and in_port it
+        # matches exactly, the rules wildcarding all three being kept apart
+        self.tables = {}  # dpid -> ({(field, value): rules}, wildcard rules)
+        sources = set()
+        destinations = set()
+        for (dpid, rules) in tables.items():
+            index = {}
+            wildcards = []
+            ordered = sorted(rules, key=lambda r: -r['priority'])
+            for (position, rule) in enumerate(ordered):
+                for field in ('dl_dst', 'dl_src', 'in_port'):
+                    if rule[field] is not None:
+                        index.setdefault((field, rule[field]), []).append((position, rule))
+                        break
+                else:
+                    wildcards.append((position, rule))
+                sources.add(rule['dl_src'])
+                destinations.add(rule['dl_dst'])
+            self.tables[dpid] = (index, wildcards)
+        # The addresses no rule mentions are all the same class, None
+        self.sources = sources - set([None])
+        self.destinations = destinations - set([None])
+        self._traces = {}  # ((dpid, in_port), src, dst) -> Outcome
+
+    def lookup(self, dpid, in_port, src, dst):
+        """Returns the output ports of the rules a class of packets may hit
+        on a switch, None standing for a table miss."""
+        branches = []
+        (index, wildcards) = self.tables.get(dpid, ({}, ()))
+        candidates = heapq.merge(index.get(('dl_dst', dst), ()),
+                                 index.get(('dl_src', src), ()),
+                                 index.get(('in_port', in_port), ()),
+                                 wildcards)
+        for (_, rule) in candidates:
+            if ((rule['in_port'] is None or rule['in_port'] == in_port) and
+                    (rule['dl_src'] is None or rule['dl_src'] == src) and
+                    (rule['dl_dst'] is None or rule['dl_dst'] == dst)):
+                branches.append(rule['outputs'])
+                if not rule['partial']:
+                    return branches
+        branches.append(None)
+        return branches
+
+    def trace(self, host, src, dst):
+        """Follows the packets of a class sent by a host through the tables.
+
+        Args:
+            host: The name of the sending host
+            src: The class of the source address
+            dst: The class of the destination address
+        returns:
+            The Outcome
+        """
+        return self._follow(self.host_port[host], src, dst)
+
+    def _follow(self, start, src, dst):
+        # Depth first search of the (dpid, in_port) a class of packets
+        # enters, each visited once per trace. The outcome of every port
+        # whose packets do not loop back into the path is cached, so the
+        # traces of the senders of a same class, such as all the senders
+        # when no rule matches their address, share it.
+        done = {}
+        partial = set()  # ports whose outcome misses a loop back into the path
+        on_path = set([start])
+        stack = [(start,) + self._step(start, src, dst)]
+        while stack:
+            (port, outcome, hops) = stack[-1]
+            for hop in hops:
+                if hop in on_path:
+                    outcome.loops.add(hop[0])
+                    partial.add(port)
+                    continue
+                known = done.get(hop) or self._traces.get((hop, src, dst))
+                if known is not None:
+                    outcome.merge(known)
+                    if hop in partial:
+                        partial.add(port)
+                    continue
+                on_path.add(hop)
+                stack.append((hop,) + self._step(hop, src, dst))
+                break
+            else:
+                stack.pop()
+                on_path.discard(port)
+                done[port] = outcome
+                if port not in partial:
+                    self._traces[(port, src, dst)] = outcome
+                if stack:
+                    stack[-1][1].merge(outcome)
+                    if port in partial:
+                        partial.add(stack[-1][0])
+        return done[start]
+
+    def _step(self, port, src, dst):
+        # The outcome of the packets entering a switch port, and the
+        # (dpid, in_port) of the switches they are sent to
+        (dpid, in_port) = port
+        outcome = Outcome()
+        hops = []
+        if dpid not in self.tables:
+            outcome.dropped.add((dpid, 'no flow table'))
+            return (outcome, iter(hops))
+        for outputs in self.lookup(dpid, in_port, src, dst):
+            if outputs is None:
+                outcome.controller = True
+                continue
+            if not outputs:
+                outcome.dropped.add((dpid, 'drop rule'))
+            for out_port in self._expand(dpid, in_port, outputs):
+                if out_port == of.OFPP_CONTROLLER:
+                    outcome.controller = True
+                    continue
+                peer = self.peers.get((dpid, out_port))
+                if peer is None:
+                    outcome.dropped.add((dpid, 'port %s without link' % (out_port,)))
+                elif self.topo.isSwitch(peer[0]):
+                    hops.append((_dpid(peer[0]), peer[1]))
+                else:
+                    outcome.delivered.add(peer[0])
+        return (outcome, iter(hops))
+
+    def _expand(self, dpid, in_port, outputs):
+        ports = []
+        for port in outputs:
+            if port in (of.OFPP_FLOOD, of.OFPP_ALL):
+                ports.extend(p for p in self.ports.get(dpid, ()) if p != in_port)
+            elif port == of.OFPP_IN_PORT:
+                ports.append(in_port)
+            elif port != of.OFPP_LOCAL:
+                ports.append(port)
+        return ports
+
+    def classes(self, mac):
+        """Returns the (source, destination) classes of an address."""
+        return (mac if mac in self.sources else None,
+                mac if mac in self.destinations else None)
+
+
+def verify_tables(topo, tables, allowed=None):
+    """Checks the flow tables of a fabric for every pair of hosts.
+
+    Args:
+        topo: The ClosDescription of the fabric
+        tables: dpid -> rules, as returned by flow_rules()
+        allowed: Function of (src MAC, dst MAC) strings returning whether
+                 the traffic is allowed, everything being allowed if None
+    returns:
+        A dict of the counts of pairs and problems, with up to
+        MAX_REPORTED examples of each problem
+    """
+    start = time.time()
+    model = TableModel(topo, tables)
+    hosts = topo.hosts()
+    macs = dict((h, topo.hostMac(h)) for h in hosts)
+    classes = dict((h, model.classes(macs[h])) for h in hosts)
+    allowed = allowed or (lambda src, dst: True)
+    problems = {'unreachable': [], 'isolation': [], 'loops': [], 'black_holes': []}
+    counts = dict((name, 0) for name in problems)
+    counts.update(pairs=0, reachable=0, via_controller=0)
+
+    def report(problem, entry):
+        counts[problem] += 1
+        if len(problems[problem]) < MAX_REPORTED:
+            problems[problem].append(entry)
+
+    for src in hosts:
+        src_class = classes[src][0]
+        (_, bcast_class) = model.classes(BROADCAST)
+        targets = [(dst, classes[dst][1]) for dst in hosts if dst != src]
+        targets.append((None, bcast_class))
+        checked = set()  # The outcomes shared by several destinations
+        for (dst, dst_class) in targets:
+            outcome = model.trace(src, src_class, dst_class)
+            dst_mac = BROADCAST if dst is None else macs[dst]
+            if id(outcome) not in checked:
+                checked.add(id(outcome))
+                for host in sorted(outcome.delivered):
+                    if host != src and not allowed(macs[src], macs[host]):
+                        report('isolation', {'src': src, 'dst': dst_mac, 'received_by': host})
+                if outcome.loops:
+                    report('loops', {'src': src, 'dst': dst_mac,
+                                     'switches': sorted(outcome.loops)})
+            if not allowed(macs[src], dst_mac):
+                continue
+            if outcome.dropped:
+                report('black_holes', {'src': src, 'dst': dst_mac,
+                                       'drops': ['s%d: %s' % d for d in sorted(outcome.dropped)]})
+            if dst is None:
+                continue
+            counts['pairs'] += 1
+            if dst in outcome.delivered:
+                counts['reachable'] += 1
+            elif outcome.controller:
+                counts['via_controller'] += 1
+            else:
+                report('unreachable', {'src': src, 'dst': dst})
+
+    result = dict(counts)
+    result['examples'] = problems
+    result['switches'] = len(tables)
+    result['rules'] = sum(len(rules) for rules in tables.values())
+    result['seconds'] = time.time() - start
+    return result
+
+
+def tenant_policy(tenant):
+    """Returns the allowed() function of verify_tables() for a Tenant."""
+    return lambda src, dst: tenant.isAllowed(EthAddr(src), EthAddr(dst))
+
+
+class Verifier(object):
+    """Collects the flow tables of the switches and verifies them.
+
+    Args:
+        topo: The ClosDescription of the fabric
+        allowed: The allowed() function of verify_tables(), or None
+        output: The file where to write the last result, if any
+        dump: The file where to write the last collected tables, if any
+        timeout: The time to wait for the flow stats replies in seconds
+    """
+
+    def __init__(self, topo, allowed=None, output=None, dump=None, timeout=5):
+        self.topo = topo
+        self.allowed = allowed
+        self.output = output
+        self.dump = dump
+        self.timeout = timeout
+        self.tables = {}
+        self.pending = set()
+        self.result = None
+        core.openflow.addListeners(self)
+
+    def collect(self):
+        """Requests the flow table of every connected switch."""
+        if self.pending:
+            return  # The previous collection is not done
+        self.tables = {}
+        for connection in core.openflow.connections:
+            self.pending.add(connection.dpid)
+            connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
+        if self.pending:
+            Timer(self.timeout, self._timeout)
+
+    def _timeout(self):
+        if self.pending:
+            log.warning("No flow table from %d switches", len(self.pending))
+            self.pending.clear()
+            self.check()
+
+    def _handle_FlowStatsReceived(self, event):
+        if event.dpid not in self.pending:
+            return
+        self.tables[event.dpid] = flow_rules(event.stats)
+        self.pending.discard(event.dpid)
+        if not self.pending:
+            self.check()
+
+    def check(self):
+        """Verifies the collected tables, and logs and saves the result."""
+        self.result = verify_tables(self.topo, self.tables, self.allowed)
+        r = self.result
+        log.info("Verified %d rules of %d switches in %.2fs: %d/%d pairs reachable "
+                 "(%d through the controller), %d unreachable, %d isolation "
+                 "violations, %d loops, %d black holes",
+                 r['rules'], r['switches'], r['seconds'], r['reachable'],
+                 r['pairs'], r['via_controller'], r['unreachable'],
+                 r['isolation'], r['loops'], r['black_holes'])
+        if self.output:
+            with open(self.output, 'w') as f:
+                json.dump(r, f, indent=2, sort_keys=True)
+        if self.dump:
+            with open(self.dump, 'w') as f:
+                json.dump(dict((str(d), rules) for (d, rules) in self.tables.items()), f)
+        return r
+
+
+def launch(nCore=2, nEdge=3, nHosts=3, bw=10, topo=None, n_vlans=None,
+           delay=10, interval=0, output=None, dump=None):
+    """
+    Verify the flow tables of the fabric.
+
+    Args:
+        nCore: The number of core switch
+        nEdge: The number of edge switch
+        nHosts: The number of hosts per edge
+        bw: The bandwidth of each link
+        topo: A topology description written by closdesc.py, overriding
+              the numbers above
+        n_vlans: Check the isolation of a Tenant of that many vlans. By
+                 default, the tenant of the Vlans controller if it runs,
+                 otherwise all traffic is allowed
+        delay: The time before the first verification in seconds
+        interval: The time between two verifications, 0 to verify once
+        output: The file where to write the result
+        dump: The file where to write the flow tables, for verify.py
+    """
+    if topo:
+        description = ClosDescription.load(topo)
+    else:
+        description = ClosDescription(nCore, nEdge, nHosts, bw)
+
+    def start():
+        if n_vlans is not None:
+            from tenants import Tenant
+            allowed = tenant_policy(Tenant(int(n_vlans), description.nCore))
+        elif core.hasComponent('Vlans'):
+            allowed = tenant_policy(core.Vlans.tenant)
+        else:
+            allowed = None
+        verifier = core.registerNew(Verifier, description, allowed, output, dump)
+        Timer(float(delay), verifier.collect)
+        if float(interval) > 0:
+            Timer(float(delay), lambda: Timer(float(interval), verifier.collect,
+                                              recurring=True))
+    core.call_when_ready(start, ('openflow',))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify flow tables dumped by the verify component")
+    parser.add_argument("tables", help="flow tables written with --dump")
+    parser.add_argument("--topo", help="topology description written by closdesc.py")
+    parser.add_argument("--nCore", type=int, default=2)
+    parser.add_argument("--nEdge", type=int, default=3)
+    parser.add_argument("--nHosts", type=int, default=3)
+    parser.add_argument("--n-vlans", type=int, help="check the isolation of a Tenant of that many vlans")
+    args = parser.parse_args()
+
+    if args.topo:
+        description = ClosDescription.load(args.topo)
+    else:
+        description = ClosDescription(args.nCore, args.nEdge, args.nHosts)
+    allowed = None
+    if args.n_vlans:
+        from tenants import Tenant
+        allowed = tenant_policy(Tenant(args.n_vlans, description.nCore))
+    with open(args.tables) as f:
+        tables = dict((int(d), rules) for (d, rules) in json.load(f).items())
+    result = verify_tables(description, tables, allowed)
+    print(json.dumps(result, indent=2, sort_keys=True))
+    sys.exit(1 if result['isolation'] or result['loops'] or result['unreachable'] else 0)
@@ -1,28 +1,56 @@
+import time
+from collections import OrderedDict
+
 from pox.core import core
-from pox.lib.util import dpid_to_str
+from pox.lib.util import dpid_to_str, str_to_bool
 from pox.openflow.discovery import Discovery
 import pox.openflow.libopenflow_01 as of
 from pox.lib.revent import *
-from clostopo import ClosTopo
+import buffers
+import templates
+from broadcast import BroadcastTrees
+from closdesc import ClosDescription
+from convergence import Convergence
+from metrics import Metrics
+from fastparse import PacketHeaders
+from accounting import FlowAccounting
+from profiling import profile_handlers
+from snapshot import decode_dpids, decode_macs, encode_macs, snapshot_controller
+from status import serve_status
+from timeouts import TimeoutController
 from tenants import Tenant
 from pox.lib.addresses import EthAddr
 
 log = core.getLogger()
 
+DROP_TIMEOUT = 10  # Hard timeout of the rules dropping rejected flows, in seconds
+NEGATIVE_CACHE_SIZE = 1024  # Rejected flows remembered, the oldest are evicted beyond
+
+# Initial (idle, hard) timeouts of the flows of each class, 0 for none
+TIMEOUTS = {'edge': (0, 0), 'core': (0, 0)}
+TUNED_TIMEOUTS = {'edge': (10, 60), 'core': (30, 300)}
+
 
 class Switch(EventMixin):
     """The switch object represents a switch, its connection, contains a Tenant
     for Vlans and a boolean isCore if the switch is whether a Core or not.
     """
 
-    def __init__(self, tenant):
+    def __init__(self, tenant, metrics, timeouts):
         self.connection = None
         self.dpid = None
         self._listener = None
         self.isCore = None
         self.mac_to_port = {}
+        self.all_metrics = metrics
+        self.metrics = None
         self.edgeToCore = {}#Contains port connection edge and core
         self.tenant = tenant
+        self.timeouts = timeouts
+        self.rejected = OrderedDict()  # (src, dst) -> expiry of its drop rule, oldest first
+        self.flows = {}  # (src, dst) -> output port of the installed flows
+        self.flows_of = {}  # MAC address -> keys of the flows it is part of
+        self.coreToEdge = {}  # On a core, edge DPID -> port connected to the edge
 
     def connect(self, connection, topo):
         """Connect the switch with the controller.
@@ -35,9 +63,11 @@ class Switch(EventMixin):
             self.dpid = connection.dpid
         assert self.dpid == connection.dpid
         self.isCore = topo.isCoreSwitch('s' + str(self.dpid))
+        self.metrics = self.all_metrics.switch(self.dpid)
         self.disconnect()
         self.connection = connection
         self._listeners = self.listenTo(connection)
+        buffers.configure(connection)
 
     def disconnect(self):
         """Disconnect the switch with the controller.
@@ -49,26 +79,27 @@ class Switch(EventMixin):
             self.connection.removeListeners(self._listeners)
             self.connection = None
             self._listeners = None
+            self.timeouts.forget_switch(self.dpid)
 
-    def resend_packet(self, packet_in, out_port):
+    def resend_packet(self, packet_in, *out_ports):
         """
         Instructs the switch to resend a packet that it had sent to us.
         "packet_in" is the ofp_packet_in object the switch had sent to the
-        controller due to a table-miss.
+        controller due to a table-miss. A packet buffered by the switch can
+        only be resent once, so all its ports are given at once.
 
         Args:
             packet_in: the ofp_packet_in object the switch had sent
-            out_port: The port in which the packet will be sent
+            out_ports: The ports in which the packet will be sent
         """
-        msg = of.ofp_packet_out()
-        msg.data = packet_in
-
-        # Add an action to send to the specified port
-        action = of.ofp_action_output(port=out_port)
-        msg.actions.append(action)
+        msg = buffers.packet_out(packet_in, out_ports)
+        if msg is None:
+            log.debug("Cannot resend the truncated packet from port %s", packet_in.in_port)
+            return
 
         # Send message to switch
         self.connection.send(msg)
+        self.metrics.packet_out_to(*out_ports)
 
     def act_like_switch(self, packet, packet_in):
         """
@@ -80,6 +111,20 @@ class Switch(EventMixin):
         """
         #log.debug("Packet in Switch s" + str(self.dpid))
 
+        """
+        Drop the frames the tenant policy forbids at the edge, and the copies
+        flooded by the edges to the cores that are not the vlan core of the source
+        """
+        if self.isCore:
+            rejected = (not self.tenant.isAllowed(packet.src, packet.dst) or
+                        self.tenant.getVlanTranslation(packet.src)[1] != self.dpid)
+        else:
+            rejected = (packet_in.in_port not in self.edgeToCore.values() and
+                        not self.tenant.isAllowed(packet.src, packet.dst))
+        if rejected:
+            self.reject(packet, packet_in)
+            return
+
         """If the destination mac address is known"""
         if packet.dst in self.mac_to_port:
             #log.debug("Dst " + str(packet.dst) + " known in the switch")
@@ -92,15 +137,9 @@ class Switch(EventMixin):
                 self.mac_to_port[packet.src] = packet_in.in_port
                 #log.debug("install flow between src <----> dst")
                 self.install_flow(
-                    packet.src, packet.dst, self.mac_to_port[packet.dst], idle_timeout=of.OFP_FLOW_PERMANENT, hard_timeout=of.OFP_FLOW_PERMANENT)
+                    packet.src, packet.dst, self.mac_to_port[packet.dst])
                 self.install_flow(
-                    packet.dst, packet.src, self.mac_to_port[packet.src], idle_timeout=of.OFP_FLOW_PERMANENT, hard_timeout=of.OFP_FLOW_PERMANENT)
-                """If the core switch is not corresponding with the right vlan_id, stop here"""
-                (vlan_id, coreDPID) = self.tenant.getVlanTranslation(packet.src)
-                if coreDPID is not self.dpid:
-                    #log.debug("Not good vlan id, but installed flows anyway")
-                    #log.debug("End treating packet\n")
-                    return
+                    packet.dst, packet.src, self.mac_to_port[packet.src])
             else:
                 """If the switch is a edge"""
                 #log.debug("Current switch is a Edge")
@@ -114,12 +153,12 @@ class Switch(EventMixin):
                     #log.debug("install flow src ----> dst")
                     """ Install flow packet.src ----> packet.dst"""
                     self.install_flow(
-                        packet.src, packet.dst, self.mac_to_port[packet.dst], idle_timeout=of.OFP_FLOW_PERMANENT, hard_timeout=of.OFP_FLOW_PERMANENT)
+                        packet.src, packet.dst, self.mac_to_port[packet.dst])
                     #log.debug("install flow host ----> corresponding vlan core")
                     """ install flow for the Vlan policy packet.dst ----> Core switch given Vlan id of packet.dst"""
                     (vlan_id, coreDPID) = self.tenant.getVlanTranslation(packet.dst)
                     self.install_flow(
-                        packet.dst, packet.src, self.edgeToCore[coreDPID], idle_timeout=of.OFP_FLOW_PERMANENT, hard_timeout=of.OFP_FLOW_PERMANENT)
+                        packet.dst, packet.src, self.edgeToCore[coreDPID])
                 else:
                     """
                     If the packet comes from a host, update mac_to_port dict with the in port,
@@ -129,9 +168,9 @@ class Switch(EventMixin):
                     self.mac_to_port[packet.src] = packet_in.in_port
                     #log.debug("install flow between src <----> dst")
                     self.install_flow(
-                        packet.src, packet.dst, self.mac_to_port[packet.dst], idle_timeout=of.OFP_FLOW_PERMANENT, hard_timeout=of.OFP_FLOW_PERMANENT)
+                        packet.src, packet.dst, self.mac_to_port[packet.dst])
                     self.install_flow(
-                        packet.dst, packet.src, self.mac_to_port[packet.src], idle_timeout=of.OFP_FLOW_PERMANENT, hard_timeout=of.OFP_FLOW_PERMANENT)
+                        packet.dst, packet.src, self.mac_to_port[packet.src])
             """Resend Packet"""
             self.resend_packet(packet_in, self.mac_to_port[packet.dst])
         else:
@@ -141,13 +180,6 @@ class Switch(EventMixin):
                 """If the switch is a core, update mac_to_port dict with the in port"""
                 #log.debug("Current switch is a Core")
                 self.mac_to_port[packet.src] = packet_in.in_port
-
-                """If the core switch is not corresponding with the right vlan_id, stop here"""
-                (vlan_id, coreDPID) = self.tenant.getVlanTranslation(packet.src)
-                if coreDPID is not self.dpid:
-                    #log.debug("Not good vlan id, but maintains info anyway")
-                    #log.debug("End treating packet\n")
-                    return
                 """resend packet"""
                 self.resend_packet(packet_in, of.OFPP_FLOOD)
             else:
@@ -161,32 +193,157 @@ class Switch(EventMixin):
                     """If the packet comes from a hosts, simply flood to hosts and all Core Switches"""
                     #log.debug("Packet received from a host")
                     self.mac_to_port[packet.src] = packet_in.in_port
-                    self.resend_packet(packet_in, of.OFPP_FLOOD)
-                    for dpid in self.edgeToCore:
-                        self.resend_packet(packet_in, self.edgeToCore[dpid])
+                    self.resend_packet(packet_in, of.OFPP_FLOOD, *self.edgeToCore.values())
         #log.debug("End treating packet\n")
 
-    def install_flow(self, src, dst, port, idle_timeout=15, hard_timeout=30):
+    def install_flow(self, src, dst, port):
         """
-        Add flow in the switch table.
+        Add flow in the switch table, with the timeouts of the core or edge flows.
 
         Args:
             src: The source Ethernet frame
             dst: The destination Ethernet frame
-            idle_timeout: /
-            hard_timeout: /
+            port: The output port
         """
         #log.debug("Installing flow...")
         #log.debug("Source MAC: " + str(src))
         #log.debug("Destination MAC: " + str(dst))
         #log.debug("Out port: " + str(port))
-        msg = of.ofp_flow_mod()  # Push rule in table
-        msg.match = of.ofp_match(dl_src=src, dl_dst=dst)
-        msg.idle_timeout = idle_timeout
-        msg.hard_timeout = hard_timeout
-        action = of.ofp_action_output(port=port)
-        msg.actions.append(action)
-        self.connection.send(msg)
+        (idle, hard, flags) = self.timeouts.install('core' if self.isCore else 'edge',
+                                                    (self.dpid, src, dst))
+        self.connection.send(templates.PAIR_FLOW.pack(  # Push rule in table
+            src, dst, port, idle, hard, flags=flags))
+        self.metrics.flow_mod += 1
+        self.index_flow(src, dst, port)
+
+    def index_flow(self, src, dst, port):
+        """
+        Remembers an installed flow, so that the flows of a host can be found.
+
+        Args:
+            src: The source Ethernet frame
+            dst: The destination Ethernet frame
+            port: The output port of the flow
+        """
+        key = (src, dst)
+        self.flows[key] = port
+        self.flows_of.setdefault(src, set()).add(key)
+        self.flows_of.setdefault(dst, set()).add(key)
+
+    def unindex_flow(self, key):
+        """
+        Forgets an installed flow.
+
+        Args:
+            key: The (src, dst) of the flow
+        """
+        del self.flows[key]
+        for mac in key:
+            keys = self.flows_of.get(mac)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.flows_of[mac]
+
+    def modify_flow(self, src, dst, port):
+        """
+        Changes the output port of an installed flow, without removing it, so
+        that no packet of the flow misses the table.
+
+        Args:
+            src: The source Ethernet frame
+            dst: The destination Ethernet frame
+            port: The new output port
+        """
+        self.connection.send(templates.PAIR_MODIFY.pack(src, dst, port))
+        self.metrics.flow_mod += 1
+        self.index_flow(src, dst, port)
+
+    def delete_flow(self, src, dst, priority=of.OFP_DEFAULT_PRIORITY):
+        """
+        Delete exactly the flow of a pair of hosts from the switch table.
+
+        Args:
+            src: The source Ethernet frame
+            dst: The destination Ethernet frame
+            priority: The priority of the flow
+        """
+        self.connection.send(templates.PAIR_DELETE.pack(src, dst, priority=priority))
+        self.metrics.flow_mod += 1
+
+    def forget_host(self, mac):
+        """
+        Delete the flows and the drop rules of a host whose vlan changed, and
+        only them. The host location is kept.
+
+        Args:
+            mac: The Ethernet MAC address of the host
+        returns:
+            The number of deleted flows
+        """
+        keys = list(self.flows_of.get(mac, ()))
+        for key in keys:
+            self.unindex_flow(key)
+        if self.connection is not None:
+            for (src, dst) in keys:
+                self.delete_flow(src, dst)
+        return len(keys) + self.clear_rejected([mac])
+
+    def clear_rejected(self, macs):
+        """
+        Delete the drop rules and negative cache entries of some hosts.
+
+        Args:
+            macs: The Ethernet MAC addresses of the hosts
+        returns:
+            The number of deleted drop rules
+        """
+        macs = set(macs)
+        rejected = [key for key in self.rejected if key[0] in macs or key[1] in macs]
+        for key in rejected:
+            del self.rejected[key]
+            if self.connection is not None:
+                self.delete_flow(key[0], key[1], of.OFP_DEFAULT_PRIORITY + 1)
+        return len(rejected)
+
+    def reject(self, packet, packet_in):
+        """
+        Drops a flow in the switch for DROP_TIMEOUT seconds, and remembers the
+        decision until then, so that the packet-ins sent before the drop rule
+        is installed are ignored without being handled again.
+
+        Args:
+            packet: Parsed packet data
+            packet_in: the ofp_packet_in object the switch had sent
+        """
+        now = time.time()
+        rejected = self.rejected
+        # The expiries increase along the order, so the expired and the
+        # evicted entries are the first ones
+        rejected.pop((packet.src, packet.dst), None)
+        rejected[(packet.src, packet.dst)] = now + DROP_TIMEOUT
+        while rejected and (len(rejected) > NEGATIVE_CACHE_SIZE or
+                            rejected[next(iter(rejected))] <= now):
+            rejected.popitem(last=False)
+        self.metrics.rejected += 1
+
+        # No action: drop, the buffered packet too
+        self.connection.send(templates.PAIR_DROP.pack(
+            packet.src, packet.dst, hard_timeout=DROP_TIMEOUT,
+            buffer_id=packet_in.buffer_id))
+        self.metrics.flow_mod += 1
+
+    def is_rejected(self, src, dst, now):
+        """
+        Returns whether a flow was rejected and its drop rule is still installed.
+
+        Args:
+            src: The source Ethernet MAC address
+            dst: The destination Ethernet MAC address
+            now: The current time
+        """
+        expiry = self.rejected.get((src, dst))
+        return expiry is not None and expiry > now
 
     def _handle_PacketIn(self, event):
         """
@@ -195,12 +352,33 @@ class Switch(EventMixin):
         Args:
             event: The event
         """
-        packet = event.parsed  # This is the parsed packet data.
-        if not packet.parsed:
+        self.metrics.packet_in += 1
+        packet = PacketHeaders.from_event(event)  # Headers read on access from the packet data.
+        if not packet.valid:
             log.warning("Ignoring incomplete packet")
             return
         packet_in = event.ofp  # The actual ofp_packet_in message.
+        start = time.time()
+        if self.is_rejected(packet.src, packet.dst, start):
+            self.metrics.rejected += 1
+            return
+        self.timeouts.packet_in(self.dpid, packet.src, packet.dst)
         self.act_like_switch(packet, packet_in)
+        self.metrics.observe_packet_in(time.time() - start)
+
+    def _handle_FlowRemoved(self, event):
+        """
+        Handles the removal of a flow installed with OFPFF_SEND_FLOW_REM, which
+        timed out unless the controller deleted it.
+
+        Args:
+            event: The event
+        """
+        msg = event.ofp
+        self.timeouts.flow_removed(self.dpid, msg)
+        key = (msg.match.dl_src, msg.match.dl_dst)
+        if msg.reason != of.OFPRR_DELETE and key in self.flows:
+            self.unindex_flow(key)
 
     def add_vlan_rule(self, port, coreDpid):
         """
@@ -213,6 +391,43 @@ class Switch(EventMixin):
         #log.debug("Edge Switch " + str(self.dpid) + " Learns Vlan translation with core Switch " + str(coreDpid))
         self.edgeToCore[coreDpid] = port
 
+    def add_edge_port(self, port, edgeDpid):
+        """
+        If the switch is a Core, it maintains the ports connected to Edge Switches.
+
+        Args:
+            port: The port connected to an Edge Switch
+            edgeDpid: the DPID of the Edge Switch
+        """
+        self.coreToEdge[edgeDpid] = port
+
+    def snapshot_state(self):
+        """
+        Returns the learned state of the switch, for warm restarts.
+        """
+        return {'mac_to_port': encode_macs(self.mac_to_port),
+                'edgeToCore': self.edgeToCore,
+                'flows': [[str(src), str(dst), port]
+                          for ((src, dst), port) in self.flows.items()]}
+
+    def restore_state(self, state):
+        """
+        Restores the state returned by snapshot_state, on ports that still exist.
+
+        Args:
+            state: The state of the switch
+        """
+        ports = self.connection.ports
+        for (mac, port) in decode_macs(state['mac_to_port']).items():
+            if port in ports:
+                self.mac_to_port[mac] = port
+        for (coreDpid, port) in decode_dpids(state['edgeToCore']).items():
+            if port in ports:
+                self.disable_flooding(port)
+                self.add_vlan_rule(port, coreDpid)
+        for (src, dst, port) in state.get('flows', []):
+            self.index_flow(EthAddr(src), EthAddr(dst), port)
+
     def disable_flooding(self, port):
         """
         Disable flooding to a port of the switch.
@@ -241,13 +456,24 @@ class Switch(EventMixin):
 class Vlans(object):
     """The vlan class"""
 
-    def __init__(self, tenant, nCore=2, nEdge=3, nHosts=3, bw=10):
-        self.topo = ClosTopo(nCore, nEdge, nHosts, bw)#The topology of the network
+    def __init__(self, tenant, nCore=2, nEdge=3, nHosts=3, bw=10, tune_timeouts=False,
+                 accounting=False):
+        self.topo = ClosDescription(nCore, nEdge, nHosts, bw)#The topology of the network
         self.nCore = nCore
         self.nEdge = nEdge
         self.nHost = nEdge * nHosts
         self.switches = {}
+        self.convergence = Convergence(self.topo, self.switches)
+        self.metrics = Metrics()
+        # The accounted flows need timeouts to ever be removed
+        self.timeouts = TimeoutController(
+            TUNED_TIMEOUTS if tune_timeouts or accounting else TIMEOUTS,
+            adapt=tune_timeouts, send_flow_rem=accounting)
         self.tenant = tenant#Tenant for the vlans policy
+        self.accounting = FlowAccounting(
+            self.host_edge, lambda mac: self.tenant.vlans.get(mac)) if accounting else None
+        self.broadcast = BroadcastTrees(  # One tree per vlan core, within the vlans
+            self, self._broadcast_root, self._broadcast_group)
 
         def startup():
             """Start events"""
@@ -255,6 +481,194 @@ class Vlans(object):
             core.openflow_discovery.addListeners(self)
         core.call_when_ready(startup, ('openflow', 'openflow_discovery'))
 
+    def snapshot_state(self):
+        """
+        Returns the state of the controller, the rest is kept by its switches.
+        """
+        return {'vlans': encode_macs(self.tenant.vlans),
+                'cores': self.tenant.vlan_core}
+
+    def restore_state(self, state):
+        """
+        Restores the state returned by snapshot_state.
+
+        Args:
+            state: The state of the controller
+        """
+        if 'vlans' in state:
+            self.tenant.vlans = decode_macs(state['vlans'])
+        if 'cores' in state:
+            self.tenant.vlan_core = decode_dpids(state['cores'])
+
+    def add_host(self, mac, vlan_id):
+        """
+        Adds a host to a vlan at runtime.
+
+        Args:
+            mac: The Ethernet MAC address of the host
+            vlan_id: The vlan ID
+        """
+        self.move_host(mac, vlan_id)
+
+    def move_host(self, mac, vlan_id):
+        """
+        Moves a host to another vlan at runtime. Only the flows between the host
+        and its peers, and the drop rules of the host, are deleted from the
+        switches: they are installed again by the next packet-ins following the
+        new vlan.
+
+        Args:
+            mac: The Ethernet MAC address of the host
+            vlan_id: The vlan ID
+        """
+        mac = EthAddr(mac)
+        self.tenant.setVlan(mac, vlan_id)
+        self._forget_host(mac)
+        log.info("Host %s moved to vlan %s", mac, vlan_id)
+
+    def remove_host(self, mac):
+        """
+        Removes a host from its vlan at runtime, after which its traffic is dropped.
+
+        Args:
+            mac: The Ethernet MAC address of the host
+        """
+        mac = EthAddr(mac)
+        self.tenant.removeHost(mac)
+        self._forget_host(mac)
+        log.info("Host %s removed from its vlan", mac)
+
+    def _port_host(self, edge, port):
+        """
+        Returns the address of the host of a vlan learned on a port of an edge,
+        or None.
+
+        Args:
+            edge: The DPID of the edge
+            port: The port of the host
+        """
+        switch = self.switches.get(edge)
+        if switch is None:
+            return None
+        for (mac, p) in switch.mac_to_port.items():
+            if p == port and mac in self.tenant.vlans:
+                return mac
+        return None
+
+    def _broadcast_root(self, edge, port):
+        """
+        Returns the core of the vlan of the host learned on a port of an edge,
+        which is the root of the broadcast tree of the host.
+
+        Args:
+            edge: The DPID of the edge
+            port: The port of the host
+        """
+        mac = self._port_host(edge, port)
+        if mac is None:
+            return None
+        return self.tenant.getCore(self.tenant.vlans[mac])
+
+    def _broadcast_group(self, edge, port):
+        """
+        Returns the (vlan, address) of the host learned on a port of an edge,
+        so that its broadcasts only reach the hosts of its vlan.
+
+        Args:
+            edge: The DPID of the edge
+            port: The port of the host
+        """
+        mac = self._port_host(edge, port)
+        if mac is None:
+            return None
+        return (self.tenant.vlans[mac], mac)
+
+    def host_edges(self):
+        """
+        Returns the DPID of the edge of every host whose location is known.
+        """
+        edges = {}
+        for switch in self.switches.values():
+            if switch.isCore is False:
+                uplinks = switch.edgeToCore.values()
+                for (mac, port) in switch.mac_to_port.items():
+                    if port not in uplinks:
+                        edges[mac] = switch.dpid
+        return edges
+
+    def host_edge(self, mac):
+        """
+        Returns the DPID of the edge of a host, or None if its location is unknown.
+        """
+        for switch in self.switches.values():
+            if switch.isCore is False:
+                port = switch.mac_to_port.get(mac)
+                if port is not None and port not in switch.edgeToCore.values():
+                    return switch.dpid
+        return None
+
+    def move_vlan(self, vlan_id, coreDPID):
+        """
+        Moves the traffic of a vlan to another core switch at runtime.
+
+        The flows of the vlan are first installed on the new core, then the
+        uplink flows of the edges are modified to the new core, and the flows
+        of the old core are deleted last, so that the packets of the vlan are
+        not sent back to the controller.
+
+        Args:
+            vlan_id: The vlan ID
+            coreDPID: The DPID of the new core switch
+        returns:
+            True if the vlan was moved, False if an edge has no link to the core
+        """
+        oldDPID = self.tenant.getCore(vlan_id)
+        if oldDPID == coreDPID:
+            return True
+        edges = [switch for switch in self.switches.values()
+                 if switch.isCore is False and switch.connection is not None]
+        newCore = self.switches.get(coreDPID)
+        if (newCore is None or newCore.connection is None or
+                any(coreDPID not in edge.edgeToCore for edge in edges)):
+            log.warning("Cannot move vlan %s to core %s: not linked to every edge",
+                        vlan_id, coreDPID)
+            return False
+
+        self.tenant.setCore(vlan_id, coreDPID)
+        hosts = set(self.tenant.hostsOf(vlan_id))
+        host_edges = self.host_edges()
+        moved = []
+        for edge in edges:
+            uplink = edge.edgeToCore.get(oldDPID)
+            moved.extend((edge, src, dst) for ((src, dst), port) in edge.flows.items()
+                         if src in hosts and port == uplink)
+
+        newCore.clear_rejected(hosts)
+        for (edge, src, dst) in moved:
+            port = newCore.coreToEdge.get(host_edges.get(dst))
+            if port is not None:
+                newCore.mac_to_port[dst] = port
+                newCore.install_flow(src, dst, port)
+        for (edge, src, dst) in moved:
+            edge.modify_flow(src, dst, edge.edgeToCore[coreDPID])
+        oldCore = self.switches.get(oldDPID)
+        if oldCore is not None:
+            for key in [key for key in oldCore.flows if key[0] in hosts]:
+                oldCore.unindex_flow(key)
+                if oldCore.connection is not None:
+                    oldCore.delete_flow(*key)
+        log.info("Vlan %s moved from core %s to core %s, %d uplink flows migrated",
+                 vlan_id, oldDPID, coreDPID, len(moved))
+        self.broadcast.schedule()
+        return True
+
+    def _forget_host(self, mac):
+        self.broadcast.schedule()
+        deleted = 0
+        for switch in self.switches.values():
+            deleted += switch.forget_host(mac)
+        log.debug("Deleted %d flows of host %s", deleted, mac)
+
     def _handle_LinkEvent(self, event):
         """
         Handles changes or discovery between switches.
@@ -262,6 +676,8 @@ class Vlans(object):
         Args:
             event: The event
         """
+        self.convergence.link_event(event)
+        self.broadcast.link_event(event)
         link = event.link
         switch_1 = self.switches.get(link.dpid1)
         switch_2 = self.switches.get(link.dpid2)
@@ -272,9 +688,11 @@ class Vlans(object):
         if switch_1.isCore and not switch_2.isCore:
             switch_2.disable_flooding(port_2)
             switch_2.add_vlan_rule(port_2, switch_1.dpid)
+            switch_1.add_edge_port(port_1, switch_2.dpid)
         elif switch_2.isCore and not switch_1.isCore:
             switch_1.disable_flooding(port_1)
             switch_1.add_vlan_rule(port_1, switch_2.dpid)
+            switch_2.add_edge_port(port_2, switch_1.dpid)
 
     def _handle_ConnectionUp(self, event):
         """
@@ -288,7 +706,7 @@ class Vlans(object):
         switch = self.switches.get(event.dpid)
         if switch is None:
             # New switch
-            switch = Switch(self.tenant)
+            switch = Switch(self.tenant, self.metrics, self.timeouts)
             self.switches[event.dpid] = switch
             switch.connect(event.connection, self.topo)
         else:
@@ -309,6 +727,7 @@ class Vlans(object):
             #log.debug("Should never happen please")
         else:
             switch.disconnect()
+            self.broadcast.forget_switch(event.dpid)
         #log.debug("switch " + dpid_to_str(event.dpid) + " down")
         # Bonus here
 
@@ -320,16 +739,31 @@ class Vlans(object):
         Args:
             event: The event
         """
+        switch = self.switches.get(event.dpid)
+        if switch is not None and switch.metrics is not None:
+            switch.metrics.port_status += 1
         if event.added:
             action = "added"
         elif event.deleted:
             action = "removed"
         else:
             action = "modified"
-        print "Port %s on Switch %s has been %s." % (event.port, event.dpid, action)
+        log.debug("Port %s on Switch %s has been %s.", event.port, event.dpid, action)
+
+    def _handle_FlowRemoved(self, event):
+        """
+        Accounts the final counters of a removed flow.
+
+        Args:
+            event: The event
+        """
+        if self.accounting is not None:
+            self.accounting.flow_removed(event.dpid, event.ofp)
 
 
-def launch(nCore=2, nEdge=3, nHosts=3, bw=10, n_vlans=4):
+def launch(nCore=2, nEdge=3, nHosts=3, bw=10, n_vlans=4, status_port=8080,
+           profile=False, profile_sample=1, snapshot=None, snapshot_interval=10, topo=None,
+           tune_timeouts=False, accounting=False):
     """
     Launch the POX Controller.
 
@@ -339,7 +773,34 @@ def launch(nCore=2, nEdge=3, nHosts=3, bw=10, n_vlans=4):
         nHosts: The number of hosts per edge
         bw: The bandwidth of each link
         n_vlans: The number of vlans id
+        status_port: The port serving the convergence state, 0 to disable
+        profile: Profile the packet-in and stats handlers, writing the
+                 reports to this directory (the current one if no value
+                 or True is given, False or 0 disable it) when
+                 /profile/dump is requested
+        profile_sample: Profile one handler call out of profile_sample
+        snapshot: The file in which the learned state is saved, and from
+                  which it is restored at start
+        snapshot_interval: The time between two snapshots in seconds
+        topo: A topology description written by closdesc.py, which then
+              overrides nCore, nEdge, nHosts and bw
+        tune_timeouts: Give the flows timeouts tuned to the packet-in rate
+                       and table occupancy, instead of permanent flows
+        accounting: Ask for the removal of every flow, and account its final
+                    counters per pair of hosts and per tenant on /accounting.
+                    Permanent flows are never removed, so the flows then get
+                    the initial tuned timeouts, even without tune_timeouts
+    returns:
+        The controller, for the shard workers
     """
+    if topo:
+        (nCore, nEdge, nHosts, bw) = ClosDescription.load(topo).params()
     tenant = Tenant(int(n_vlans), int(nCore))
-    core.registerNew(Vlans, tenant, nCore=int(nCore),
-                     nEdge=int(nEdge), nHosts=int(nHosts), bw=int(bw))
+    vlans = core.registerNew(Vlans, tenant, nCore=int(nCore),
+                             nEdge=int(nEdge), nHosts=int(nHosts), bw=int(bw),
+                             tune_timeouts=str_to_bool(tune_timeouts),
+                             accounting=str_to_bool(accounting))
+    profiler = profile_handlers(Switch, profile, profile_sample)
+    vlans.status_server = serve_status(vlans, int(status_port), profiler)
+    snapshot_controller(vlans, snapshot, snapshot_interval)
+    return vlans
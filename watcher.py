@@ -2,36 +2,167 @@ from pox.core import core
 from pox.lib.util import dpid_to_str
 from pox.openflow.discovery import Discovery
 import pox.openflow.libopenflow_01 as of
+from pox.lib.revent import *
+from closdesc import ClosDescription
 
 log = core.getLogger()
 
 
-class MyComponent (object):
-    def __init__(self):
+class TopologyDiff(Event):
+    """Raised with the links added and removed since the previous diff.
+
+    Links are (dpid1, port1, dpid2, port2) tuples, one per direction as
+    discovered by openflow_discovery.
+    """
+
+    def __init__(self, added, removed):
+        Event.__init__(self)
+        self.added = added
+        self.removed = removed
+
+
+class TopologyWatcher(EventMixin):
+    """Topology state service kept up to date from discovery events.
+
+    Every link and port is indexed by switch, so that each event only
+    updates its own entries and the queries do not walk the whole graph.
+    The changes made during one turn of the event loop are published
+    together as a TopologyDiff.
+
+    Args:
+        nCore: The number of core switch
+        nEdge: The number of edge switch
+        nHosts: The number of hosts per edge
+        bw: The bandwidth of each link
+    """
+    _eventMixin_events = set([TopologyDiff])
+
+    def __init__(self, nCore=2, nEdge=3, nHosts=3, bw=10):
+        topo = ClosDescription(nCore, nEdge, nHosts, bw)
+        self.ports = {}  # dpid -> {port: (dpid, port) at the other end}
+        self.connected = set()
+        self.expected_switches = len(topo.switches())
+        # Number of discovered links of each pair of switches linked in
+        # the topology, and number of such pairs without any link
+        self.pair_links = {}
+        for (n1, n2) in topo.links():
+            if topo.isSwitch(n1) and topo.isSwitch(n2):
+                self.pair_links[frozenset((int(n1[1:]), int(n2[1:])))] = 0
+        self.missing = len(self.pair_links)
+        self._added = []
+        self._removed = []
+
         def startup():
             core.openflow.addListeners(self)
             core.openflow_discovery.addListeners(self)
-        core.call_when_ready(startup, ('openflow','openflow_discovery'))
+        core.call_when_ready(startup, ('openflow', 'openflow_discovery'))
         log.debug("init over")
 
+    def links_of(self, dpid):
+        """Returns the links of a switch as a dict port -> (dpid, port).
+
+        The dict is the index itself and must not be modified.
+
+        Args:
+            dpid: The DPID of the switch
+        """
+        return self.ports.get(dpid, {})
+
+    def peer(self, dpid, port):
+        """Returns the (dpid, port) linked to a port, or None for a host port.
+
+        Args:
+            dpid: The DPID of the switch
+            port: The port of the switch
+        """
+        return self.ports.get(dpid, {}).get(port)
+
+    def is_complete(self):
+        """Returns true if every switch and switch link of the topology is up."""
+        return (self.missing == 0 and
+                len(self.connected) >= self.expected_switches)
+
+    def snapshot(self):
+        """Returns the discovered links as a list of tuples."""
+        return [(dpid1, port1, dpid2, port2)
+                for (dpid1, ports) in self.ports.items()
+                for (port1, (dpid2, port2)) in ports.items()]
+
+    def _add(self, dpid1, port1, dpid2, port2):
+        ports = self.ports.setdefault(dpid1, {})
+        if ports.get(port1) == (dpid2, port2):
+            return
+        if port1 in ports:
+            self._remove(dpid1, port1)
+        ports[port1] = (dpid2, port2)
+        self._count(dpid1, dpid2, 1)
+        self._publish(self._added, (dpid1, port1, dpid2, port2))
+
+    def _remove(self, dpid1, port1, both=False):
+        peer = self.ports.get(dpid1, {}).pop(port1, None)
+        if peer is None:
+            return
+        self._count(dpid1, peer[0], -1)
+        self._publish(self._removed, (dpid1, port1) + peer)
+        if both and self.peer(*peer) == (dpid1, port1):
+            self._remove(*peer)
+
+    def _count(self, dpid1, dpid2, delta):
+        """Updates the links of a pair and the number of missing pairs."""
+        pair = frozenset((dpid1, dpid2))
+        count = self.pair_links.get(pair)
+        if count is None:
+            return
+        self.pair_links[pair] = count + delta
+        if count == 0:
+            self.missing -= 1
+        elif count + delta == 0:
+            self.missing += 1
+
+    def _publish(self, changes, link):
+        """Queues a change, the diff is raised once per event loop turn."""
+        if not self._added and not self._removed:
+            core.callLater(self._flush)
+        changes.append(link)
+
+    def _flush(self):
+        added = set(self._added)
+        removed = set(self._removed)
+        self._added = []
+        self._removed = []
+        # A link removed then added again in the same turn did not change
+        both = added & removed
+        added = tuple(added - both)
+        removed = tuple(removed - both)
+        if added or removed:
+            log.debug("Topology diff: +%s -%s", added, removed)
+            self.raiseEvent(TopologyDiff, added, removed)
+
     def _handle_LinkEvent(self, event):
         """
         When link changes for example -> link h1 s3 hold_down
         """
         l = event.link
-        sw1 = l.dpid1
-        sw2 = l.dpid2
-        pt1 = l.port1
-        pt2 = l.port2
-
-        log.debug(core.openflow_discovery.adjacency)
+        if event.added:
+            self._add(l.dpid1, l.port1, l.dpid2, l.port2)
+        elif event.removed:
+            self._remove(l.dpid1, l.port1)
 
     def _handle_ConnectionUp(self, event):
         """
         here's a very simple POX component that listens to ConnectionUp events from all switches, and logs a message when one occurs.
         """
+        self.connected.add(event.dpid)
         log.debug("Switch %s has come up.", dpid_to_str(event.dpid))
-        log.debug("Switch %s has come up.", event.dpid)
+
+    def _handle_ConnectionDown(self, event):
+        """
+        Forgets the links of a switch that went down.
+        """
+        self.connected.discard(event.dpid)
+        for port in list(self.links_of(event.dpid)):
+            self._remove(event.dpid, port, both=True)
+        log.debug("Switch %s has gone down.", dpid_to_str(event.dpid))
 
     def _handle_PortStatus(self, event):
         """
@@ -42,10 +173,15 @@ class MyComponent (object):
             action = "added"
         elif event.deleted:
             action = "removed"
+            self._remove(event.dpid, event.port, both=True)
         else:
             action = "modified"
-        print "Port %s on Switch %s has been %s." % (event.port, event.dpid, action)
+            if event.ofp.desc.state & of.OFPPS_LINK_DOWN:
+                self._remove(event.dpid, event.port, both=True)
+        log.debug("Port %s on Switch %s has been %s.", event.port, event.dpid, action)
 
 
-def launch():
-    core.registerNew(MyComponent)
+def launch(nCore=2, nEdge=3, nHosts=3, bw=10, topo=None):
+    if topo:
+        (nCore, nEdge, nHosts, bw) = ClosDescription.load(topo).params()
+    core.registerNew(TopologyWatcher, int(nCore), int(nEdge), int(nHosts), int(bw))